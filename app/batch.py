@@ -0,0 +1,288 @@
+"""
+Davkovy (batch) prepocet davek pro cely archiv pacientu bez GUI.
+
+Kazdy pacient ma vlastni slozku s peti DICOM akvizicemi (1 h, 4-6 h, 24 h, 48 h, 144 h)
+a souborem `dosithyroid.json` (primo ve slozce nebo v podslozce `dosithyroid_output`)
+se vstupy, ktere se jinak zadavaji v GUI. GUI tento soubor uklada do `dosithyroid_output`
+pri vyhodnoceni a vypoctu davky (save_patient_inputs):
+
+    {
+        "podana_aktivita": 550.0,             # MBq v okamziku podani, nebo:
+        "aktivita": 600.0,                    # MBq ke dni kalibrace aktivity
+        "datum_aktivity": "30.05.2025 12:00", # (prepocet premenovym zakonem)
+        "datum_podani": "01.06.2025 08:00",
+        "objem_organu": 20.0,                 # ml
+        "spect_uptake": 0,                    # % (volitelne)
+        "typ_korekce": "ACSC",                # volitelne
+        "ant_roi": [[x, y], ...],             # body polygonu nebo cesta k .npy masce
+        "pos_roi": [[x, y], ...],             # (nebo mape oblasti)
+        "oblast": "Right lobe",               # vyhodnocovana oblast mapy ROI (volitelne)
+        "dt_korekce": true,                   # dalsi volitelne kroky zpracovani
+        "dt_sigma": null,                     # (viz DosimetryPipeline)
+        "zarovnani": ["ant", "pos"],
+        "metoda_zarovnani": "fft",
+        "md_data": {...},                     # tabulky mrtvych dob a kalibrace
+        "kal_data": {...}                     # (prepisuji je volby --md-data/--kal-data)
+    }
+
+Cesty k .npy jsou relativni ke slozce pacienta.
+
+Spusteni:
+    python -m app.batch <archiv> -o vysledky.csv [-j pocet_procesu] [--kal-data kal.json]
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from app.functions import najdi_akvizice, premenovy_zakon
+from app.pipeline import DosimetryPipeline
+
+# Nazev souboru se vstupy pacienta
+PATIENT_FILE = "dosithyroid.json"
+
+# Pocet akvizic pacienta (1 h, 4-6 h, 24 h, 48 h, 144 h) - pipeline predpoklada
+# prave tyto sloty vcetne reference 24 h, stejne jako nacti_studii v GUI
+POCET_AKVIZIC = 5
+
+# Sloupce vystupniho CSV (jeden radek na pacienta)
+CSV_COLUMNS = [
+    "patient",
+    "status",
+    "typ_korekce",
+    "podana_aktivita",
+    "times_h",
+    "uptake",
+    "k_t",
+    "k_B",
+    "k_T",
+    "integral_riu",
+    "podil_f",
+    "eff_polocas",
+    "big_E",
+    "absorbovana_davka",
+    "error",
+]
+
+
+def _patient_file(folder):
+    # Vstupni soubor muze byt primo ve slozce nebo ve vystupni slozce GUI
+    for candidate in (
+        os.path.join(folder, PATIENT_FILE),
+        os.path.join(folder, "dosithyroid_output", PATIENT_FILE),
+    ):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def find_patient_folders(root):
+    """
+    Projde adresarovy strom `root` a vrati seznam slozek pacientu
+    (slozek obsahujicich soubor dosithyroid.json).
+    """
+    folders = []
+    for folder, dirs, _ in os.walk(root):
+        # Vystupni slozky GUI nejsou samostatni pacienti
+        dirs[:] = sorted(d for d in dirs if d != "dosithyroid_output")
+        if _patient_file(folder) is not None:
+            folders.append(folder)
+    return folders
+
+
+def _load_roi(value, folder):
+    # ROI je bud seznam bodu polygonu, nebo cesta k ulozene binarni masce (.npy)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.load(os.path.join(folder, value))
+    return [tuple(point) for point in value]
+
+
+def save_patient_inputs(folder, vstupy, ant_roi=None, pos_roi=None):
+    """
+    Ulozi vstupy pacienta z GUI do `folder`/dosithyroid_output/dosithyroid.json
+    ve formatu, ktery cte process_patient. ROI (masky, mapy oblasti nebo ploche
+    indexy) se ulozi jako .npy vedle souboru, v JSON jsou cesty relativni ke slozce
+    pacienta `folder`; ROI None se zapise jako null.
+    Vraci cestu k ulozenemu souboru.
+    """
+    try:
+        output_folder = os.path.join(folder, "dosithyroid_output")
+        os.makedirs(output_folder, exist_ok=True)
+
+        vstupy = dict(vstupy)
+        for key, roi in (("ant_roi", ant_roi), ("pos_roi", pos_roi)):
+            vstupy[key] = None
+            if roi is not None:
+                np.save(os.path.join(output_folder, f"{key}.npy"), np.asarray(roi))
+                vstupy[key] = f"dosithyroid_output/{key}.npy"
+
+        path = os.path.join(output_folder, PATIENT_FILE)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(vstupy, f, indent=4, ensure_ascii=False)
+        return path
+
+    except Exception as e:
+        print(f"Error saving patient inputs: {e}")
+        raise Exception(f"Error saving patient inputs: {e}")
+
+
+def process_patient(folder, md_data=None, kal_data=None, typ_korekce=None):
+    """
+    Spocita davku pro jednoho pacienta a vrati jeden radek vysledku (slovnik).
+    Chyby se nepropaguji - zapisou se do sloupce 'error', aby jeden vadny pacient
+    nezastavil prepocet celeho archivu.
+    """
+    row = {"patient": folder, "status": "error"}
+    try:
+        with open(_patient_file(folder), encoding="utf-8") as f:
+            vstupy = json.load(f)
+
+        # Podana aktivita - primo, nebo prepocet z kalibrovane aktivity
+        if "podana_aktivita" in vstupy:
+            podana_aktivita = float(vstupy["podana_aktivita"])
+        else:
+            date_format = "%d.%m.%Y %H:%M"
+            podana_aktivita = premenovy_zakon(
+                float(vstupy["aktivita"]),
+                datetime.strptime(vstupy["datum_aktivity"], date_format),
+                datetime.strptime(vstupy["datum_podani"], date_format),
+            )
+
+        # Jina sada akvizic by se tise priradila do spatnych casovych slotu
+        paths = najdi_akvizice(folder)
+        if len(paths) != POCET_AKVIZIC:
+            raise ValueError(
+                f"expected {POCET_AKVIZIC} DICOM acquisitions, found {len(paths)}"
+            )
+
+        typ = typ_korekce or vstupy.get("typ_korekce", "ACSC")
+        results = DosimetryPipeline(
+            dicom_paths=paths,
+            ant_roi=_load_roi(vstupy["ant_roi"], folder),
+            pos_roi=_load_roi(vstupy["pos_roi"], folder),
+            podana_aktivita=podana_aktivita,
+            datum_podani=vstupy["datum_podani"],
+            objem_organu=vstupy["objem_organu"],
+            md_data=md_data if md_data is not None else vstupy.get("md_data"),
+            kal_data=kal_data if kal_data is not None else vstupy.get("kal_data"),
+            typ_korekce=typ,
+            spect_uptake=vstupy.get("spect_uptake", 0),
+            dt_korekce=vstupy.get("dt_korekce", True),
+            dt_sigma=vstupy.get("dt_sigma"),
+            zarovnani=vstupy.get("zarovnani", True),
+            metoda_zarovnani=vstupy.get("metoda_zarovnani", "fft"),
+            oblast=vstupy.get("oblast"),
+        ).run()
+
+        k_t, k_B, k_T = results["riu_params"]
+        row.update(
+            {
+                "status": "ok",
+                "typ_korekce": typ,
+                "podana_aktivita": podana_aktivita,
+                "times_h": " ".join(f"{t:.3f}" for t in results["times"]),
+                "uptake": " ".join(f"{u:.6f}" for u in results["uptake"]),
+                "k_t": k_t,
+                "k_B": k_B,
+                "k_T": k_T,
+                "integral_riu": results["integral_riu"],
+                "podil_f": results["podil_f"],
+                "eff_polocas": results["eff_polocas"],
+                "big_E": results["big_E"],
+                "absorbovana_davka": results["absorbovana_davka"],
+            }
+        )
+
+    except Exception as e:
+        row["error"] = str(e)
+
+    return row
+
+
+def run_batch(
+    root, output_csv, workers=None, md_data=None, kal_data=None, typ_korekce=None
+):
+    """
+    Prepocita vsechny pacienty v archivu `root` paralelne v ProcessPoolExecutoru
+    (standardne tolik procesu, kolik ma pocitac jader) a zapise vysledky do CSV.
+    Vraci seznam radku ve stejnem poradi jako slozky pacientu.
+    """
+    folders = find_patient_folders(root)
+    workers = workers or os.cpu_count() or 1
+
+    rows = []
+    if folders:
+        with ProcessPoolExecutor(max_workers=min(workers, len(folders))) as executor:
+            n = len(folders)
+            rows = list(
+                executor.map(
+                    process_patient,
+                    folders,
+                    [md_data] * n,
+                    [kal_data] * n,
+                    [typ_korekce] * n,
+                )
+            )
+
+    with open(output_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return rows
+
+
+def _load_json(path):
+    if path is None:
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Batch dosimetry of a whole patient archive (no GUI)."
+    )
+    parser.add_argument("root", help="root directory of the patient archive")
+    parser.add_argument(
+        "-o", "--output", default="dosithyroid_batch.csv", help="output CSV file"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--correction",
+        choices=["ACSC", "SC", "AC", "No corr"],
+        default=None,
+        help="override the type of correction for all patients",
+    )
+    parser.add_argument("--kal-data", help="JSON file with calibration factors")
+    parser.add_argument("--md-data", help="JSON file with dead time values")
+    args = parser.parse_args(argv)
+
+    rows = run_batch(
+        args.root,
+        args.output,
+        workers=args.workers,
+        md_data=_load_json(args.md_data),
+        kal_data=_load_json(args.kal_data),
+        typ_korekce=args.correction,
+    )
+
+    failed = [row for row in rows if row["status"] != "ok"]
+    print(f"Processed {len(rows)} patients, {len(failed)} failed -> {args.output}")
+    for row in failed:
+        print(f"  {row['patient']}: {row['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
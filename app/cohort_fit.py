@@ -0,0 +1,224 @@
+"""
+Hromadny (populacni) fit RIU krivek pro retrospektivni kohorty.
+
+Misto fitu jednoho pacienta po druhem (riu_fit) se Levenberg-Marquardtovy kroky
+pocitaji najednou nad poli (pacient x casovy bod): rezidua, analyticka Jacobiho
+matice (riu_jacobian) i normalni rovnice 3 x 3 vsech pacientu jsou jedna numpy
+operace, takze kohorta o desitkach tisic pacientu se nafituje v radu sekund.
+Vahovani, chyby parametru a kovariance odpovidaji riu_fit.
+
+Spusteni nad vystupem davkoveho prepoctu (sloupce 'times_h' a 'uptake'):
+    python -m app.cohort_fit dosithyroid_batch.csv -o riu_fit.csv
+"""
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+from app.functions import riu_uptace_fce, riu_jacobian, riu_initial_params
+
+# Sloupce vystupniho CSV (jeden radek na pacienta)
+CSV_COLUMNS = [
+    "patient",
+    "k_t",
+    "k_B",
+    "k_T",
+    "k_t_err",
+    "k_B_err",
+    "k_T_err",
+    "converged",
+]
+
+
+def _residuals(cas_h, riu_values, weights, params):
+    # Vazena rezidua (pacient x casovy bod) pro parametry (pacient x 3)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        model = riu_uptace_fce(cas_h, *(params[:, i, None] for i in range(3)))
+    return weights * (model - riu_values)
+
+
+def _jacobian(cas_h, weights, params):
+    # Vazena Jacobiho matice (pacient x casovy bod x parametr)
+    jac = riu_jacobian(cas_h, *(params[:, i, None] for i in range(3)))
+    return weights[:, :, None] * jac
+
+
+def fit_riu_cohort(cas_h, riu_values, y_err=None, max_iter=200, tol=1e-10):
+    """
+    Fit riu_uptace_fce pro vsechny pacienty najednou (Levenberg-Marquardt).
+
+    - cas_h: casy v hodinach, pole (pacient x casovy bod) nebo spolecne (casovy bod,)
+    - riu_values: namerene hodnoty RIU (pacient x casovy bod)
+    - y_err: volitelne nejistoty hodnot (vahy 1 / y_err^2 jako v riu_fit)
+
+    Vraci (parametry (pacient x 3), chyby parametru (pacient x 3),
+    kovariance (pacient x 3 x 3), priznak konvergence (pacient,)).
+    Radky s neplatnymi daty nebo bez konvergence maji priznak False.
+    """
+    try:
+        riu_values = np.asarray(riu_values, dtype=np.float64)
+        if riu_values.ndim != 2 or riu_values.shape[1] < 3:
+            raise ValueError(
+                "uptake must be a (patients x timepoints) array with at least 3 "
+                f"timepoints, got shape {riu_values.shape}"
+            )
+        cas_h = np.broadcast_to(
+            np.asarray(cas_h, dtype=np.float64), riu_values.shape
+        ).copy()
+        N, M = riu_values.shape
+
+        if y_err is not None:
+            y_err = np.broadcast_to(np.asarray(y_err, dtype=np.float64), (N, M))
+            # Nulove nejistoty nahradi nejmensi kladnou nejistotou pacienta (jako riu_fit)
+            minimum = np.min(
+                np.where(y_err > 0, y_err, np.inf), axis=1, keepdims=True
+            )
+            y_err = np.where(y_err == 0, minimum, y_err)
+            weights = (1 / y_err) ** 2
+        else:
+            weights = np.ones((N, M))
+
+        # Radky s NaN, nekonecny nebo bez platnych vah se nefituji
+        valid = np.all(np.isfinite(cas_h) & np.isfinite(riu_values), axis=1)
+        valid &= np.all(np.isfinite(weights) & (weights > 0), axis=1)
+        riu_values = np.where(valid[:, None], riu_values, 0.0)
+        cas_h = np.where(valid[:, None], cas_h, 0.0)
+        weights = np.where(valid[:, None], weights, 1.0)
+
+        params = riu_initial_params(cas_h, riu_values)
+        cost = np.sum(_residuals(cas_h, riu_values, weights, params) ** 2, axis=1)
+        damping = np.full(N, 1e-3)
+        converged = ~valid
+        active = np.flatnonzero(valid)
+
+        for _ in range(max_iter):
+            if not active.size:
+                break
+            t, y = cas_h[active], riu_values[active]
+            w, p = weights[active], params[active]
+
+            # Normalni rovnice (J^T J + lambda * diag(J^T J)) delta = -J^T r vsech pacientu
+            r = _residuals(t, y, w, p)
+            jac = _jacobian(t, w, p)
+            jtj = np.einsum("nmi,nmj->nij", jac, jac)
+            gradient = np.einsum("nmi,nm->ni", jac, r)
+            diagonal = np.einsum("nii->ni", jtj)
+            system = jtj + (damping[active, None] * diagonal)[:, :, None] * np.eye(3)
+            with np.errstate(invalid="ignore"):
+                try:
+                    delta = np.linalg.solve(system, -gradient[:, :, None])[:, :, 0]
+                except np.linalg.LinAlgError:
+                    # Singularni soustava u nektereho pacienta - reseni po jednom
+                    delta = np.stack(
+                        [
+                            np.linalg.lstsq(a, -b, rcond=None)[0]
+                            for a, b in zip(system, gradient)
+                        ]
+                    )
+
+            # Krok se prijme jen tam, kde snizi chi^2; jinak se zvysi tlumeni
+            candidate = p + delta
+            new_cost = np.sum(_residuals(t, y, w, candidate) ** 2, axis=1)
+            improved = np.isfinite(new_cost) & (new_cost <= cost[active])
+            accepted = active[improved]
+            params[accepted] = candidate[improved]
+            reduction = cost[accepted] - new_cost[improved]
+            cost[accepted] = new_cost[improved]
+            damping[accepted] = np.maximum(damping[accepted] / 10, 1e-12)
+            damping[active[~improved]] *= 10
+
+            # Konvergence: maly krok, maly relativni pokles chi^2 nebo nulova rezidua
+            step_small = np.linalg.norm(delta[improved], axis=1) <= tol * (
+                np.linalg.norm(candidate[improved], axis=1) + tol
+            )
+            cost_small = reduction <= tol * np.maximum(cost[accepted], 1e-300)
+            done = accepted[(step_small | cost_small) | (cost[accepted] == 0)]
+            converged[done] = True
+
+            # Radky s tlumenim bez uspesneho kroku uz nekonverguji
+            stuck = active[~improved][damping[active[~improved]] > 1e16]
+            active = active[~np.isin(active, np.concatenate((done, stuck)))]
+
+        converged &= valid
+
+        # Kovariance z Jacobiho matice v optimu skalovana redukovanym chi^2 (jako riu_fit)
+        jac = _jacobian(cas_h, weights, params)
+        jtj = np.einsum("nmi,nmj->nij", jac, jac)
+        covar = np.linalg.pinv(jtj)
+        nfree = M - 3
+        if nfree > 0:
+            covar *= (cost / nfree)[:, None, None]
+        errors = np.sqrt(np.abs(np.einsum("nii->ni", covar)))
+
+        params[~valid] = np.nan
+        errors[~valid] = np.nan
+        covar[~valid] = np.nan
+        converged &= np.all(np.isfinite(params), axis=1)
+        return params, errors, covar, converged
+
+    except Exception as e:
+        print(f"Error in cohort RIU fit: {e}")
+        raise Exception(f"Error in cohort RIU fit: {e}")
+
+
+def read_uptake_csv(path):
+    """
+    Nacte casy a uptake pacientu z CSV davkoveho prepoctu (app.batch). Radky bez dat
+    (chybni pacienti) se preskoci. Vraci (pacienti, casy, uptake) - pole maji tvar
+    (pacient x casovy bod).
+    """
+    patients, times, uptake = [], [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if not row.get("times_h") or not row.get("uptake"):
+                continue
+            patients.append(row["patient"])
+            times.append([float(v) for v in row["times_h"].split()])
+            uptake.append([float(v) for v in row["uptake"].split()])
+    return patients, np.array(times), np.array(uptake)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Population RIU fit of a whole cohort from a batch results CSV."
+    )
+    parser.add_argument("input", help="CSV with 'times_h' and 'uptake' columns")
+    parser.add_argument(
+        "-o", "--output", default="dosithyroid_riu_fit.csv", help="output CSV file"
+    )
+    args = parser.parse_args(argv)
+
+    patients, times, uptake = read_uptake_csv(args.input)
+    if not patients:
+        print(f"No uptake series found in {args.input}")
+        return 1
+    params, errors, _, converged = fit_riu_cohort(times, uptake)
+
+    with open(args.output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for patient, p, e, ok in zip(patients, params, errors, converged):
+            writer.writerow(
+                {
+                    "patient": patient,
+                    "k_t": p[0],
+                    "k_B": p[1],
+                    "k_T": p[2],
+                    "k_t_err": e[0],
+                    "k_B_err": e[1],
+                    "k_T_err": e[2],
+                    "converged": bool(ok),
+                }
+            )
+
+    print(
+        f"Fitted {len(patients)} patients, {int((~converged).sum())} not converged "
+        f"-> {args.output}"
+    )
+    return 0 if converged.all() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Diskova cache dekodovanych snimku.
+
+Dekodovana okna jednoho DICOM souboru (pole okno x H x W v WORK_DTYPE) se ulozi
+jako `<SOPInstanceUID>.npy` spolu s metadaty akvizice v `<SOPInstanceUID>.json`.
+Klicem je SOP Instance UID, takze stejny snimek se najde i po presunuti nebo
+prejmenovani souboru. Pri opakovanem otevreni studie se okna nacitaji
+pres np.load(mmap_mode="r") bez dekodovani. Celkova velikost cache je omezena,
+pri prekroceni se mazou nejdele nepouzite zaznamy (LRU podle casu posledniho pouziti).
+Uklid je chraneny zamkem (put vola vice vlaken nacti_studii najednou) a snasi
+zaznamy smazane mezitim jinym procesem i soubory, ktere nejdou smazat, protoze
+je ma namapovane nacteny snimek (Windows) - ty zustanou do pristiho uklidu.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+import pydicom
+
+from app.functions import dicom_image, WORK_DTYPE
+
+# Vychozi umisteni cache (lze zmenit promennou prostredi DOSITHYROID_CACHE)
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DOSITHYROID_CACHE",
+    os.path.join(os.path.expanduser("~"), ".dosithyroid", "frame_cache"),
+)
+
+# Vychozi maximalni velikost cache (B)
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+class FrameCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # uklid z vice vlaken najednou
+
+    def _paths(self, uid):
+        # Cesty k souboru se snimky a k souboru s metadaty pro dane UID
+        base = os.path.join(self.directory, str(uid))
+        return base + ".npy", base + ".json"
+
+    def get(self, uid):
+        """
+        Vrati (frames, metadata) pro snimek s danym SOP Instance UID, nebo None.
+        Snimky jsou pole jen pro cteni namapovane ze souboru cache.
+        """
+        frames_path, meta_path = self._paths(uid)
+        if not (os.path.isfile(frames_path) and os.path.isfile(meta_path)):
+            return None
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                metadata = json.load(f)
+            frames = np.load(frames_path, mmap_mode="r")
+        except (OSError, ValueError):
+            # Poskozeny zaznam se chova jako chybejici
+            return None
+
+        # Zaznam byl prave pouzit - posun v poradi LRU
+        os.utime(frames_path)
+        return frames, metadata
+
+    def put(self, uid, frames, metadata):
+        """
+        Ulozi okna snimku a metadata pod dane SOP Instance UID a v pripade potreby
+        uvolni misto smazanim nejdele nepouzitych zaznamu.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            frames_path, meta_path = self._paths(uid)
+
+            # Zapis pres docasny soubor, aby soubezne cteni nikdy nevidelo polovicni zaznam
+            tmp_path = frames_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.asarray(frames, dtype=WORK_DTYPE))
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, frames_path)
+
+            self.evict()
+
+        except Exception as e:
+            print(f"Error writing frame cache: {e}")
+            raise Exception(f"Error writing frame cache: {e}")
+
+    def size(self):
+        # Celkova velikost zaznamu v cache (B)
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        # Seznam (cas posledniho pouziti, velikost, UID) vsech zaznamu
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # zaznam mezitim smazal jiny uklid
+            entries.append((stat.st_mtime, stat.st_size, name[: -len(".npy")]))
+        return entries
+
+    def evict(self):
+        """
+        Smaze nejdele nepouzite zaznamy, dokud celkova velikost neklesne pod max_bytes.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, uid in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(uid):
+                    total -= size
+
+    def _remove(self, uid):
+        # Smaze zaznam; False, pokud soubor se snimky nejde smazat (je namapovany
+        # nactenym snimkem) - zaznam pak zustane cely vcetne metadat
+        frames_path, meta_path = self._paths(uid)
+        try:
+            os.remove(frames_path)
+        except FileNotFoundError:
+            pass  # smazal ho soubezny uklid
+        except PermissionError:
+            return False
+        try:
+            os.remove(meta_path)
+        except (FileNotFoundError, PermissionError):
+            pass
+        return True
+
+    def load_image(self, dicom_path):
+        """
+        Nacte snimek `dicom_path` jako dicom_image. Pri shode SOP Instance UID se okna
+        vezmou z cache bez dekodovani, jinak se soubor dekoduje a ulozi do cache.
+        Nekomprimovana data se do cache neukladaji - ta se mapuji primo ze souboru.
+        """
+        try:
+            header = pydicom.dcmread(dicom_path, stop_before_pixels=True)
+            uid = header.SOPInstanceUID
+            image = dicom_image()
+
+            cached = self.get(uid)
+            if cached is not None:
+                image.frames, metadata = cached
+                image.acq_date = metadata["acq_date"]
+                image.acq_time = metadata["acq_time"]
+                image.acq_dur = metadata["acq_dur"]
+                image.energy_windows = metadata.get("energy_windows")
+                print(f"Loaded DICOM file from cache: {dicom_path}")
+                return image
+
+            image.load_header(dicom_path)
+            if not image.is_memory_mapped:
+                self.put(
+                    uid,
+                    image.frames,
+                    {
+                        "acq_date": str(image.acq_date),
+                        "acq_time": str(image.acq_time),
+                        "acq_dur": float(image.acq_dur),
+                        "energy_windows": image.energy_windows,
+                        "source": os.path.abspath(dicom_path),
+                    },
+                )
+            return image
+
+        except Exception as e:
+            print(f"Error loading DICOM file through cache: {e}")
+            raise Exception(f"Error loading DICOM file through cache: {e}")
@@ -1,75 +1,443 @@
 import pydicom
 import numpy as np
 from PIL import Image, ImageTk, ImageDraw
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import binary_dilation, gaussian_filter, shift as ndimage_shift
 from scipy.signal import fftconvolve
+import scipy.fft
 from matplotlib.widgets import PolygonSelector
-from matplotlib.path import Path
-from matplotlib.patches import Circle, Polygon
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Polygon
 import matplotlib.pyplot as plt
 import locale
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from lmfit import Model
+from functools import lru_cache
+from scipy.special import lambertw
+from scipy.optimize import least_squares
+
+from app.tasks import TaskCancelled
+from app.tiac import riu_integral
+
+
+# Vychozi hodnoty mrtve doby kamery (s) pro jednotliva okna - FNKV GE Optima NM/CT 640
+MD_DATA_OPTIMA_640 = {
+    "ant_pw": 1.2278225074520933e-05,
+    "ant_usw": 7.523878532633466e-05,
+    "ant_lsw": 7.52862007849338e-05,
+    "pos_pw": 1.2120528337418146e-05,
+    "pos_usw": 5.7212768749137515e-05,
+    "pos_lsw": 5.6539578680391605e-05,
+}
+
+# Vychozi kalibracni faktory kamery (cps/MBq) pro jednotlive typy korekce - FNKV GE Optima NM/CT 640
+KAL_DATA_OPTIMA_640 = {"ACSC": 7.77, "SC": 13.30, "AC": 18.3, "No corr": 19.7}
+
+# Pozadovane davky (Gy), pro ktere se pocita planovana terapeuticka aktivita
+POZADOVANE_DAVKY = [150, 200, 250, 300, 350, 400]
+
+
+# Poradi oken v DICOM souboru a zaroven v ose oken studijniho zasobniku.
+# Sude indexy jsou anteriorni, liche posteriorni projekce.
+WINDOWS = ("ant_pw", "pos_pw", "ant_lsw", "pos_lsw", "ant_usw", "pos_usw")
+
+# Pracovni datovy typ snimku celeho zpracovani (okna dicom_image, zasobnik studie,
+# diskova cache). Korekce snimky preskaluji, proto float; float32 staci pro pocty
+# impulzu a oproti float64 zabira polovinu pameti. Soucty pres pixely (cetnosti)
+# se akumuluji ve float64.
+WORK_DTYPE = np.float32
+
+
+# Pocet urovni kvantizace nahledu: 16 urovni na jeden odstin sedi (255 * 16 + 1),
+# takze vychozi LUT dava presne stejny obraz jako prime skalovani 0-255
+PREVIEW_LUT_SIZE = 255 * 16 + 1
+
+
+@lru_cache(maxsize=32)
+def preview_lut(low=0.0, high=1.0):
+    """
+    8-bitova vyhledavaci tabulka (PREVIEW_LUT_SIZE,) pro okno/uroven nahledu.
+    Index i odpovida hodnote i / (PREVIEW_LUT_SIZE - 1) nasobku maxima snimku,
+    `low` a `high` jsou meze okna ve stejnych jednotkach (vychozi 0-1 = cely rozsah).
+    Tabulka je v cache, proto je jen pro cteni.
+    """
+    hodnoty = np.arange(PREVIEW_LUT_SIZE, dtype=np.float64) / (PREVIEW_LUT_SIZE - 1)
+    lut = np.clip((hodnoty - low) * (255.0 / (high - low)), 0, 255)
+    lut = np.floor(lut + 1e-9).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def _preview_indices(frame, maximum):
+    # Kvantizace okna na indexy LUT (uint16) - jedina pracovni alokace, zbytek in-place
+    scaled = np.multiply(frame, (PREVIEW_LUT_SIZE - 1) / maximum, dtype=WORK_DTYPE)
+    np.clip(scaled, 0, PREVIEW_LUT_SIZE - 1, out=scaled)
+    return scaled.astype(np.uint16)
+
+
+def energy_window_widths(dataset):
+    """
+    Sirky energetickych oken (keV) z Energy Window Information Sequence (0054,0012):
+    sirka = Upper (0054,0015) - Lower (0054,0014) limit z Energy Window Range Sequence
+    (0054,0013). Okna se k rovinam prirazuji podle Energy Window Vector (0054,0010),
+    bez nej se predpoklada poradi PW, LSW, USW (po dvou rovinach jako WINDOWS).
+    Vraci slovnik {okno: sirka}, nebo None, pokud hlavicka sirky oken neobsahuje.
+    """
+    try:
+        items = dataset.get((0x0054, 0x0012))
+        if items is None or not items.value:
+            return None
+        sirky = []
+        for item in items.value:
+            ranges = item[0x0054, 0x0013].value
+            sirky.append(
+                sum(
+                    float(r[0x0054, 0x0015].value) - float(r[0x0054, 0x0014].value)
+                    for r in ranges
+                )
+            )
+
+        vector = dataset.get((0x0054, 0x0010))
+        if vector is not None and len(vector.value) >= len(WINDOWS):
+            cisla = [int(n) for n in vector.value]
+        elif len(sirky) == len(WINDOWS) // 2:
+            cisla = [1 + i // 2 for i in range(len(WINDOWS))]
+        else:
+            return None
+        return {name: sirky[cislo - 1] for name, cislo in zip(WINDOWS, cisla)}
+
+    except (KeyError, IndexError, TypeError, ValueError):
+        # Neuplna nebo nestandardni sekvence - pouziji se vychozi sirky oken
+        return None
+
+
+def map_pixel_data(dicom_path, header):
+    """
+    Namapuje Pixel Data nekomprimovaneho DICOMu (little endian, 1 vzorek na pixel)
+    primo ze souboru pomoci np.memmap - bez kopie v RAM. `header` je hlavicka
+    nactena se stop_before_pixels. Vraci pole (rovina x H x W) jen pro cteni,
+    nebo None, pokud data namapovat nejdou (komprese, big endian, nestandardni bity).
+    """
+    transfer_syntax = header.file_meta.get("TransferSyntaxUID")
+    if (
+        transfer_syntax is None
+        or transfer_syntax.is_compressed
+        or transfer_syntax.is_deflated
+        or not transfer_syntax.is_little_endian
+    ):
+        return None
+
+    bits = int(header.BitsAllocated)
+    signed = int(header.get("PixelRepresentation", 0)) == 1
+    if (
+        bits not in (8, 16, 32)
+        or int(header.get("SamplesPerPixel", 1)) != 1
+        # Znamenkova data s mene ulozenymi bity je nutne rozsirit - to udela jen dekoder
+        or (signed and int(header.get("BitsStored", bits)) != bits)
+    ):
+        return None
+
+    # Pozice hodnoty elementu Pixel Data v souboru (element se nenacita, jen preskoci)
+    dataset = pydicom.dcmread(dicom_path, defer_size=1024)
+    element = dataset.get_item(0x7FE00010, keep_deferred=True)
+    offset = getattr(element, "value_tell", None)
+    if offset is None:
+        return None
+
+    n_frames = int(header.get("NumberOfFrames", 1) or 1)
+    shape = (n_frames, int(header.Rows), int(header.Columns))
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+    if element.length < np.prod(shape) * dtype.itemsize:
+        return None
+    return np.memmap(dicom_path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def _window_property(index, doc):
+    # Vytvori property, ktera je pohledem na jedno okno v poli `frames`
+    def getter(self):
+        return self._frame(index)
+
+    def setter(self, value):
+        self._set_window(index, value)
+
+    return property(getter, setter, doc=doc)
+
+
+def _max_property(index, doc):
+    # Maximum okna pro kontrastni normalizaci nahledu - u odlozeneho nacteni se spocita
+    # az pri prvnim pouziti (prazdny obraz ma maximum 1, aby se nedelilo nulou)
+    def getter(self):
+        if index not in self._max:
+            frame = self._frame(index)
+            if frame is None:
+                return None
+            maximum = np.max(frame)
+            self._max[index] = 1 if maximum == 0 else maximum
+        return self._max[index]
+
+    def setter(self, value):
+        self._max[index] = value
+
+    return property(getter, setter, doc=doc)
+
+
+# Okna, jejichz nahledy se skaluji na maximum projekce (ostatni okna se zobrazuji primo)
+_PREVIEW_MAX = {"ant_pw": "ant_max", "pos_pw": "pos_max"}
 
 
 class dicom_image:
+    # Planarni obrazky pro ruzne okna a projekce (anterior/posterior).
+    # Nejsou to samostatna pole, ale pohledy do spolecneho pole `frames` (okno x H x W),
+    # ktere muze byt samo pohledem do zasobniku cele studie (study_stack).
+    ant_pw = _window_property(0, "Anteriorni obraz z hlavniho energetickeho okna (PW)")
+    pos_pw = _window_property(1, "Posteriorni obraz z hlavniho energetickeho okna")
+    ant_lsw = _window_property(2, "Anteriorni obraz z dolniho scatter okna")
+    pos_lsw = _window_property(3, "Posteriorni obraz z dolniho scatter okna")
+    ant_usw = _window_property(4, "Anteriorni obraz z horniho scatter okna")
+    pos_usw = _window_property(5, "Posteriorni obraz z horniho scatter okna")
+
+    ant_max = _max_property(0, "Maximum anteriorniho PW obrazu")
+    pos_max = _max_property(1, "Maximum posteriorniho PW obrazu")
+
     def __init__(self):
         # Konstruktor tridy - inicializuje vsechny atributy na None.
         # Tyto atributy budou pozdeji obsahovat jednotlive planarni obrazky nebo metadata z DICOM souboru.
 
-        # Planarni obrazky pro ruzne okna a projekce (anterior/posterior)
-        self.ant_pw = (
-            None  # Anteriorni obraz z hlavniho energetickeho okna (photopeak window)
-        )
-        self.pos_pw = None  # Posteriorni obraz z hlavniho energetickeho okna
-        self.ant_lsw = None  # Anteriorni obraz z dolniho scatter okna
-        self.pos_lsw = None  # Posteriorni obraz z dolniho scatter okna
-        self.ant_usw = None  # Anteriorni obraz z horniho scatter okna
-        self.pos_usw = None  # Posteriorni obraz z horniho scatter okna
+        # Vsechna okna jednoho snimku v jednom poli (okno x H x W), poradi podle WINDOWS
+        self._frames = None
+        self._max = {}
+
+        # Pocitadlo zmen pixelovych dat (pri zmene se zahodi cache nahledu)
+        # a cache nahledu {okno: (verze, indexy LUT, {(velikost, okno LUT): obrazek})}
+        self._version = 0
+        self._preview = {}
+
+        # Odlozene dekodovani (load_header): cesta k souboru, pixely namapovane ze souboru
+        # (jen nekomprimovana data), pocet rovin v souboru, rozmer snimku
+        # a priznaky jiz dekodovanych oken (None = neni co dekodovat)
+        self._source = None
+        self._pixels = None
+        self._source_frames = 0
+        self._shape = None
+        self._decoded = None
+
+        # Zasobnik studie, do ktereho `frames` ukazuje (None = samostatny snimek)
+        self.study = None
 
         # Metadata k obrazum
         self.acq_date = None  # Datum akvizice
         self.acq_time = None  # Cas akvizice
         self.acq_dur = None  # Delka akvizice (pocet milisekund prevedeny na sekundy)
+        self.energy_windows = None  # Sirky energetickych oken {okno: keV}
 
         # ROI (region of interest) - budou se pozdeji pouzivat pro zakresleni
         self.ant_roi = None
         self.pos_roi = None
 
-    def load_dicom(self, dicom_path):
+        # Odlozeny (sub-pixelovy) posun projekci z zarovnani (shift_x, shift_y).
+        # Okna se neposouvaji, posun se uplatni az pri souctu v ROI a pri zobrazeni.
+        self.offsets = {"ant": (0.0, 0.0), "pos": (0.0, 0.0)}
+
+    @property
+    def frames(self):
+        # Pole vsech oken; pri odlozenem nacteni se dekoduji vsechna dosud nedekodovana okna
+        if self._decoded is not None:
+            self._decode(np.flatnonzero(~self._decoded))
+        return self._frames
+
+    @frames.setter
+    def frames(self, value):
+        self._frames = value
+        self._decoded = None
+        self._pixels = None
+        self.touch()
+
+    def touch(self):
+        # Oznaci zmenu pixelovych dat - nahledy se pri dalsim pouziti vykresli znovu
+        self._version += 1
+
+    def data_version(self, name):
+        """
+        Klic verze dat okna `name` pro cache nahledu: meni se pri kazdem zapisu do okna,
+        zmene zasobniku studie (korekce, zarovnani) i odlozeneho posunu projekce.
+        """
+        study_version = self.study.version if self.study is not None else 0
+        return (self._version, study_version, self.offsets.get(name[:3]))
+
+    @property
+    def is_loaded(self):
+        # True, pokud uz jsou dekodovana vsechna okna (nebo neni co dekodovat)
+        return self._decoded is None
+
+    @property
+    def is_memory_mapped(self):
+        # True, pokud se nedekodovana okna ctou primo z namapovaneho souboru
+        return self._pixels is not None
+
+    def _frame(self, index):
+        # Jedno okno; pri odlozenem nacteni se dekoduje az pri prvnim pristupu.
+        # Namapovana okna se vraci primo jako pohled do souboru (jen pro cteni).
+        if self._decoded is not None and not self._decoded[index]:
+            if self._pixels is not None and index < self._source_frames:
+                return self._pixels[index]
+            self._decode([index])
+        if self._frames is None:
+            return None
+        return self._frames[index]
+
+    def _decode(self, indices):
+        # Dekoduje zadana okna ze souboru - kazde okno jen jednou.
+        # Okna, ktera v souboru nejsou (DICOM jen s PW okny), se vyplni jednickami.
+        if self._frames is None:
+            self._frames = np.empty((len(WINDOWS),) + self._shape, dtype=WORK_DTYPE)
+
+        in_file = [i for i in indices if i < self._source_frames]
+        if self._pixels is not None:
+            # Namapovana data - jen kopie ze souboru, bez dekoderu
+            self._frames[in_file] = self._pixels[in_file]
+        elif len(in_file) == 1:
+            # Jedina rovina - dekoduje se jen ona (u nekomprimovanych dat se cte jen jeji cast souboru)
+            self._frames[in_file[0]] = pydicom.pixels.pixel_array(
+                self._source, index=int(in_file[0])
+            )
+        elif in_file:
+            # Vice rovin - jedno cteni souboru, dekoduji se jen zadane (dosud
+            # nedekodovane) roviny
+            for i, frame in zip(
+                in_file,
+                pydicom.pixels.iter_pixels(
+                    self._source, indices=[int(i) for i in in_file]
+                ),
+            ):
+                self._frames[i] = frame
+        for i in indices:
+            if i >= self._source_frames:
+                self._frames[i] = 1
+
+        self._decoded[list(indices)] = True
+        if self._decoded.all():
+            self._decoded = None
+            self._pixels = None
+
+    def _set_window(self, index, value):
+        # Zapis okna primo do pole `frames` (in-place, takze se projevi i v zasobniku studie)
+        value = np.asarray(value)
+        if self._frames is None and self._decoded is None:
+            # Chybejici okna jsou jednicky, stejne jako u DICOMu jen s PW okny
+            self._frames = np.ones((len(WINDOWS),) + value.shape, dtype=WORK_DTYPE)
+        elif self._frames is None:
+            self._frames = np.empty((len(WINDOWS),) + self._shape, dtype=WORK_DTYPE)
+        elif not self._frames.flags.writeable:
+            # Okna jen pro cteni (napr. z diskove cache) - prvni zapis vytvori vlastni kopii
+            self._frames = np.array(self._frames, dtype=WORK_DTYPE)
+        if value.shape != self._frames.shape[1:]:
+            raise ValueError(
+                f"Window {WINDOWS[index]} must have shape {self._frames.shape[1:]}, got {value.shape}"
+            )
+        self._frames[index] = value
+        self.touch()
+        if self._decoded is not None:
+            # Prepsane okno uz se ze souboru dekodovat nebude
+            self._decoded[index] = True
+            if self._decoded.all():
+                self._decoded = None
+                self._pixels = None
+
+    def decode(self):
+        """
+        Dekoduje vsechna okna, ktera nejsou namapovana ze souboru (komprimovana data),
+        aby pozdejsi pristup k oknum uz nemusel volat dekoder.
+        """
+        if self._decoded is not None and self._pixels is None:
+            self._decode(np.flatnonzero(~self._decoded))
+        return self
+
+    def read_frames(self, out):
+        """
+        Zapise vsechna okna do pripraveneho pole `out` (okno x H x W). Namapovana
+        okna se kopiruji primo ze souboru, takze nevznika dalsi kopie snimku v RAM.
+        """
+        if self._decoded is not None and self._pixels is not None:
+            for index in range(len(WINDOWS)):
+                out[index] = self._frame(index)
+        else:
+            out[...] = self.frames
+        return out
+
+    def _read_metadata(self, dicom_data):
+        # Nacteni zakladnich metadat z hlavicky DICOMu
+        self.acq_date = dicom_data[0x0008, 0x0022].value  # Acquisition Date (DA)
+        self.acq_time = dicom_data[0x0008, 0x0032].value  # Acquisition Time (TM)
+        self.acq_dur = (
+            dicom_data[0x0018, 0x1242].value * 0.001
+        )  # Acquisition Duration (milisekundy na sekundy)
+        # Sirky energetickych oken pro TEW korekci (None = vychozi TEW_SIRKY)
+        self.energy_windows = energy_window_widths(dicom_data)
+
+    def load_header(self, dicom_path):
+        """
+        Prvni faze nacteni: precte z `dicom_path` pouze hlavicku (bez pixelovych dat)
+        a metadata akvizice. Jednotliva okna se dekoduji az ve chvili, kdy k nim
+        nektery krok poprve pristoupi, a kazde jen jednou. Nekomprimovana data
+        se nedekoduji vubec - okna jsou pohledy do souboru namapovaneho np.memmap.
+        """
+        try:
+            header = pydicom.dcmread(dicom_path, stop_before_pixels=True)
+            n_frames = int(header.get("NumberOfFrames", 1) or 1)
+
+            # Stejna logika jako v load_dicom: 6 rovin, jinak jen 2 PW okna a zbytek jednicky
+            self._source = dicom_path
+            self._source_frames = (
+                len(WINDOWS) if n_frames == len(WINDOWS) else min(n_frames, 2)
+            )
+            self._shape = (int(header.Rows), int(header.Columns))
+            self._frames = None
+            self._decoded = np.zeros(len(WINDOWS), dtype=bool)
+            self._pixels = map_pixel_data(dicom_path, header)
+            self._max = {}
+            self.study = None
+            self.touch()
+
+            self._read_metadata(header)
+
+            print(f"Loaded DICOM header: {dicom_path}")
+            print(f"Acquisition Date: {self.acq_date}")
+            print(f"Acquisition Time: {self.acq_time}")
+            print(f"Acquisition Duration: {self.acq_dur}")
+
+        except Exception as e:
+            print(f"Error loading DICOM file: {e}")
+            raise Exception(f"Error loading DICOM file: {e}")
+
+    def load_dicom(self, dicom_path, lazy=False):
         """
         Nacte DICOM soubor z cesty `dicom_path`, extrahuje jednotlive planarni obrazy
         a ulozi je do atributu tridy. Zaroven nacte dulezita metadata.
+        S `lazy=True` se nacte jen hlavicka a pixely se dekoduji az pri pouziti (load_header).
         """
+        if lazy:
+            return self.load_header(dicom_path)
+
         try:
             # Nacteni DICOM souboru pomoci knihovny pydicom
             dicom_data = pydicom.dcmread(dicom_path)
-
-            # Zkontroluj pocet obrazovych rovin (pole pixel_array)
-            # Ocekavame, ze bude mit 6 rovin (ant/post pro PW, LSW, USW)
-            if len(dicom_data.pixel_array) == 6:
-                self.ant_pw = dicom_data.pixel_array[0]
-                self.pos_pw = dicom_data.pixel_array[1]
-                self.ant_lsw = dicom_data.pixel_array[2]
-                self.pos_lsw = dicom_data.pixel_array[3]
-                self.ant_usw = dicom_data.pixel_array[4]
-                self.pos_usw = dicom_data.pixel_array[5]
-            else:
-                # Pokud jsou pouze 2 rovin (typicky jen PW), zbyvajici scatter okna nahradime poli jednicek
-                # Tim zajistime kompatibilitu dalsiho zpracovani bez nutnosti dalsi validace
-                self.ant_pw = dicom_data.pixel_array[0]
-                self.pos_pw = dicom_data.pixel_array[1]
-                self.ant_lsw = np.ones_like(self.ant_pw)
-                self.pos_lsw = np.ones_like(self.pos_pw)
-                self.ant_usw = np.ones_like(self.ant_pw)
-                self.pos_usw = np.ones_like(self.pos_pw)
+            # Dekodovani pixelovych dat jen jednou
+            pixel_array = dicom_data.pixel_array
+
+            # Ocekavame 6 rovin (ant/post pro PW, LSW, USW) v poradi podle WINDOWS.
+            # Pokud jsou pouze 2 roviny (typicky jen PW), zbyvajici scatter okna nahradime poli jednicek
+            # Tim zajistime kompatibilitu dalsiho zpracovani bez nutnosti dalsi validace
+            n_frames = len(WINDOWS) if len(pixel_array) == len(WINDOWS) else 2
+            self.frames = np.ones(
+                (len(WINDOWS),) + pixel_array.shape[1:], dtype=WORK_DTYPE
+            )
+            self.frames[:n_frames] = pixel_array[:n_frames]
+            self.study = None
 
             # Nacteni zakladnich metadat z hlavicky DICOMu
-            self.acq_date = dicom_data[0x0008, 0x0022].value  # Acquisition Date (DA)
-            self.acq_time = dicom_data[0x0008, 0x0032].value  # Acquisition Time (TM)
-            self.acq_dur = (
-                dicom_data[0x0018, 0x1242].value * 0.001
-            )  # Acquisition Duration (milisekundy na sekundy)
+            self._read_metadata(dicom_data)
 
             # Urceni maximalnich hodnot v hlavnim okne (PW) – pro pozdejsi kontrastni normalizaci
             self.ant_max = np.max(self.ant_pw)
@@ -92,30 +460,27 @@ class dicom_image:
             print(f"Error loading DICOM file: {e}")
             raise Exception(f"Error loading DICOM file: {e}")
 
+    def aligned_window(self, name):
+        # Okno s uplatnenym odlozenym posunem sve projekce (bez cyklickeho pretoceni)
+        frame = getattr(self, name)
+        shift_x, shift_y = self.offsets[name[:3]]
+        if frame is None or (shift_x == 0 and shift_y == 0):
+            return frame
+        return shift_image(frame, shift_x, shift_y)
+
     def convert_to_image(self, planar_type="ant_pw"):
         """
         Prevede vybrany planarni obrazek na PIL image objekt.
         Pouziva se pro zobrazeni ve GUI nebo ulozeni do souboru.
+        PW okna se vykresli pres cache nahledu (preview).
         """
         try:
             # Vyber obrazoveho pole podle zadaneho typu
-            if planar_type == "ant_pw":
-                image_array = self.ant_pw
-                # Normalizace na rozsah 0–255 pro zobrazeni (kontrastni transformace)
-                image_array = image_array.astype(np.float32)
-                image_array = np.clip((image_array / self.ant_max) * 255, 0, 255)
-            elif planar_type == "pos_pw":
-                image_array = self.pos_pw
-                image_array = image_array.astype(np.float32)
-                image_array = np.clip((image_array / self.pos_max) * 255, 0, 255)
-            elif planar_type == "ant_lsw":
-                image_array = self.ant_lsw
-            elif planar_type == "pos_lsw":
-                image_array = self.pos_lsw
-            elif planar_type == "ant_usw":
-                image_array = self.ant_usw
-            elif planar_type == "pos_usw":
-                image_array = self.pos_usw
+            if planar_type in _PREVIEW_MAX:
+                # Normalizace na 0–255 pro zobrazeni (kontrastni transformace) pres LUT
+                return self.preview(planar_type)
+            elif planar_type in WINDOWS:
+                image_array = self.aligned_window(planar_type)
             else:
                 # Pokud zadany typ neni podporovan, vyhod vyjimku
                 raise Exception(
@@ -131,6 +496,462 @@ class dicom_image:
             # Osetreni chyby pri konverzi
             raise Exception(f"Error converting DICOM image to PIL: {e}")
 
+    def preview(
+        self, planar_type="ant_pw", size=None, window=(0.0, 1.0), resample=None
+    ):
+        """
+        8-bitovy nahled PW okna (PIL obrazek 'L'), volitelne zmenseny na `size`
+        (sirka, vyska). Okno se kvantizuje na indexy LUT jen jednou pro kazdou verzi dat
+        (data_version), obraz pro dane okno/uroven `window` (zlomky maxima projekce)
+        je jen vyber z LUT a hotove nahledy se pamatuji podle velikosti a okna.
+        Opakovane vykresleni beze zmeny dat tak nic nepocita. Vraceny obrazek je
+        sdileny s cache - pro kresleni je treba pracovat s kopii.
+        """
+        maximum = getattr(self, _PREVIEW_MAX[planar_type])
+        version = self.data_version(planar_type) + (maximum,)
+
+        cached = self._preview.get(planar_type)
+        if cached is None or cached[0] != version:
+            indices = _preview_indices(self.aligned_window(planar_type), maximum)
+            cached = (version, indices, {})
+            self._preview[planar_type] = cached
+
+        _, indices, renders = cached
+        key = (None if size is None else tuple(size), tuple(window), resample)
+        if key not in renders:
+            image = Image.fromarray(preview_lut(*window)[indices])
+            if size is not None:
+                image = image.resize(tuple(size), resample)
+            renders[key] = image
+        return renders[key]
+
+
+def preview_image(image, planar_type, size, resample=None):
+    """
+    Nahled okna snimku zmenseny na `size` (sirka, vyska) - z cache nahledu dicom_image,
+    u jinych objektu s metodou convert_to_image se obrazek vykresli a zmensi primo.
+    """
+    if hasattr(image, "preview"):
+        return image.preview(planar_type, size, resample=resample)
+    return image.convert_to_image(planar_type).resize(tuple(size), resample)
+
+
+class study_stack:
+    """
+    Souvisly zasobnik vsech snimku studie v jednom 4-D poli (casovy bod x okno x H x W).
+    Osa oken odpovida WINDOWS, osa casovych bodu klicum slovniku dicom_images.
+    Objekty dicom_image po vytvoreni zasobniku ukazuji svymi okny primo do nej,
+    takze operace nad celym zasobnikem se okamzite projevi i v jednotlivych snimcich.
+    """
+
+    def __init__(self, data, keys, acq_dur):
+        self.data = data  # pole (casovy bod x okno x H x W)
+        self.keys = list(keys)  # klice casovych bodu (indexy akvizic)
+        self.windows = WINDOWS  # nazvy oken v ose 1
+        self.acq_dur = np.asarray(acq_dur, dtype=np.float64)  # doby akvizice (s)
+        self._work = None  # pracovni pole pro mezivysledky (work_buffer)
+        self.version = 0  # pocitadlo zmen dat (zneplatni nahledy snimku)
+
+    @classmethod
+    def from_images(cls, dicom_images):
+        """
+        Zkopiruje snimky ze slovniku {index: dicom_image} do noveho zasobniku
+        a presmeruje okna snimku tak, aby byla pohledy do nej.
+        """
+        try:
+            keys = list(dicom_images.keys())
+            first = dicom_images[keys[0]]
+            shape = np.shape(first.ant_pw)
+            data = np.empty((len(keys), len(WINDOWS)) + shape, dtype=WORK_DTYPE)
+
+            for t, key in enumerate(keys):
+                image = dicom_images[key]
+                if isinstance(image, dicom_image):
+                    image.read_frames(data[t])
+                else:
+                    # Obecny objekt s okny jako atributy - chybejici okna jsou jednicky
+                    for w, name in enumerate(WINDOWS):
+                        value = getattr(image, name, None)
+                        data[t, w] = 1 if value is None else value
+
+            study = cls(data, keys, [dicom_images[key].acq_dur for key in keys])
+
+            # Presmerovani snimku na pohledy do zasobniku
+            for t, key in enumerate(keys):
+                image = dicom_images[key]
+                if isinstance(image, dicom_image):
+                    image.frames = data[t]
+                    image.study = study
+                else:
+                    for w, name in enumerate(WINDOWS):
+                        setattr(image, name, data[t, w])
+
+            return study
+
+        except Exception as e:
+            print(f"Error building study stack: {e}")
+            raise Exception(f"Error building study stack: {e}")
+
+    @classmethod
+    def of(cls, dicom_images):
+        """
+        Vrati zasobnik, do ktereho uz vsechny snimky (ve stejnem poradi) ukazuji,
+        jinak vytvori novy pomoci from_images.
+        """
+        keys = list(dicom_images.keys())
+        study = getattr(dicom_images[keys[0]], "study", None) if keys else None
+        if (
+            study is not None
+            and study.keys == keys
+            and all(
+                isinstance(dicom_images[key], dicom_image)
+                and dicom_images[key].study is study
+                for key in keys
+            )
+        ):
+            return study
+        return cls.from_images(dicom_images)
+
+    def work_buffer(self, n=None):
+        # Predalokovane pracovni pole (casovy bod x H x W) pro mezivysledky nad jednim
+        # oknem vsech snimku, s `n` pole (n x casovy bod x H x W) pro n oken -
+        # vytvori se jednou a pouziva se opakovane
+        shape = (self.data.shape[0],) + self.data.shape[2:]
+        if n is not None:
+            shape = (n,) + shape
+        if self._work is None or self._work.shape != shape:
+            self._work = np.empty(shape, dtype=WORK_DTYPE)
+        return self._work
+
+    def index(self, window):
+        # Index okna v ose oken
+        return self.windows.index(window)
+
+    def window(self, name):
+        # Pohled (casovy bod x H x W) na jedno okno vsech snimku
+        return self.data[:, self.index(name)]
+
+    def projection(self, projection):
+        # Pohled na okna (pw, lsw, usw) jedne projekce - 'ant' sude, 'pos' liche indexy
+        return self.data[:, 0::2] if projection == "ant" else self.data[:, 1::2]
+
+    def total_rates(self):
+        # Celkove cetnosti (cps) vsech oken vsech snimku, matice (casovy bod x okno)
+        T, K = self.data.shape[:2]
+        counts = self.data.reshape(T, K, -1).sum(axis=2, dtype=np.float64)
+        return counts / self.acq_dur[:, None]
+
+    def roi_counts(self, ant_roi, pos_roi):
+        """
+        Soucty impulzu v ROI pro vsechna okna vsech snimku jednou indexovanou redukci.
+        ROI se prevedou na ploche indexy pixelu (roi_indices), ze zasobniku se vyberou
+        jen pixely ROI vsech oken najednou a sectou se po oknech (np.add.reduceat),
+        bez docasnych poli velikosti celeho snimku. Vraci matici (casovy bod x okno);
+        okna projekce bez ROI jsou NaN.
+        """
+        T, K, H, W = self.data.shape
+        counts = np.full((T, K), np.nan)
+        indices = [
+            None if roi is None else roi_indices(roi) for roi in (ant_roi, pos_roi)
+        ]
+
+        # Indexy pixelu ROI kazdeho okna v ploche (casovy bod x okno*H*W) matici
+        windows, gather, lengths = [], [], []
+        for k in range(K):
+            roi = indices[k % 2]
+            if roi is None:
+                continue
+            windows.append(k)
+            gather.append(roi + k * H * W)
+            lengths.append(len(roi))
+        if not windows:
+            return counts
+
+        windows = np.array(windows)
+        lengths = np.array(lengths)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        counts[:, windows] = 0.0
+
+        nonempty = lengths > 0
+        if nonempty.any():
+            values = self.data.reshape(T, K * H * W)[:, np.concatenate(gather)]
+            counts[:, windows[nonempty]] = np.add.reduceat(
+                values, starts[nonempty], axis=1, dtype=np.float64
+            )
+        return counts
+
+    def region_counts(self, ant_labels, pos_labels, n_labels=None):
+        """
+        Soucty impulzu pro vsechny oblasti ROI vsech oken vsech snimku jednim
+        vektorizovanym pruchodem (np.bincount). ROI jsou mapy oblasti (label mapy):
+        0 = pozadi, kladna cisla = jednotlive oblasti (binarni maska = oblast 1).
+        Vraci pole (casovy bod x okno x oblast), oblast 0 (pozadi) se nescita;
+        okna projekce bez ROI jsou NaN. `n_labels` je pocet oblasti vcetne pozadi
+        (vychozi podle nejvyssiho cisla oblasti v mapach).
+        """
+        T, K, H, W = self.data.shape
+        maps = [
+            None if m is None else roi_label_map(m, (H, W)).ravel()
+            for m in (ant_labels, pos_labels)
+        ]
+        if n_labels is None:
+            n_labels = _label_count(maps)
+        counts = np.full((T, K, n_labels), np.nan)
+        flat = self.data.reshape(T, K, H * W)
+
+        for start, labels in enumerate(maps):
+            if labels is None:
+                continue
+            # Jen pixely nektere oblasti - docasna pole maji velikost ROI, ne snimku
+            pixels = np.flatnonzero(labels)
+            values = flat[:, start::2][:, :, pixels]
+            n_windows = values.shape[1]
+            bins = (
+                np.arange(T * n_windows)[:, None] * n_labels
+                + labels[pixels].astype(np.intp)
+            ).ravel()
+            counts[:, start::2] = np.bincount(
+                bins, weights=values.ravel(), minlength=T * n_windows * n_labels
+            ).reshape(T, n_windows, n_labels)
+        return counts
+
+    def region_rates(self, ant_labels, pos_labels, offsets=None):
+        """
+        Cetnosti (cps) vsech oblasti ROI, pole (casovy bod x okno x oblast),
+        viz region_counts. Projekce s odlozenym posunem (offsets) se pocitaji
+        pres posunute vahy kazde oblasti.
+        """
+        shifted = [offsets is not None and np.any(offsets[:, p]) for p in (0, 1)]
+        shape = self.data.shape[2:]
+        rates = self.region_counts(
+            None if shifted[0] else ant_labels,
+            None if shifted[1] else pos_labels,
+            _label_count(
+                [
+                    None if m is None else roi_label_map(m, shape)
+                    for m in (ant_labels, pos_labels)
+                ]
+            ),
+        )
+        rates /= self.acq_dur[:, None, None]
+
+        for start, labels in ((0, ant_labels), (1, pos_labels)):
+            if labels is None or not shifted[start]:
+                continue
+            labels = roi_label_map(labels, shape)
+            view = self.data[:, start::2]
+            rates[:, start::2] = 0.0
+            for label in np.unique(labels[labels > 0]):
+                roi = (labels == label).astype(self.data.dtype)
+                for t, (shift_x, shift_y) in enumerate(offsets[:, start]):
+                    weights = shift_image(roi, -shift_x, -shift_y)
+                    rates[t, start::2, label] = (
+                        np.einsum("kyx,yx->k", view[t], weights) / self.acq_dur[t]
+                    )
+        return rates
+
+    def roi_rates(self, ant_roi, pos_roi, offsets=None):
+        """
+        Cetnosti (cps) v ROI pro vsechna okna vsech snimku najednou (roi_counts).
+        ROI jsou binarni masky nebo ploche indexy pixelu.
+        Vraci matici (casovy bod x okno); okna projekce bez ROI jsou NaN.
+        `offsets` (casovy bod x projekce x (shift_x, shift_y)) jsou odlozene posuny
+        z zarovnani - misto posunu vsech oken se posune ROI opacnym smerem
+        (linearni interpolace je samoadjungovana), mimo obraz se pocita s nulami.
+        """
+        # Projekce bez posunu - soucty pres indexy ROI jednou redukci
+        shifted = [offsets is not None and np.any(offsets[:, p]) for p in (0, 1)]
+        rates = self.roi_counts(
+            None if shifted[0] else ant_roi, None if shifted[1] else pos_roi
+        )
+        rates /= self.acq_dur[:, None]
+
+        # Posunute projekce - ROI vahy posunute opacnym smerem
+        for start, roi in ((0, ant_roi), (1, pos_roi)):
+            if roi is None or not shifted[start]:
+                continue
+            roi = roi_mask(roi, self.data.shape[2:]).astype(self.data.dtype)
+            view = self.data[:, start::2]
+            counts = np.empty(view.shape[:2])
+            for t, (shift_x, shift_y) in enumerate(offsets[:, start]):
+                weights = shift_image(roi, -shift_x, -shift_y)
+                counts[t] = np.einsum("kyx,yx->k", view[t], weights)
+            rates[:, start::2] = counts / self.acq_dur[:, None]
+        return rates
+
+    def scale(self, factors):
+        # Vynasobeni kazdeho okna kazdeho snimku faktorem z matice (casovy bod x okno), in-place
+        factors = np.asarray(factors, dtype=self.data.dtype)
+        self.data *= factors.reshape(factors.shape + (1,) * (self.data.ndim - 2))
+        self.version += 1
+
+    def dt_correction(self, md_data, sigma=None, progress=None):
+        """
+        Korekce na mrtvou dobu vsech oken z `md_data` ({okno: mrtva doba v s}) ve vsech
+        snimcich najednou. Namerene cetnosti se spocitaji jednou redukci pres zasobnik,
+        korekcni faktory jednim vektorizovanym volanim lambertw a aplikuji se in-place.
+        Se `sigma` se misto jednoho faktoru na okno pouzije pixelova mapa faktoru
+        z vyhlazenych lokalnich cetnosti (dt_correction_map).
+        Vraci (namerene cetnosti, korekcni faktory), matice (casovy bod x okno z md_data);
+        u pixelove korekce je faktor pomer korigovane a namerene celkove cetnosti.
+        `progress(podil, text)` se vola po kazdem okne a naposledy pred zmenou dat
+        (napr. Task.progress) - zruseni v nem nechava data beze zmeny.
+        """
+        windows = [self.index(window) for window in md_data]
+        mrtve_doby = np.array([md_data[window] for window in md_data], dtype=np.float64)
+
+        merene_cetnosti = self.total_rates()[:, windows]
+        if sigma is not None:
+            # Mapy faktoru vsech oken (WORK_DTYPE) se spocitaji predem, data se zmeni
+            # az po poslednim kontrolnim bodu - korekce se provede cela, nebo vubec
+            maps = self.work_buffer(len(windows))
+            for j, k in enumerate(windows):
+                dt_correction_map(
+                    self.data[:, k],
+                    self.acq_dur[:, None, None],
+                    mrtve_doby[j],
+                    sigma,
+                    out=maps[j],
+                )
+                if progress is not None:
+                    progress((j + 1) / (len(windows) + 1), f"map {self.windows[k]}")
+            if progress is not None:
+                progress(
+                    len(windows) / (len(windows) + 1),
+                    "applying correction (cannot be cancelled)",
+                )
+            for j, k in enumerate(windows):
+                np.multiply(self.data[:, k], maps[j], out=self.data[:, k])
+            self.version += 1
+            kor_faktory = self.total_rates()[:, windows] / merene_cetnosti
+            return merene_cetnosti, kor_faktory
+
+        kor_faktory = dt_correction_factor(merene_cetnosti, mrtve_doby)
+        if progress is not None:
+            progress(0.5, "applying correction (cannot be cancelled)")
+
+        # Okna mimo md_data se nasobi jednickou (zustanou beze zmeny)
+        factors = np.ones(self.data.shape[:2])
+        factors[:, windows] = kor_faktory
+        self.scale(factors)
+        return merene_cetnosti, kor_faktory
+
+    def roll_projection(self, projection, shift_x, shift_y):
+        """
+        Cyklicky posune vsechna okna jedne projekce; kazdy casovy bod o svuj posun
+        (pole shift_x, shift_y). Chovani odpovida np.roll, provede se jednou operaci.
+        """
+        view = self.projection(projection)
+        T, K, H, W = view.shape
+        shift_y = np.asarray(shift_y, dtype=int).reshape(T, 1, 1, 1)
+        shift_x = np.asarray(shift_x, dtype=int).reshape(T, 1, 1, 1)
+
+        # Indexy zdrojovych radku a sloupcu: rolled[n] = puvodni[n - shift]
+        rows = (np.arange(H).reshape(1, 1, H, 1) - shift_y) % H
+        cols = (np.arange(W).reshape(1, 1, 1, W) - shift_x) % W
+        t = np.arange(T).reshape(T, 1, 1, 1)
+        k = np.arange(K).reshape(1, K, 1, 1)
+        view[...] = view[t, k, rows, cols]
+        self.version += 1
+
+
+def roi_indices(roi):
+    """
+    ROI jako ploche indexy pixelu (1-D pole, radkove poradi). Prijima binarni masku
+    (H x W) nebo uz hotove ploche indexy. Oproti masce zabira pamet jen podle
+    velikosti ROI a soucty v ROI jsou jen vyber a soucet techto pixelu.
+    """
+    roi = np.asarray(roi)
+    if roi.ndim == 2:
+        return np.flatnonzero(roi)
+    return roi.astype(np.intp, copy=False).ravel()
+
+
+def roi_mask(roi, shape):
+    # Binarni maska (H x W) z masky nebo plochych indexu ROI
+    roi = np.asarray(roi)
+    if roi.ndim == 2:
+        return roi.astype(bool, copy=False)
+    mask = np.zeros(shape, dtype=bool)
+    mask.ravel()[roi] = True
+    return mask
+
+
+def roi_label_map(roi, shape):
+    # Mapa oblasti (H x W) z mapy oblasti, masky nebo plochych indexu ROI (oblast 1)
+    roi = np.asarray(roi)
+    if roi.ndim == 2 and roi.dtype != bool:
+        return roi
+    return roi_mask(roi, shape).view(np.uint8)
+
+
+def _label_count(label_maps):
+    # Pocet oblasti vcetne pozadi (0) podle nejvyssiho cisla oblasti v mapach
+    return 1 + max([int(m.max()) for m in label_maps if m is not None and m.size] + [0])
+
+
+def najdi_akvizice(folder):
+    """
+    Najde ve slozce `folder` vsechny DICOM soubory (*.dcm) a seradi je podle data
+    a casu akvizice. Cte se pouze hlavicka (bez pixelovych dat), takze je to rychle.
+    Vraci seznam cest serazeny od nejstarsi akvizice.
+    """
+    try:
+        akvizice = []
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith(".dcm"):
+                continue
+            path = os.path.join(folder, name)
+            header = pydicom.dcmread(path, stop_before_pixels=True)
+            # Klic pro razeni - datum (YYYYMMDD) a cas (HHMMSS.ffffff) akvizice
+            akvizice.append(
+                (str(header[0x0008, 0x0022].value), str(header[0x0008, 0x0032].value), path)
+            )
+
+        return [path for _, _, path in sorted(akvizice)]
+
+    except Exception as e:
+        print(f"Error searching DICOM files in {folder}: {e}")
+        raise Exception(f"Error searching DICOM files in {folder}: {e}")
+
+
+def _nacti_akvizici(path, cache=None):
+    # Nacteni jedne akvizice ve vlaknu: hlavicka + dekodovani oken, ktera nejsou namapovana
+    if cache is not None:
+        return cache.load_image(path)
+    image = dicom_image()
+    image.load_header(path)
+    image.decode()
+    return image
+
+
+def nacti_studii(folder, pocet_akvizic=5, workers=None, cache=None):
+    """
+    Nacte celou studii ze slozky `folder`: akvizice seradi podle casu (najdi_akvizice)
+    a priradi je postupne slotum 0 .. pocet_akvizic-1 (1 h, 4-6 h, 24 h, 48 h, 144 h).
+    Soubory se dekoduji soucasne v ThreadPoolExecutoru - dekodery pydicom
+    (JPEG/RLE) i kopie z namapovaneho souboru uvolnuji GIL.
+    S `cache` (FrameCache) se jiz jednou dekodovane snimky berou z diskove cache.
+    Vraci slovnik {slot: dicom_image}.
+    """
+    try:
+        paths = najdi_akvizice(folder)
+        if len(paths) != pocet_akvizic:
+            raise ValueError(
+                f"expected {pocet_akvizic} DICOM acquisitions, found {len(paths)}"
+            )
+
+        with ThreadPoolExecutor(max_workers=workers or len(paths)) as executor:
+            images = list(
+                executor.map(_nacti_akvizici, paths, [cache] * len(paths))
+            )
+
+        return dict(enumerate(images))
+
+    except Exception as e:
+        print(f"Error loading study from {folder}: {e}")
+        raise Exception(f"Error loading study from {folder}: {e}")
+
 
 def align_images(reference_image, moving_image, sigma=0.5):
     """
@@ -199,8 +1020,426 @@ def posunuti_image(image, shift_x, shift_y):
         raise Exception(f"Error shifting image: {e}")
 
 
+def shift_image(image, shift_x, shift_y, order=1):
+    """
+    Posune obraz o (shift_x, shift_y) pixelu, i o neceli pocet (linearni interpolace).
+    Na rozdil od posunuti_image (np.roll) hodnoty nepretaci na druhy okraj -
+    uvolnene pixely se vyplni nulami a pixely mimo obraz se zahodi.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    if float(shift_x).is_integer() and float(shift_y).is_integer():
+        # Celociselny posun - presna kopie vyrezu bez interpolace
+        shifted = np.zeros_like(image)
+        H, W = image.shape
+        sy, sx = int(shift_y), int(shift_x)
+        if abs(sy) < H and abs(sx) < W:
+            shifted[max(sy, 0) : H + min(sy, 0), max(sx, 0) : W + min(sx, 0)] = image[
+                max(-sy, 0) : H + min(-sy, 0), max(-sx, 0) : W + min(-sx, 0)
+            ]
+        return shifted
+    return ndimage_shift(
+        image, (shift_y, shift_x), order=order, mode="grid-constant", cval=0.0
+    )
+
+
+def study_offsets(dicom_images):
+    # Odlozene posuny vsech snimku jako pole (casovy bod x projekce x (shift_x, shift_y))
+    nulovy = {"ant": (0.0, 0.0), "pos": (0.0, 0.0)}
+    return np.array(
+        [
+            [getattr(image, "offsets", nulovy)[p] for p in ("ant", "pos")]
+            for image in dicom_images.values()
+        ],
+        dtype=np.float64,
+    )
+
+
+def phase_correlation_shifts(
+    reference, moving, sigma=0.5, upsample=20, whitening=0.25
+):
+    """
+    Sub-pixelova registrace fazovou korelaci: posuny (shift_x, shift_y) obrazu `moving`
+    (... x H x W) vuci `reference` (tvar broadcastovatelny na `moving`) se stejnou
+    konvenci jako align_images. Celociselne maximum se zpresni maticovou DFT
+    korelacniho spektra na okoli maxima s krokem 1/upsample pixelu.
+
+    `whitening` je mocnina normalizace krizoveho spektra: 1 = cista fazova korelace,
+    0 = obycejna krizova korelace. U planarnich snimku s malym poctem impulzu
+    je plna normalizace citliva na sum, proto je vychozi hodnota jen 0.25.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    moving = np.asarray(moving, dtype=np.float64)
+    H, W = moving.shape[-2:]
+    if reference.shape[-2:] != (H, W):
+        raise ValueError("Input images must have the same shape for alignment.")
+
+    try:
+        reference = gaussian_filter(
+            reference, sigma=(0,) * (reference.ndim - 2) + (sigma, sigma)
+        )
+        moving = gaussian_filter(
+            moving, sigma=(0,) * (moving.ndim - 2) + (sigma, sigma)
+        )
+
+        # Normalizovane krizove spektrum
+        cross = scipy.fft.fft2(reference, workers=-1) * np.conj(
+            scipy.fft.fft2(moving, workers=-1)
+        )
+        if whitening:
+            cross = cross / (np.abs(cross) ** whitening + np.finfo(np.float64).tiny)
+
+        # 1. Celociselne maximum korelace
+        correlation = scipy.fft.ifft2(cross, workers=-1).real
+        flat = correlation.reshape(correlation.shape[:-2] + (H * W,))
+        y_max, x_max = np.unravel_index(np.argmax(flat, axis=-1), (H, W))
+        lag_y = (y_max + H // 2) % H - H // 2
+        lag_x = (x_max + W // 2) % W - W // 2
+
+        # 2. Zpresneni: korelace v okoli +-0.75 px maxima s krokem 1/upsample (maticova DFT)
+        region = int(np.ceil(1.5 * upsample))
+        steps = (np.arange(region) - region // 2) / upsample
+        freq_y = scipy.fft.fftfreq(H) * H
+        freq_x = scipy.fft.fftfreq(W) * W
+        lags_y = lag_y[..., None] + steps
+        lags_x = lag_x[..., None] + steps
+        kernel_y = np.exp(2j * np.pi * lags_y[..., :, None] * freq_y / H)
+        kernel_x = np.exp(2j * np.pi * lags_x[..., :, None] * freq_x / W)
+        # Dve maticova nasobeni (region x H)(H x W)(W x region) - vyhne se tri-operandovemu
+        # einsum bez optimalizace poradi, ktery roste s region^2 * H * W
+        upsampled = (kernel_y @ cross @ np.swapaxes(kernel_x, -1, -2)).real
+
+        flat = upsampled.reshape(upsampled.shape[:-2] + (region * region,))
+        fine_y, fine_x = np.unravel_index(np.argmax(flat, axis=-1), (region, region))
+        return lag_x + steps[fine_x], lag_y + steps[fine_y]
+
+    except Exception as e:
+        print(f"Error aligning images: {e}")
+        raise Exception(f"Error aligning images: {e}")
+
+
+def registration_shifts(reference, moving, sigma=0.5):
+    """
+    Davkova registrace: posuny vsech obrazu `moving` (... x H x W) vuci referencim
+    `reference` (tvar broadcastovatelny na `moving`, napr. ... x 1 x H x W).
+    Vysledek je shodny s align_images (stejne zhlazeni, stejna definice posunu),
+    ale spektrum reference se spocita jen jednou a vsechny obrazy se transformuji
+    jednim realnym FFT (rfft2) s vice vlakny. Vraci pole (shift_x, shift_y).
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    moving = np.asarray(moving, dtype=np.float64)
+    H, W = moving.shape[-2:]
+    if reference.shape[-2:] != (H, W):
+        raise ValueError("Input images must have the same shape for alignment.")
+
+    try:
+        # Gaussovske zhlazeni jen v rovine obrazu (ne pres casove body / projekce)
+        reference = gaussian_filter(
+            reference, sigma=(0,) * (reference.ndim - 2) + (sigma, sigma)
+        )
+        moving = gaussian_filter(
+            moving, sigma=(0,) * (moving.ndim - 2) + (sigma, sigma)
+        )
+
+        # Doplneni nulami na >= 2N-1, aby korelace byla linearni (jako fftconvolve), ne cyklicka
+        size = (
+            scipy.fft.next_fast_len(2 * H - 1),
+            scipy.fft.next_fast_len(2 * W - 1),
+        )
+        spectrum_ref = scipy.fft.rfft2(reference, s=size, workers=-1)
+        spectrum_mov = scipy.fft.rfft2(moving, s=size, workers=-1)
+
+        # Krizova korelace corr(lag) = sum ref[n] * mov[n - lag]
+        correlation = scipy.fft.irfft2(
+            spectrum_ref * np.conj(spectrum_mov), s=size, workers=-1
+        )
+
+        # Vyber posunu -N//2 .. N - N//2 - 1 ve stejnem poradi jako vystup mode="same"
+        lags_y = np.arange(H) - H // 2
+        lags_x = np.arange(W) - W // 2
+        correlation = correlation[..., lags_y % size[0], :][..., lags_x % size[1]]
+
+        flat = correlation.reshape(correlation.shape[:-2] + (H * W,))
+        y_max, x_max = np.unravel_index(np.argmax(flat, axis=-1), (H, W))
+        return lags_x[x_max], lags_y[y_max]
+
+    except Exception as e:
+        print(f"Error aligning images: {e}")
+        raise Exception(f"Error aligning images: {e}")
+
+
+def align_study(
+    dicom_images,
+    projections=("ant", "pos"),
+    reference_index=2,
+    method="fft",
+    progress=None,
+):
+    """
+    Zarovna vsechny snimky zadanych projekci na referencni snimek (standardne 24h, index 2).
+    Posuny se urci z PW oken vsech projekci a casovych bodu jednou davkovou registraci.
+
+    - method="fft": celociselne posuny (registration_shifts), PW i scatter okna
+      se cyklicky posunou (np.roll) primo v zasobniku studie.
+    - method="phase": sub-pixelove posuny fazovou korelaci (phase_correlation_shifts).
+      Okna se neposouvaji, posun se ulozi do `offsets` snimku a uplatni se az pri
+      souctu v ROI (bez pretoceni horkych pixelu pres okraj) a pri zobrazeni.
+
+    `progress(podil, text)` se vola po registraci kazde projekce a naposledy pred
+    posunem dat (napr. Task.progress) - zruseni v nem nechava data beze zmeny.
+    Vraci slovnik {projekce: {index: (shift_x, shift_y)}}.
+    """
+    try:
+        if method == "phase":
+            registrace = phase_correlation_shifts
+        elif method == "fft":
+            registrace = registration_shifts
+        else:
+            raise ValueError(f"Unknown alignment method: {method}")
+
+        # Posuny vsech projekci se urci predem, data se posunou az po poslednim
+        # kontrolnim bodu - zarovnani se provede cele, nebo vubec
+        study = study_stack.of(dicom_images)
+        t_ref = study.keys.index(reference_index)
+        shift_x, shift_y = [], []
+        for p, projection in enumerate(projections):
+            pw = study.window(f"{projection}_pw")
+            sx, sy = registrace(pw[t_ref], pw)
+            shift_x.append(sx)
+            shift_y.append(sy)
+            if progress is not None:
+                progress((p + 1) / (len(projections) + 1), f"registered {projection}")
+        if progress is not None:
+            progress(
+                len(projections) / (len(projections) + 1),
+                "applying shifts (cannot be cancelled)",
+            )
+
+        shifts = {}
+        for p, projection in enumerate(projections):
+            if method == "fft":
+                # Posun PW i scatter oken vsech casovych bodu jednou operaci
+                study.roll_projection(projection, shift_x[p], shift_y[p])
+                shift = [(int(x), int(y)) for x, y in zip(shift_x[p], shift_y[p])]
+                offsets = [(0.0, 0.0)] * len(shift)
+            else:
+                shift = [(float(x), float(y)) for x, y in zip(shift_x[p], shift_y[p])]
+                offsets = shift
+
+            for t, key in enumerate(study.keys):
+                image = dicom_images[key]
+                if not hasattr(image, "offsets"):
+                    image.offsets = {"ant": (0.0, 0.0), "pos": (0.0, 0.0)}
+                image.offsets[projection] = offsets[t]
+            shifts[projection] = dict(zip(study.keys, shift))
+        return shifts
+
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"Error aligning study: {e}")
+        raise Exception(f"Error aligning study: {e}")
+
+
+def align_projection(
+    dicom_images, projection, reference_index=2, method="fft", progress=None
+):
+    """
+    Zarovna vsechny snimky jedne projekce ('ant' nebo 'pos') na referencni snimek
+    (standardne 24h, index 2). Posun se urci z PW okna a stejne se posunou i scatter okna
+    (method="phase": sub-pixelovy odlozeny posun, viz align_study).
+    Vraci slovnik {index: (shift_x, shift_y)}.
+    """
+    try:
+        return align_study(
+            dicom_images, (projection,), reference_index, method, progress
+        )[projection]
+
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"Error aligning {projection} projection: {e}")
+        raise Exception(f"Error aligning {projection} projection: {e}")
+
+
+@lru_cache(maxsize=16)
+def _rasterize_polygon(shape, vertices):
+    # Scanline vyplneni polygonu (pravidlo sudy-lichy) jen v jeho ohranicujicim obdelniku.
+    # Vysledek je v cache podle tvaru a vrcholu, proto je jen pro cteni.
+    height, width = shape
+    mask = np.zeros(shape, dtype=bool)
+
+    x0, y0 = np.asarray(vertices, dtype=np.float64).T
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    # Radky (stredy pixelu) a sloupce v ohranicujicim obdelniku polygonu
+    top = max(int(np.ceil(y0.min())), 0)
+    bottom = min(int(np.floor(y0.max())), height - 1)
+    left = max(int(np.ceil(x0.min())), 0)
+    right = min(int(np.floor(x0.max())), width - 1)
+    if top > bottom or left > right:
+        mask.flags.writeable = False
+        return mask
+
+    # Pruseciky vsech hran se vsemi radky; hrana protina radek y,
+    # pokud y lezi v polouzavrenem intervalu [min(y0, y1), max(y0, y1))
+    rows = np.arange(top, bottom + 1, dtype=np.float64)[:, None]
+    crosses = (np.minimum(y0, y1) <= rows) & (rows < np.maximum(y0, y1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = x0 + (rows - y0) * (x1 - x0) / (y1 - y0)
+    xs = np.sort(np.where(crosses, xs, np.inf), axis=1)
+
+    # Dvojice pruseciku ohranicuji useky uvnitr polygonu: pixely start <= x < end
+    n_pairs = xs.shape[1] // 2
+    starts = np.ceil(xs[:, 0 : 2 * n_pairs : 2])
+    ends = np.ceil(xs[:, 1 : 2 * n_pairs : 2])
+    valid = np.isfinite(ends)
+    starts = np.clip(starts[valid], left, right + 1).astype(np.intp)
+    ends = np.clip(ends[valid], left, right + 1).astype(np.intp)
+    span_rows = np.nonzero(valid)[0] + top
+
+    # Vyplneni useku po radcich (useku je jen par na radek)
+    for row, start, end in zip(span_rows.tolist(), starts.tolist(), ends.tolist()):
+        mask[row, start:end] = True
+    mask.flags.writeable = False
+    return mask
+
+
+def polygon_mask(shape, roi_points):
+    """
+    Vytvori binarni masku ROI o rozmeru `shape` z bodu polygonu [(x, y), ...].
+    Pixel patri do ROI, pokud jeho stred (celociselne souradnice) lezi uvnitr polygonu.
+    Rasterizuje se po radcich jen v ohranicujicim obdelniku polygonu a vysledek
+    se pamatuje pro dany tvar a vrcholy (opakovane volani pri editaci ROI je okamzite).
+    Vracena maska je jen pro cteni.
+    """
+    try:
+        if roi_points is None or len(roi_points) < 3:
+            # Polygon musi mit minimalne 3 body, jinak vracime prazdnou masku
+            return np.zeros(shape, dtype=bool)
+
+        vertices = tuple((float(x), float(y)) for x, y in roi_points)
+        return _rasterize_polygon(tuple(int(n) for n in shape), vertices)
+
+    except Exception as e:
+        raise Exception(f"Error creating polygon mask: {e}")
+
+
+# Prodleva (ms), po kterou se cekaji dalsi upravy ROI, nez se prekresli nahledy
+OVERLAY_DEBOUNCE_MS = 80
+
+
+class ROI_overlay_renderer:
+    """
+    Vykreslovani obrysu ROI do nahledu vsech snimku v Tk labelech.
+
+    Zmensene podkladove nahledy (RGBA) se pamatuji a meni se jen se zmenou dat snimku
+    (cache nahledu dicom_image). Pri uprave ROI se kresli jen vrstva polygonu
+    v rozliseni nahledu - jedna pro vsechny snimky, protoze ROI je spolecna - a slozi
+    se s podkladem. Rychle po sobe jdouci upravy (tazeni vrcholu) se slouci:
+    nahledy se prekresli jednou, az se ROI `delay_ms` nezmeni. Bez `scheduler`
+    (objekt s Tk metodami after/after_cancel) se prekresluje hned.
+    """
+
+    def __init__(
+        self,
+        dicom_obj,
+        planar_type,
+        img_labels,
+        size_image,
+        image_shape,
+        scheduler=None,
+        delay_ms=OVERLAY_DEBOUNCE_MS,
+    ):
+        self.dicom_obj = dicom_obj
+        self.planar_type = planar_type
+        self.img_labels = img_labels
+        self.size_image = tuple(size_image)
+        self.scheduler = scheduler
+        self.delay_ms = delay_ms
+
+        # Meritko souradnic obrazu -> souradnice nahledu a tloustka cary (2 px obrazu)
+        height, width = image_shape
+        self.scale = (self.size_image[0] / width, self.size_image[1] / height)
+        self.line_width = max(1, round(2 * min(self.scale)))
+
+        self._base = {}  # {klic: (nahled z cache, jeho RGBA kopie)}
+        self._photos = {}  # {klic: ImageTk.PhotoImage zobrazeny v labelu}
+        self._points = []
+        self._pending = None  # id naplanovaneho prekresleni
+
+    def base(self, key):
+        # Zmenseny podklad snimku v RGBA - prevadi se znovu jen pri zmene nahledu
+        preview = preview_image(
+            self.dicom_obj[key],
+            self.planar_type,
+            self.size_image,
+            Image.Resampling.LANCZOS,
+        )
+        cached = self._base.get(key)
+        if cached is None or cached[0] is not preview:
+            cached = (preview, preview.convert("RGBA"))
+            self._base[key] = cached
+        return cached[1]
+
+    def layer(self, points):
+        # Pruhledna vrstva s cervenym uzavrenym polygonem v souradnicich nahledu
+        layer = Image.new("RGBA", self.size_image, (0, 0, 0, 0))
+        if len(points) > 1:
+            sx, sy = self.scale
+            body = [(x * sx, y * sy) for x, y in points]
+            ImageDraw.Draw(layer).line(
+                body + body[:1], fill=(255, 0, 0, 255), width=self.line_width
+            )
+        return layer
+
+    def request(self, points):
+        """
+        Pozadavek na prekresleni s novymi body ROI. Se `scheduler` se predchozi
+        nevyrizeny pozadavek zrusi a prekresleni se naplanuje za `delay_ms`.
+        """
+        self._points = list(points)
+        if self.scheduler is None:
+            self.flush()
+            return
+        if self._pending is not None:
+            self.scheduler.after_cancel(self._pending)
+        self._pending = self.scheduler.after(self.delay_ms, self.flush)
+
+    def finish(self):
+        # Naplanovane prekresleni se provede hned (zavreni editoru)
+        if self._pending is not None:
+            self.scheduler.after_cancel(self._pending)
+            self.flush()
+
+    def flush(self):
+        # Prekresleni vsech nahledu s poslednimi body ROI
+        self._pending = None
+        layer = self.layer(self._points)
+        for key in self.dicom_obj.keys():
+            image = Image.alpha_composite(self.base(key), layer)
+            photo = self._photos.get(key)
+            if photo is not None and (photo.width(), photo.height()) == image.size:
+                # Stejny PhotoImage se jen prepise, label se nemusi prenastavovat
+                photo.paste(image)
+                continue
+            photo = ImageTk.PhotoImage(image)
+            self._photos[key] = photo
+            self.img_labels[key].config(image=photo)
+            self.img_labels[key].image = photo  # reference, aby nedoslo k odstraneni GC
+
+
 class ROI_drawer_manual:
-    def __init__(self, dicom_obj, planar_type, img_labels, size_image):
+    def __init__(
+        self,
+        dicom_obj,
+        planar_type,
+        img_labels,
+        size_image,
+        label=None,
+        scheduler=None,
+        master=None,
+        figsize=(13, 13),
+    ):
         """
         Konstruktor tridy, ktera zajistuje kresleni a upravu ROI polygonu na obraze.
 
@@ -209,6 +1448,12 @@ class ROI_drawer_manual:
         - planar_type: retezec 'ant_pw' nebo 'pos_pw', urcujici, kterou projekci zobrazit a upravovat
         - img_labels: slovnik Tkinter Label widgetu, ktere slouzi k zobrazeni obrazku s ROI v GUI
         - size_image: cilova velikost zobrazeni obrazku v pixelech (napr. 256x256)
+        - label: cislo oblasti v mape ROI (viz OBLASTI_ROI); None = ROI je binarni maska
+        - scheduler: Tk widget (after/after_cancel) pro slouceni rychlych uprav ROI
+          pri prekreslovani nahledu; None = nahledy se prekresli hned
+        - master: Tk widget, do ktereho se editor vlozi (FigureCanvasTkAgg);
+          None = samostatne pyplot okno otevrene metodou show()
+        - figsize: velikost platna v palcich
 
         V teto funkci se inicializuje graficke okno, obrazek, PolygonSelector pro kresleni polygonu,
         a dalsi pomocne promenne.
@@ -230,13 +1475,40 @@ class ROI_drawer_manual:
                 dicom_obj[2].ant_pw if planar_type == "ant_pw" else dicom_obj[2].pos_pw
             )
 
-            # Vytvoreni matplotlib figure a axes pro vykreslovani
-            self.fig, self.ax = plt.subplots(
-                figsize=(13, 13)
-            )  # velke platno pro pohodlne kresleni
+            # Prekreslovani obrysu ROI do nahledu vsech snimku v GUI
+            self.overlay = ROI_overlay_renderer(
+                dicom_obj,
+                planar_type,
+                img_labels,
+                self.size_image,
+                np.shape(self.image),
+                scheduler,
+            )
 
-            # Vykresleni obrazku do axes s sedou (gray) barevnou mapou
-            self.ax.imshow(self.image, cmap="gray")
+            # Vytvoreni matplotlib figure a axes pro vykreslovani
+            self.master = master
+            if master is None:
+                # Samostatne okno pres pyplot (blokujici plt.show())
+                self.fig, self.ax = plt.subplots(figsize=figsize)
+                self.canvas = None
+            else:
+                # Platno vlozene do Tk okna - figure mimo pyplot, po close() se uvolni
+                self.fig = Figure(figsize=figsize)
+                self.ax = self.fig.add_subplot()
+                self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+                self.canvas.get_tk_widget().pack(fill="both", expand=True)
+
+            # Vykresleni obrazku do axes s sedou (gray) barevnou mapou - 8-bitovy
+            # nahled z cache snimku (stejny jako v nahledech GUI), jinak data okna
+            if hasattr(dicom_obj[2], "preview"):
+                self.ax.imshow(
+                    np.asarray(dicom_obj[2].preview(planar_type)),
+                    cmap="gray",
+                    vmin=0,
+                    vmax=255,
+                )
+            else:
+                self.ax.imshow(self.image, cmap="gray")
 
             # Inicializace prazdneho seznamu pro souradnice bodu ROI polygonu
             self.roi_points = []
@@ -244,6 +1516,12 @@ class ROI_drawer_manual:
             # Masku ROI nastavime na None, az se vybere polygon, bude vytvorena
             self.mask = None
 
+            # Mapa oblasti pred zacatkem kresleni - nova oblast se do ni vklada pod cislem label
+            self.label = label
+            self.base_labels = getattr(
+                dicom_obj[2], "ant_roi" if planar_type == "ant_pw" else "pos_roi", None
+            )
+
             # Vytvoreni PolygonSelector widgetu, ktery umoznuje interaktivne kreslit polygon
             # Parametr useblit=True zlepsuje vykon pri prekreslovani
             self.selector = PolygonSelector(self.ax, self.on_select, useblit=True)
@@ -269,13 +1547,15 @@ class ROI_drawer_manual:
                 bbox=dict(
                     facecolor="black", alpha=0.5
                 ),  # pozadi textu s polopruzracnym cernym boxem
+                animated=True,  # kresli se blitovanim nad ulozenym pozadim
             )
 
-            # Inicializace promennych, ktere budou slouzit k vykreslovani ROI
-            self.contour = None  # cervena hranice ROI - bude ulozena contourova linka
-            self.polygon_patch = None  # zeleny polygon kolem ROI (patch objekt)
-            self.point_patches = []  # seznam patch objektu pro jednotlive body polygonu
-            self.point_radius = 1  # polomer kruznic pro body polygonu, zvoleno male
+            # Inicializace promennych, ktere budou slouzit k vykreslovani ROI.
+            # Vytvori se pri prvnim vykresleni a dale se jim jen meni data (animated artisty)
+            self.contour = None  # cervena hranice ROI - uzavrena linka polygonu
+            self.polygon_patch = None  # zelena vypln ROI (patch objekt)
+            self.point_patches = []  # znacky bodu polygonu (jedna linka se vsemi body)
+            self.point_size = 5  # velikost znacek bodu polygonu (body)
 
         except Exception as e:
             # Pokud nastane chyba pri inicializaci, vypis ji a prehod vyjimku dale
@@ -285,14 +1565,37 @@ class ROI_drawer_manual:
     def show(self):
         """
         Metoda pro zobrazeni grafickeho okna s obrazkem a moznosti kresleni ROI.
-        Zavola plt.show(), ktere blokuje dalsi beh programu dokud okno neni zavreno.
+        Samostatne okno: zavola plt.show(), ktere blokuje dalsi beh programu
+        dokud okno neni zavreno. Vlozeny editor: jen vykresli platno (neblokuje,
+        udalosti obsluhuje hlavni smycka Tk).
         """
         try:
-            plt.show()
+            if self.canvas is None:
+                plt.show()
+            else:
+                self.canvas.draw()
         except Exception as e:
             print(f"Error displaying ROI selection: {e}")
             raise Exception(f"Error displaying ROI selection: {e}")
 
+    def close(self):
+        """
+        Ukonceni editoru - odpoji udalosti, dokonci naplanovane prekresleni nahledu
+        a uvolni platno, aby opakovane segmentace nezvysovaly pamet.
+        """
+        try:
+            self.selector.disconnect_events()
+            self.overlay.finish()
+            if self.canvas is None:
+                plt.close(self.fig)
+            else:
+                self.canvas.get_tk_widget().destroy()
+                self.canvas = None
+            self.fig.clear()
+        except Exception as e:
+            print(f"Error closing ROI editor: {e}")
+            raise Exception(f"Error closing ROI editor: {e}")
+
     def on_select(self, verts):
         """
         Callback funkce, ktera je volana PolygonSelectorem po dokonceni (nebo uprave) polygonu ROI.
@@ -318,14 +1621,14 @@ class ROI_drawer_manual:
     def create_mask(self):
         """
         Vytvori binarni masku ROI ve forme 2D numpy pole shodne velikosti s obrazkem.
-        Masku vytvori pomoci matplotlib.path.Path a funkce contains_points,
-        ktera zjisti, ktere pixely patri do polygonu ROI.
+        Masku vytvori funkce polygon_mask, ktera polygon rasterizuje po radcich
+        jen v jeho ohranicujicim obdelniku.
 
         Postup:
-        - z bodu polygonu vytvori Path objekt
-        - vytvori grid souradnic vsech pixelu (x,y)
-        - zjisti, ktere pixely jsou uvnitr polygonu
+        - pro kazdy radek pixelu v rozsahu polygonu najde pruseciky s hranami
+        - useky mezi dvojicemi pruseciku vyplni
         - vysledek ve tvaru 2D pole True/False ulozi do self.mask
+          (pri opakovanem volani se stejnymi body se vezme z cache)
         """
         try:
             if not self.roi_points or len(self.roi_points) < 3:
@@ -333,153 +1636,110 @@ class ROI_drawer_manual:
                 self.mask = np.zeros_like(self.image, dtype=bool)
                 return
 
-            height, width = self.image.shape
-            y, x = np.mgrid[:height, :width]
-            points = np.vstack((x.ravel(), y.ravel())).T
-
-            path = Path(self.roi_points)
-            mask = path.contains_points(points)
-            self.mask = mask.reshape(self.image.shape)
+            self.mask = polygon_mask(self.image.shape, self.roi_points)
 
         except Exception as e:
             raise Exception(f"Error creating mask: {str(e)}")
 
-    def remove_old_artists(self):
-        """
-        Pomocna metoda, ktera odstrani stare vykreslene objekty ROI z axes,
-        aby nedochazelo k prekryvani nebo mnozstvi cary/bodu pri prekresleni.
-
-        Odstrani:
-        - cervene contour linie ROI
-        - zeleny polygon patch
-        - kruznice reprezentujici body polygonu
-        """
-        # Odstraneni contour linky pokud existuje
-        if self.contour is not None:
-            if hasattr(
-                self.contour, "collections"
-            ):  # contour muze mit vice kolekci (line segments)
-                for coll in self.contour.collections:
-                    coll.remove()
-            self.contour = None
-
-        # Odstraneni polygonu (zeleny ram) pokud existuje
-        if self.polygon_patch is not None:
-            self.polygon_patch.remove()
-            self.polygon_patch = None
-
-        # Odstraneni vsech bodu polygonu (kruznice)
-        for p in self.point_patches:
-            p.remove()
-        self.point_patches.clear()  # vycisteni seznamu patch objektu
-
     def display_results(self):
         """
-        Metoda pro prekresleni axes s aktualnim obrazkem a vykreslenim ROI polygonu a hranice.
-        Postup:
-        - vycistit axes (odstranit vse)
-        - vykreslit obrazek (pozadi)
-        - vykreslit cervenou hranici ROI (contour) podle binarni masky
-        - vykreslit zeleny polygon kolem ROI
-        - vykreslit jednotlive body polygonu jako male zelené kruznice
-        - vytvorit a zobrazit text s pixelovou hodnotou (pocatecne prazdny)
-        - provest redraw canvas pro aktualizaci obrazku
+        Metoda pro prekresleni ROI polygonu a hranice nad obrazkem.
+        Obrazek se vykresli jen jednou (v konstruktoru) a je soucasti ulozeneho pozadi;
+        ROI tvori trvale animated artisty, kterym se pri kazde uprave jen zmeni data:
+        - cervena hranice ROI (uzavrena linka primo z bodu polygonu)
+        - zelena polopruhledna vypln polygonu
+        - body polygonu jako jedna linka se znackami
+        Prekresli se jen tyto artisty blitovanim (viz _blit).
         """
         try:
-            self.ax.cla()  # vycisteni axes od vsech grafickych prvku
-
-            self.ax.imshow(self.image, cmap="gray")  # vykresleni podkladoveho obrazku
-
-            # Pokud existuje maska, vykresli cervenou hranici ROI pomoci contour
-            if self.mask is not None:
-                self.contour = self.ax.contour(self.mask, colors="r", linewidths=2)
-            else:
-                self.contour = None
-
-            # Pokud mame alespon dva body polygonu, vykresli zeleny polygon patch
-            if len(self.roi_points) >= 2:
+            if self.contour is None:
+                self.contour = Line2D(
+                    [], [], color="r", linewidth=2, animated=True, zorder=3
+                )
+                self.ax.add_line(self.contour)
+            if self.polygon_patch is None:
                 self.polygon_patch = Polygon(
-                    self.roi_points,
+                    [(0, 0)],
                     closed=True,
-                    fill=False,
-                    edgecolor="lime",
-                    linewidth=2,
+                    facecolor="lime",
+                    edgecolor="none",
+                    alpha=0.15,
+                    animated=True,
+                    zorder=2,
                 )
                 self.ax.add_patch(self.polygon_patch)
-
-            # Vykresli jednotlive body polygonu jako male zelené kruznice
-            self.point_patches.clear()
-            for x, y in self.roi_points:
-                circ = Circle(
-                    (x, y), radius=self.point_radius, color="lime", picker=True
+            if not self.point_patches:
+                body = Line2D(
+                    [],
+                    [],
+                    linestyle="none",
+                    marker="o",
+                    markersize=self.point_size,
+                    color="lime",
+                    animated=True,
+                    zorder=4,
                 )
-                self.ax.add_patch(circ)
-                self.point_patches.append(circ)
+                self.ax.add_line(body)
+                self.point_patches.append(body)
 
-            # Vytvoreni textoveho prvku pro hodnotu pixelu (zatim prazdny)
-            self.text = self.ax.text(
-                0.05,
-                0.95,
-                "",
-                transform=self.ax.transAxes,
-                color="yellow",
-                fontsize=12,
-                bbox=dict(facecolor="black", alpha=0.5),
-            )
+            xs = [x for x, _ in self.roi_points]
+            ys = [y for _, y in self.roi_points]
+
+            # Hranice ROI - uzavrena linka pres vrcholy (bez pocitani contour z masky)
+            if len(self.roi_points) >= 2:
+                self.contour.set_data(xs + xs[:1], ys + ys[:1])
+                self.polygon_patch.set_xy(self.roi_points)
+                self.polygon_patch.set_visible(True)
+            else:
+                self.contour.set_data([], [])
+                self.polygon_patch.set_visible(False)
+            self.point_patches[0].set_data(xs, ys)
 
-            # Prekresleni canvas, aby se vse aktualizovalo
-            self.fig.canvas.draw_idle()
+            self._blit()
 
         except Exception as e:
             print(f"Error displaying ROI contour: {e}")
             raise Exception(f"Error displaying ROI contour: {e}")
 
+    def _blit(self):
+        # Prekresleni jen animated artistu (ROI, text s hodnotou pixelu) nad ulozenym
+        # pozadim s obrazkem. Pozadi spravuje PolygonSelector (useblit), ktery pri
+        # update() obnovi pozadi a vykresli i vsechny ostatni animated artisty osy;
+        # bez podpory blitovani na platne se pouzije draw_idle.
+        self.selector.update()
+
     def apply_roi_to_all_images(self, planar_type):
         """
         Metoda, ktera aplikuje aktualni ROI polygon na vsechny obrazky v slovniku dicom_obj.
 
-        Vykresli cervenou linku kolem ROI do kazdeho obrazku (pomoci Pillow draw.line)
-        a nasledne aktualizuje Tkinter Label widgety, ktere zobrazují obrazky v GUI.
+        Cervenou linku kolem ROI do nahledu kazdeho obrazku vykresli ROI_overlay_renderer,
+        ktery nasledne aktualizuje Tkinter Label widgety, ktere zobrazují obrazky v GUI
+        (se schedulerem az po ustaleni rychlych uprav).
 
         Dale nastavi do vsech dicom objektu binarni masku ROI pod atributy ant_roi nebo pos_roi
         podle planar_type.
 
-        Pozor: metoda predpoklada, ze kazdy objekt v dicom_obj ma metodu convert_to_image a
+        Pozor: metoda predpoklada, ze kazdy objekt v dicom_obj ma metodu preview
+        nebo convert_to_image (viz preview_image) a
         ze img_labels obsahuje odpovidajici Label widgety.
         """
         try:
-            for key in self.dicom_obj.keys():
-                # Prevod obrazku na RGB a vytvoreni kresliciho objektu Pillow
-                image = (
-                    self.dicom_obj[key].convert_to_image(self.planar_type)
-                ).convert("RGB")
-                draw = ImageDraw.Draw(image)
-
-                # Vytvoreni seznamu bodu jako int tuple pro kresleni polygonu (zakulaceni souradnic)
-                roi_points_int = [(int(x), int(y)) for x, y in self.roi_points]
-
-                # Vykresleni polygonu cervenou ciarou
-                if len(roi_points_int) > 1:
-                    # Přidání prvního bodu na konec seznamu pro uzavření polygonu
-                    roi_points_int.append(roi_points_int[0])
-                    draw.line(roi_points_int, fill="red", width=2)
-
-                # Konverze obrazku zpatky na Tkinter PhotoImage
-                tk_img = ImageTk.PhotoImage(
-                    image.resize(self.size_image, Image.Resampling.LANCZOS)
+            # ROI pro vsechny snimky: binarni maska, nebo mapa oblasti s vlozenou novou oblasti
+            roi = self.mask
+            if self.label is not None and self.mask is not None:
+                roi = set_roi_region(
+                    self.base_labels, self.mask, self.label, self.mask.shape
                 )
 
-                # Aktualizace Tkinter Labelu obrazku v GUI
-                self.img_labels[key].config(image=tk_img)
-                self.img_labels[
-                    key
-                ].image = tk_img  # ukladame referenci, aby nedoslo k odstraneni GC
-
-                # Nastaveni binarni masky do dicom objektu (podle planar_type)
+            for key in self.dicom_obj.keys():
+                # Nastaveni binarni masky (nebo mapy oblasti) do dicom objektu (podle planar_type)
                 if planar_type == "ant_pw":
-                    self.dicom_obj[key].ant_roi = self.mask
+                    self.dicom_obj[key].ant_roi = roi
                 else:
-                    self.dicom_obj[key].pos_roi = self.mask
+                    self.dicom_obj[key].pos_roi = roi
+
+            # Prekresleni obrysu v nahledech (pri rychlych upravach az po jejich ustaleni)
+            self.overlay.request(self.roi_points)
 
         except Exception as e:
             print(f"Error applying ROI to images: {e}")
@@ -505,8 +1765,11 @@ class ROI_drawer_manual:
                 return  # mimo rozsah
 
             value = self.image[y, x]
-            self.text.set_text(f"Pixel Value: {value:.2f}")
-            plt.draw()
+            text = f"Pixel Value: {value:.2f}"
+            if text == self.text.get_text():
+                return  # stejny pixel - neni co prekreslovat
+            self.text.set_text(text)
+            self._blit()
 
         except Exception as e:
             raise Exception(f"Error displaying pixel value: {str(e)}")
@@ -534,33 +1797,59 @@ def premenovy_zakon(aktivita, reference_time, nynejsi_time):
         raise Exception(f"Error in decay correction: {e}")
 
 
-def tew_correction(em_image, sc1_image, sc2_image):
+# Vychozi relativni sirky oken pro TEW, pokud je DICOM hlavicka neobsahuje
+# (fotopik 20 %, rozptylova okna 6 %)
+TEW_SIRKY = {"pw": 0.2, "lsw": 0.06, "usw": 0.06}
+
+# Pocet radku snimku zpracovanych najednou pri pixelove TEW korekci cele studie
+TEW_CHUNK_ROWS = 32
+
+
+def tew_correction(
+    em_image,
+    sc1_image,
+    sc2_image,
+    em_width=TEW_SIRKY["pw"],
+    sc1_width=TEW_SIRKY["usw"],
+    sc2_width=TEW_SIRKY["lsw"],
+    out=None,
+):
     """
     Provede korekci rozptylu pomoci metody Triple Energy Window (TEW).
 
     Metoda TEW pouziva dve vedlejsi okna na odhad rozptylu,
-    ktery je odecten od emisniho obrazu pro odstraneni vlivu rozptylu.
+    ktery je odecten od emisniho obrazu pro odstraneni vlivu rozptylu:
+    rozptyl = (sc1 / w_sc1 + sc2 / w_sc2) * w_em / 2.
+    Sirky oken (ve stejnych jednotkach, napr. keV) se mohou broadcastovat se snimky.
+    `out` je volitelna dvojice predalokovanych poli (korigovany obraz, nejistota).
     """
 
     try:
-        # Vypocet chyb (standardni odchylky) jako odmocnina poctu castic (Poissonova statistika)
-        em_error = np.sqrt(em_image)
-        sc1_error = np.sqrt(sc1_image)
-        sc2_error = np.sqrt(sc2_image)
-
-        # Odhad rozptylu jako prumer upravenych hodnot z dvou rozptylovych oken
-        # Koeficienty 0.06 a 0.2 jsou experimentalne urcene vahy/metricke konstanty
-        scatter_estimate = (sc1_image / 0.06 + sc2_image / 0.06) * (0.2 / 2)
+        # Vysledky v pracovnim typu (float32), u vstupu ve float64 (cetnosti) ve float64.
+        # Pocita se jen ve dvou vystupnich polich, mezivysledky jsou in-place.
+        dtype = np.result_type(em_image, sc1_image, sc2_image, WORK_DTYPE)
+        a1 = np.asarray(em_width, dtype=np.float64) / (2 * np.asarray(sc1_width))
+        a2 = np.asarray(em_width, dtype=np.float64) / (2 * np.asarray(sc2_width))
+        if out is None:
+            shape = np.broadcast_shapes(
+                np.shape(em_image), np.shape(sc1_image), np.shape(sc2_image)
+            )
+            out = (np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype))
+        corrected_image, corrected_uncertainty = out
 
-        # Vypocet nejistoty odhadu rozptylu z nejistot jednotlivych rozptylovych oken
-        scatter_uncertainty = 0.2 / (2 * 0.06) * np.sqrt(sc1_error**2 + sc2_error**2)
+        # Nejistota (Poissonova statistika, rozptyl = pocet impulzu) z nezavislych chyb
+        # emisniho obrazu a odhadu rozptylu: sqrt(em + a1^2 * sc1 + a2^2 * sc2)
+        np.multiply(sc1_image, a1 * a1, out=corrected_uncertainty, casting="unsafe")
+        corrected_uncertainty += sc2_image * (a2 * a2)
+        corrected_uncertainty += em_image
+        np.sqrt(corrected_uncertainty, out=corrected_uncertainty)
 
         # Korekce emisniho obrazu odectenim odhadu rozptylu,
         # soucasne orezani na minimum 0, aby nebyly zaporne hodnoty
-        corrected_image = np.clip(em_image - scatter_estimate, a_min=0, a_max=None)
-
-        # Nejistota korektniho obrazu spocitana jako suma chyb emisniho obrazu a rozptylu (nezavisle chyby)
-        corrected_uncertainty = np.sqrt(em_error**2 + scatter_uncertainty**2)
+        np.multiply(sc1_image, a1, out=corrected_image, casting="unsafe")
+        corrected_image += sc2_image * a2
+        np.subtract(em_image, corrected_image, out=corrected_image, casting="unsafe")
+        np.clip(corrected_image, 0, None, out=corrected_image)
 
         # Vrati korektni obraz a jeho nejistotu
         return corrected_image, corrected_uncertainty
@@ -571,6 +1860,416 @@ def tew_correction(em_image, sc1_image, sc2_image):
         raise Exception(f"Error in TEW correction: {e}")
 
 
+def tew_widths(energy_windows, projection="ant"):
+    """
+    Sirky oken (pw, usw, lsw) projekce pro tew_correction ze slovniku sirek oken
+    dicom_image.energy_windows; bez nej vychozi TEW_SIRKY.
+    """
+    if not energy_windows:
+        return TEW_SIRKY["pw"], TEW_SIRKY["usw"], TEW_SIRKY["lsw"]
+    return tuple(
+        energy_windows[f"{projection}_{okno}"] for okno in ("pw", "usw", "lsw")
+    )
+
+
+def tew_correct_study(
+    dicom_images, projections=("ant", "pos"), chunk_rows=TEW_CHUNK_ROWS
+):
+    """
+    Pixelova TEW korekce PW oken cele studie. Pro kazdou projekci vrati dvojici poli
+    (casovy bod x H x W, WORK_DTYPE): snimky korigovane na rozptyl a mapy jejich
+    Poissonovy nejistoty. Sirky oken se berou z DICOM hlavicky kazdeho snimku.
+    Pocita se po blocich `chunk_rows` radku, takze docasna pole maji velikost bloku
+    a ne celeho zasobniku. Vysledek lze pouzit pro soucty v ROI, nahledy i export.
+    """
+    try:
+        study = study_stack.of(dicom_images)
+        T, _, H, W = study.data.shape
+        vysledky = {}
+
+        for projection in projections:
+            sirky = np.array(
+                [
+                    tew_widths(dicom_images[key].energy_windows, projection)
+                    for key in study.keys
+                ]
+            ).reshape(T, 3, 1, 1)
+            pw = study.window(f"{projection}_pw")
+            usw = study.window(f"{projection}_usw")
+            lsw = study.window(f"{projection}_lsw")
+            corrected = np.empty((T, H, W), dtype=WORK_DTYPE)
+            uncertainty = np.empty((T, H, W), dtype=WORK_DTYPE)
+
+            for start in range(0, H, chunk_rows):
+                rows = slice(start, start + chunk_rows)
+                tew_correction(
+                    pw[:, rows],
+                    usw[:, rows],
+                    lsw[:, rows],
+                    sirky[:, 0],
+                    sirky[:, 1],
+                    sirky[:, 2],
+                    out=(corrected[:, rows], uncertainty[:, rows]),
+                )
+            vysledky[projection] = (corrected, uncertainty)
+
+        return vysledky
+
+    except Exception as e:
+        print(f"Error in pixel-wise TEW correction: {e}")
+        raise Exception(f"Error in pixel-wise TEW correction: {e}")
+
+
+# Maximum namerene cetnosti paralyzabilniho modelu: R_m * tau <= 1/e
+DT_MAX_X = 1.0 / np.e
+
+
+def _check_dt_range(x):
+    # Nad 1/e nema paralyzabilni model reseni (W je komplexni) - namerena cetnost
+    # nemuze byt realna, misto nefyzikalniho faktoru se vyhodi chyba
+    x_max = np.max(x, initial=0.0)
+    if x_max > DT_MAX_X:
+        raise ValueError(
+            f"measured rate exceeds the paralyzable model maximum "
+            f"(R_m * tau = {x_max:.4f} > 1/e)"
+        )
+
+
+def dt_correction_factor(merena_cetnost, mrtva_doba):
+    """
+    Vypocita korekcni faktor na mrtvou dobu paralyzabilniho modelu detektoru.
+    R_corr = -REAL(W(-R_m * tau)) / tau, korekcni faktor = R_corr / R_m.
+    Funguje jak pro skalary, tak pro numpy pole namerenych cetnosti.
+    Pri nulove cetnosti je faktor 1, pri R_m * tau > 1/e se vyhodi chyba.
+    """
+    try:
+        x = np.asarray(merena_cetnost * mrtva_doba, dtype=np.float64)
+        _check_dt_range(x)
+        # Teoreticka (skutecna) cetnost pomoci hlavni vetve Lambertovy W funkce
+        with np.errstate(divide="ignore", invalid="ignore"):
+            teoreticka_cetnost = -np.real(lambertw(-x, k=0)) / mrtva_doba
+            # Korekcni faktor jako pomer teoreticke a namerene cetnosti
+            faktor = np.where(x == 0, 1.0, teoreticka_cetnost / merena_cetnost)
+        return faktor[()]
+
+    except Exception as e:
+        print(f"Error computing dead time correction factor: {e}")
+        raise Exception(f"Error computing dead time correction factor: {e}")
+
+
+# Tabulka korekcnich faktoru paralyzabilniho modelu: pro y = -W(-x) z [0, 1] je
+# x = R_m * tau = y * exp(-y) z fyzikalniho rozsahu [0, 1/e] a faktor y / x = exp(y).
+# Interpoluje se v promenne s = sqrt(1 - e * x), ve ktere je faktor hladky i u x = 1/e,
+# kde ma W odmocninovou singularitu (relativni chyba interpolace ~1e-8).
+_DT_TABLE_Y = np.linspace(1.0, 0.0, 4097)
+_DT_TABLE_S = np.sqrt(np.clip(1.0 - np.e * _DT_TABLE_Y * np.exp(-_DT_TABLE_Y), 0, None))
+_DT_TABLE_FACTOR = np.exp(_DT_TABLE_Y)
+
+
+def dt_correction_factor_table(merena_cetnost, mrtva_doba):
+    """
+    Korekcni faktor na mrtvou dobu jako dt_correction_factor, ale bez volani lambertw:
+    faktor se interpoluje z predpocitane tabulky hlavni vetve W (np.interp), coz je
+    rychle i pro cele mapy cetnosti. Nulova cetnost ma faktor 1, cetnosti nad
+    maximem paralyzabilniho modelu (R_m * tau > 1/e) vyhodi chybu stejne jako
+    dt_correction_factor.
+    """
+    try:
+        x = np.asarray(merena_cetnost * mrtva_doba, dtype=np.float64)
+        _check_dt_range(x)
+        s = np.sqrt(np.clip(1.0 - np.e * x, 0.0, 1.0))
+        return np.interp(s, _DT_TABLE_S, _DT_TABLE_FACTOR)
+
+    except Exception as e:
+        print(f"Error computing dead time correction factor: {e}")
+        raise Exception(f"Error computing dead time correction factor: {e}")
+
+
+# Vychozi sigma (pixely) vyhlazeni map cetnosti pro pixelovou korekci na mrtvou dobu
+DT_MAP_SIGMA = 3.0
+
+
+def dt_correction_map(frames, acq_dur, mrtva_doba, sigma=DT_MAP_SIGMA, out=None):
+    """
+    Pixelova mapa korekcnich faktoru na mrtvou dobu pro snimky `frames` (... x H x W).
+    Mrtva doba je vlastnost celeho detektoru - celkovy faktor snimku f se spocita
+    z jeho celkove cetnosti (jako globalni korekce) a ztraty (f - 1) se rozdeli mezi
+    pixely umerne lokalni hustote impulzu vyhlazene gaussian_filter (sigma v pixelech):
+    faktor = 1 + (f - 1) * s / s_vazeny, kde s_vazeny je prumer vyhlazene mapy vazeny
+    impulzy. Vazeny prumer faktoru je tedy presne f (celkova korigovana cetnost odpovida
+    globalni korekci), rovnomerny snimek ma vsude f a horke misto vetsi faktor nez
+    studene pozadi.
+    `acq_dur` a `mrtva_doba` se broadcastuji pres osy pred H x W.
+    `out` je volitelne predalokovane pracovni pole (WORK_DTYPE) pro vyhlazene snimky,
+    do ktereho se zapise i vysledna mapa faktoru (vraci se `out`).
+    """
+    frames = np.asarray(frames)
+    if out is None:
+        out = np.empty(frames.shape, dtype=WORK_DTYPE)
+    gaussian_filter(
+        frames,
+        sigma=(0,) * (frames.ndim - 2) + (sigma, sigma),
+        output=out,
+        mode="nearest",
+    )
+
+    # Celkove faktory vsech snimku jednim volanim (nad 1/e vyhodi chybu)
+    lead = out.shape[:-2]
+    impulzy = frames.sum(axis=(-2, -1), dtype=np.float64)
+    acq_dur = np.broadcast_to(np.asarray(acq_dur, dtype=np.float64), lead + (1, 1))
+    mrtva_doba = np.broadcast_to(
+        np.asarray(mrtva_doba, dtype=np.float64), lead + (1, 1)
+    )
+    faktory = dt_correction_factor_table(
+        impulzy / acq_dur[..., 0, 0], mrtva_doba[..., 0, 0]
+    )
+
+    # Faktory se prepisi do `out` po snimcich - docasna pole float64 maji velikost
+    # jen jednoho snimku
+    for i in np.ndindex(lead):
+        vazena = np.einsum("ij,ij->", frames[i], out[i], dtype=np.float64)
+        if vazena > 0:
+            out[i] *= (faktory[i] - 1.0) * impulzy[i] / vazena
+            out[i] += 1.0
+        else:
+            # Prazdny snimek nema ztraty
+            out[i] = 1.0
+    return out
+
+
+def apply_dt_correction(dicom_images, md_data, sigma=None, progress=None):
+    """
+    Aplikuje korekci na mrtvou dobu na vsechny snimky ve slovniku `dicom_images`
+    pro vsechna okna uvedena v `md_data` ({okno: mrtva doba v s}).
+    Vsechny snimky a okna se koriguji najednou nad zasobnikem studie (study_stack),
+    data se prepisuji in-place. Se `sigma` se koriguje pixelove (dt_correction_map).
+    `progress` jsou kontrolni body prubehu a zruseni (viz study_stack.dt_correction).
+    Vraci slovnik {index: {okno: (namerena cetnost, korekcni faktor)}} pro zapis do reportu.
+    """
+    try:
+        study = study_stack.of(dicom_images)
+        merene_cetnosti, kor_faktory = study.dt_correction(md_data, sigma, progress)
+
+        return {
+            index: {
+                key: (merene_cetnosti[t, j], kor_faktory[t, j])
+                for j, key in enumerate(md_data)
+            }
+            for t, index in enumerate(study.keys)
+        }
+
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"Error in dead time correction: {e}")
+        raise Exception(f"Error in dead time correction: {e}")
+
+
+def roi_count_rates(dicom_images, windows, oblast=None):
+    """
+    Spocita cetnosti (cps) v ROI pro zadana okna vsech snimku studie najednou.
+    Anteriorni okna pouzivaji ant_roi, posteriorni pos_roi (ROI je stejna pro vsechny snimky).
+    U map oblasti se bez `oblast` pocita sjednoceni vsech oblasti, jinak jen zadana
+    oblast (nazev z OBLASTI_ROI, viz region_labels).
+    Vraci slovnik {okno: pole cetnosti pres casove body}.
+    """
+    try:
+        if oblast is not None:
+            first = next(iter(dicom_images.values()))
+            labels = region_labels((first.ant_roi, first.pos_roi), oblast)
+            rates = region_count_rates(dicom_images, windows)
+            return {window: rates[window][:, labels].sum(axis=1) for window in windows}
+
+        study = study_stack.of(dicom_images)
+        first = dicom_images[study.keys[0]]
+        needs_pos = any(window.startswith("pos") for window in windows)
+        rates = study.roi_rates(
+            first.ant_roi,
+            first.pos_roi if needs_pos else None,
+            study_offsets(dicom_images),
+        )
+        return {window: rates[:, study.index(window)] for window in windows}
+
+    except Exception as e:
+        print(f"Error computing ROI count rates: {e}")
+        raise Exception(f"Error computing ROI count rates: {e}")
+
+
+def region_count_rates(dicom_images, windows):
+    """
+    Cetnosti (cps) vsech oblasti map ROI (ant_roi/pos_roi jako label mapy) pro zadana
+    okna vsech snimku jednim pruchodem. Vraci slovnik {okno: pole (casovy bod x oblast)},
+    sloupec 0 je pozadi (nulovy).
+    """
+    try:
+        study = study_stack.of(dicom_images)
+        first = dicom_images[study.keys[0]]
+        needs_pos = any(window.startswith("pos") for window in windows)
+        rates = study.region_rates(
+            first.ant_roi,
+            first.pos_roi if needs_pos else None,
+            study_offsets(dicom_images),
+        )
+        return {window: rates[:, study.index(window)] for window in windows}
+
+    except Exception as e:
+        print(f"Error computing region count rates: {e}")
+        raise Exception(f"Error computing region count rates: {e}")
+
+
+# Oblasti stitne zlazy a jejich cisla v mape ROI. Uzly maji cisla od 4 vyse
+# (kazdy dalsi uzel dostane nove cislo) a lezi nad laloky, cela zlaza je sjednoceni
+# vsech oblasti a lalok zahrnuje i uzly nakreslene uvnitr nej.
+OBLASTI_ROI = {"Whole thyroid gland": 1, "Right lobe": 2, "Left lobe": 3, "Node": 4}
+
+
+def region_label(labels, oblast):
+    """
+    Cislo oblasti pro nove nakreslenou ROI typu `oblast` v mape `labels`.
+    Kazdy novy uzel dostane dalsi volne cislo (>= 4).
+    """
+    label = OBLASTI_ROI[oblast]
+    if oblast == "Node" and labels is not None and np.size(labels):
+        label = max(label, int(np.max(labels)) + 1)
+    return label
+
+
+def set_roi_region(labels, mask, label, shape=None):
+    """
+    Vrati novou mapu oblasti, kde pixely masky `mask` patri oblasti `label`.
+    Predchozi pixely teto oblasti se smazou; pri prekryvu plati nove nakreslena oblast,
+    jen uzly zustavaji nad laloky (prekreslenim laloku se uzel uvnitr nesmaze).
+    Binarni maska na vstupu se bere jako mapa s jedinou oblasti 1.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if labels is None:
+        labels = np.zeros(mask.shape if shape is None else shape, dtype=np.int16)
+    else:
+        labels = np.asarray(labels).astype(np.int16)
+    labels[labels == label] = 0
+    if label < OBLASTI_ROI["Node"]:
+        mask = mask & (labels < OBLASTI_ROI["Node"])
+    labels[mask] = label
+    return labels
+
+
+def nested_nodes(labels, lobe):
+    """
+    Cisla uzlu mapy oblasti `labels` nakreslenych uvnitr oblasti `lobe`. Pixely
+    laloku pod uzlem uzel prepsal, uzel do laloku patri, pokud nejcastejsi oblasti
+    v jeho okoli (sousedni pixely mimo uzly) je `lobe`.
+    Binarni maska nebo ploche indexy (jedina oblast) zadne uzly nemaji.
+    """
+    labels = np.asarray(labels)
+    if labels.ndim != 2 or labels.dtype == bool:
+        return []
+    nodes = []
+    for node in np.unique(labels[labels >= OBLASTI_ROI["Node"]]):
+        okoli = labels[
+            binary_dilation(labels == node) & (labels < OBLASTI_ROI["Node"])
+        ]
+        if okoli.size and np.bincount(okoli.astype(np.intp)).argmax() == lobe:
+            nodes.append(int(node))
+    return nodes
+
+
+def region_labels(label_maps, oblast):
+    """
+    Cisla oblasti, ktere se secitaji pro vyhodnoceni oblasti `oblast`: cela zlaza je
+    sjednoceni vsech oblasti, uzly vsechny oblasti >= 4, laloky svoje cislo a uzly
+    nakreslene uvnitr nich (nested_nodes).
+    Pokud oblast nakreslena neni (jedina ROI jako driv), pouzije se cela ROI.
+    """
+    present = np.unique(
+        [
+            int(label)
+            for m in label_maps
+            if m is not None
+            # Ploche indexy nebo binarni maska jsou jedina oblast 1
+            for label in (
+                np.unique(m) if np.ndim(m) == 2 and np.asarray(m).dtype != bool else [1]
+            )
+            if label > 0
+        ]
+    ).astype(np.intp)
+    if oblast == "Whole thyroid gland":
+        selected = present
+    elif oblast == "Node":
+        selected = present[present >= OBLASTI_ROI["Node"]]
+    else:
+        lobe = OBLASTI_ROI[oblast]
+        selected = present[present == lobe]
+        if selected.size:
+            selected = np.union1d(
+                selected,
+                [
+                    node
+                    for m in label_maps
+                    if m is not None
+                    for node in nested_nodes(m, lobe)
+                ],
+            ).astype(np.intp)
+    if not selected.size:
+        selected = present
+    return [int(label) for label in selected]
+
+
+# Okna potrebna pro jednotlive typy korekce pri vyhodnoceni uptake
+OKNA_PRO_KOREKCI = {
+    "ACSC": ("ant_pw", "ant_usw", "ant_lsw", "pos_pw", "pos_usw", "pos_lsw"),
+    "SC": ("ant_pw", "ant_usw", "ant_lsw"),
+    "AC": ("ant_pw", "pos_pw"),
+    "No corr": ("ant_pw",),
+}
+
+
+def compute_uptake(
+    cetnosti, typ_korekce, kal_data, podana_aktivita, energy_windows=None
+):
+    """
+    Prepocita cetnosti v ROI na frakcni uptake podane aktivity.
+
+    - cetnosti: slovnik {okno: pole cetnosti (cps) pres casove body}
+    - typ_korekce: 'ACSC', 'SC', 'AC' nebo 'No corr'
+    - kal_data: kalibracni faktory {typ korekce: cps/MBq}
+    - podana_aktivita: podana aktivita v MBq
+    - energy_windows: sirky oken {okno: keV} z DICOM hlavicky (None = TEW_SIRKY)
+    """
+    try:
+        c = {key: np.asarray(value) for key, value in cetnosti.items()}
+
+        if typ_korekce == "ACSC":
+            # TEW korekce obou projekci a geometricky prumer
+            hodnoty_ant = tew_correction(
+                c["ant_pw"], c["ant_usw"], c["ant_lsw"], *tew_widths(energy_windows)
+            )[0]
+            hodnoty_pos = tew_correction(
+                c["pos_pw"],
+                c["pos_usw"],
+                c["pos_lsw"],
+                *tew_widths(energy_windows, "pos"),
+            )[0]
+            hodnoty = np.sqrt(hodnoty_ant * hodnoty_pos) / kal_data[typ_korekce]
+        elif typ_korekce == "SC":
+            # Pouze anteriorni projekce s TEW korekci
+            hodnoty_ant = tew_correction(
+                c["ant_pw"], c["ant_usw"], c["ant_lsw"], *tew_widths(energy_windows)
+            )[0]
+            hodnoty = hodnoty_ant / kal_data[typ_korekce]
+        elif typ_korekce == "AC":
+            # Geometricky prumer PW oken bez korekce rozptylu
+            hodnoty = np.sqrt(c["ant_pw"] * c["pos_pw"]) / kal_data[typ_korekce]
+        else:
+            # Bez korekce - jen anteriorni PW okno
+            hodnoty = c["ant_pw"] / kal_data[typ_korekce]
+
+        return hodnoty / podana_aktivita
+
+    except Exception as e:
+        print(f"Error computing uptake: {e}")
+        raise Exception(f"Error computing uptake: {e}")
+
+
 def compute_time_differences(reference_date_time, dates, times):
     """
     Vypocita casove rozdily v hodinach vzhledem k referencnimu datu a casu.
@@ -719,21 +2418,107 @@ def riu_uptace_fce(x, k_t, k_B, k_T):
     return (k_t / (k_B - k_T)) * (np.exp(-k_T * x) - np.exp(-k_B * x))
 
 
+def riu_jacobian(x, k_t, k_B, k_T):
+    """
+    Analyticka Jacobiho matice riu_uptace_fce podle parametru (k_t, k_B, k_T),
+    pole (bod x parametr). Parametry se mohou broadcastovat s casy (napr. sloupce
+    parametru (pacient x 1) a casy (pacient x bod) daji pole (pacient x bod x parametr)).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    d = k_B - k_T
+    exp_B = np.exp(-k_B * x)
+    exp_T = np.exp(-k_T * x)
+    rozdil = exp_T - exp_B
+    return np.stack(
+        (
+            rozdil / d,
+            k_t / d * (x * exp_B - rozdil / d),
+            k_t / d * (rozdil / d - x * exp_T),
+        ),
+        axis=-1,
+    )
+
+
+# Pocatecni odhady parametru RIU, pokud je z dat nelze odvodit
+RIU_PARAMS_DEFAULT = (0.05, 0.1, 0.005)
+
+
+def riu_initial_params(cas_h, riu_values):
+    """
+    Pocatecni odhad (k_t, k_B, k_T) z dat v uzavrenem tvaru. Pozdni body (od maxima)
+    klesaji priblizne jako A * exp(-k_T * t), takze k_T a A = k_t / (k_B - k_T) dava
+    linearni fit logaritmu. Body pred maximem pak urci k_B z
+    exp(-k_B * t) = exp(-k_T * t) - y / A (median odhadu).
+    Pracuje i s poli (pacient x casovy bod) - odhady vsech pacientu najednou
+    (cohort_fit), pak vraci pole (pacient x 3). Kde data odhad neumozni,
+    pouzije se RIU_PARAMS_DEFAULT.
+    """
+    cas_h = np.asarray(cas_h, dtype=np.float64)
+    riu_values = np.asarray(riu_values, dtype=np.float64)
+    jeden = riu_values.ndim == 1
+    riu_values = np.atleast_2d(riu_values)
+    cas_h = np.broadcast_to(cas_h, riu_values.shape)
+
+    index = np.arange(riu_values.shape[1])
+    peak = np.argmax(riu_values, axis=1)[:, None]
+
+    # Linearni regrese log(y) ~ t pres pozdni body (maskovane soucty)
+    late = (index >= peak) & (riu_values > 0)
+    n = late.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        log_y = np.where(late, np.log(np.where(late, riu_values, 1.0)), 0.0)
+        t = np.where(late, cas_h, 0.0)
+        sum_t, sum_y = t.sum(axis=1), log_y.sum(axis=1)
+        slope = (n * (t * log_y).sum(axis=1) - sum_t * sum_y) / (
+            n * (t * t).sum(axis=1) - sum_t**2
+        )
+        intercept = (sum_y - slope * sum_t) / n
+        k_T = -slope
+        amplitude = np.exp(intercept)
+
+        # k_B z bodu pred maximem (body od maxima lezi na prolozene primce, zbytek ~ 0)
+        early = (index < peak) & (cas_h > 0)
+        zbytek = np.exp(-k_T[:, None] * cas_h) - riu_values / amplitude[:, None]
+        ok = early & (zbytek > 0)
+        odhady = np.where(ok, -np.log(np.where(ok, zbytek, 1.0)) / cas_h, np.nan)
+        k_B = np.where(
+            ok.any(axis=1),
+            np.nanmedian(np.where(ok.any(axis=1)[:, None], odhady, 0.0), axis=1),
+            10 * k_T,
+        )
+
+    params = np.column_stack((amplitude * (k_B - k_T), k_B, k_T))
+    valid = (n >= 2) & np.isfinite(k_B) & np.isfinite(k_T)
+    valid &= (k_B > k_T) & (k_T > 0)
+    params[~valid] = RIU_PARAMS_DEFAULT
+    if jeden:
+        return tuple(float(p) for p in params[0])
+    return params
+
+
 def riu_fit(x_a_y_data, y_err=None):
+    """
+    Fit modelu riu_uptace_fce (Levenberg-Marquardt s analytickou Jacobiho matici)
+    z pocatecniho odhadu riu_initial_params - jedno reseni misto opakovanych fitu.
+    Vahovani, chyby parametru a kovariance odpovidaji lmfit.Model.fit
+    (rezidua nasobena vahami, kovariance skalovana redukovanym chi^2).
+    Vraci (parametry, chyby parametru, kovariancni matice).
+    """
     try:
         # Rozdeli vstupni data na cas (x) a hodnoty RIU (y)
-        cas_h = np.array(x_a_y_data[0])  # cas v hodinach
-        riu_values = np.array(x_a_y_data[1])  # namerene hodnoty RIU
-
-        # Vytvori model na zaklade funkce riu_uptace_fce
-        model = Model(riu_uptace_fce)
-
-        # Inicializuje parametry fitu s pocatecnimi odhady
-        params = model.make_params(k_t=0.05, k_B=0.1, k_T=0.005)
+        cas_h = np.array(x_a_y_data[0], dtype=np.float64)  # cas v hodinach
+        riu_values = np.array(x_a_y_data[1], dtype=np.float64)  # namerene hodnoty RIU
+        if cas_h.shape != riu_values.shape or cas_h.size < 3:
+            raise ValueError(
+                f"expected matching time and uptake arrays with at least 3 points, "
+                f"got {cas_h.shape} and {riu_values.shape}"
+            )
+        if not (np.all(np.isfinite(cas_h)) and np.all(np.isfinite(riu_values))):
+            raise ValueError("time and uptake values must be finite")
 
         if y_err is not None:
             # Pokud jsou zadane nejistoty hodnot y, prevede je na numpy pole
-            y_err = np.array(y_err)
+            y_err = np.array(y_err, dtype=np.float64)
 
             # Nulove hodnoty nejistot nahradi minimalni kladnou hodnotou, aby se vyhnulo deleni nulou
             y_err[y_err == 0] = np.min(y_err[y_err > 0])
@@ -742,34 +2527,88 @@ def riu_fit(x_a_y_data, y_err=None):
             weights = (1 / y_err) ** 2
         else:
             # Pokud nejsou zadane nejistoty, vahy nejsou pouzity
-            weights = None
+            weights = np.ones_like(riu_values)
 
-        # Fit provede v loopu 5 iteraci, cimz se snazi lepe konvergovat k optimu
-        for i in range(5):
-            result = model.fit(riu_values, params, x=cas_h, weights=weights)
-            params = result.params  # aktualizuje parametry pro dalsi iteraci
+        def rezidua(p):
+            return weights * (riu_uptace_fce(cas_h, *p) - riu_values)
 
-        # Vytažení hodnot parametru z vysledku fitu
-        k_t = result.params["k_t"].value
-        k_B = result.params["k_B"].value
-        k_T = result.params["k_T"].value
+        def jacobian(p):
+            return weights[:, None] * riu_jacobian(cas_h, *p)
 
-        # Vytažení standardnich odchylek (chyby) parametru z fitu
-        k_t_err = result.params["k_t"].stderr
-        k_B_err = result.params["k_B"].stderr
-        k_T_err = result.params["k_T"].stderr
+        result = least_squares(
+            rezidua,
+            riu_initial_params(cas_h, riu_values),
+            jac=jacobian,
+            method="lm",
+            xtol=1e-10,
+            ftol=1e-10,
+        )
 
-        # Vytažení kovarianční matice, ktera popisuje korelace mezi parametry
-        covar = result.covar
+        # Kovariance z Jacobiho matice v optimu skalovana redukovanym chi^2 (jako lmfit)
+        nfree = cas_h.size - result.x.size
+        chisqr = float(np.sum(result.fun**2))
+        covar = np.linalg.pinv(result.jac.T @ result.jac)
+        if nfree > 0:
+            covar *= chisqr / nfree
 
         # Vrati hodnoty parametru, jejich chyby a kovariančni matici jako numpy pole
-        return (
-            np.array([k_t, k_B, k_T]),  # Hodnoty parametru
-            np.array([k_t_err, k_B_err, k_T_err]),  # Chyby parametru
-            covar,  # Kovariančni matice
-        )
+        return result.x, np.sqrt(np.abs(np.diag(covar))), covar
 
     except Exception as e:
         # Pri chybe vypise informaci a vyhodi vyjimku dale
         print(f"Error in riu_fit: {e}")
         raise Exception(f"Error in riu_fit: {e}")
+
+
+def compute_dose(riu_params, times, pomer, objem_organu, podana_aktivita):
+    """
+    Z parametru fitu RIU spocita TIAC, podil f, efektivni polocas, konstantu E
+    a absorbovanou davku. Casy jsou v hodinach, objem organu v ml, aktivita v MBq.
+    Vraci slovnik se vsemi vysledky (zaokrouhlenymi stejne jako v GUI).
+    """
+    try:
+        k_t, k_B, k_T = riu_params
+
+        # Integral RIU od 0 do nekonecna upraveny pomerem, prepocteno na dny
+        integral_riu = round(float(pomer * riu_integral(k_t, k_B, k_T)) / 24, 3)
+        # Integral uptake mezi prvnim a poslednim merenim (analyticky), prepocteno na dny
+        integral_statik = round(
+            float(pomer * riu_integral(k_t, k_B, k_T, times[0], times[-1])) / 24, 3
+        )
+        # Podil F jako procento integralu mimo merene casove okno
+        podil_f = 100 - round(integral_statik / integral_riu * 100, 3)
+        # Efektivni polocas v dnech z vylucovaci konstanty
+        eff_polocas = round(np.log(2) / k_T / 24, 3)
+        # Hmotnost organu (objem * hustota)
+        organ_mass = float(objem_organu) * 1.045
+        # Konstanta E ((Gy*gram)/(MBq*day))
+        big_E = round((organ_mass**0.25 + 18) / 7.2, 3)
+        # Absorbovana davka (Gy)
+        absorbovana_davka = round(podana_aktivita * big_E * integral_riu / organ_mass, 3)
+
+        return {
+            "integral_riu": integral_riu,
+            "integral_statik": integral_statik,
+            "podil_f": podil_f,
+            "eff_polocas": eff_polocas,
+            "organ_mass": organ_mass,
+            "big_E": big_E,
+            "absorbovana_davka": absorbovana_davka,
+        }
+
+    except Exception as e:
+        print(f"Error computing dose: {e}")
+        raise Exception(f"Error computing dose: {e}")
+
+
+def planned_activities(big_E, organ_mass, integral_riu, davky=None):
+    """
+    Pro kazdou pozadovanou davku (Gy) spocita potrebnou terapeutickou aktivitu (MBq).
+    Vraci seznam dvojic (davka, aktivita).
+    """
+    if davky is None:
+        davky = POZADOVANE_DAVKY
+    return [
+        (dose, round((1 / big_E) * (organ_mass * dose) / integral_riu, 3))
+        for dose in davky
+    ]
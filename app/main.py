@@ -5,22 +5,34 @@ import psutil
 from app.functions import (
     Graf_1,
     ROI_drawer_manual,
-    dicom_image,
-    tew_correction,
+    nacti_studii,
     premenovy_zakon,
     compute_time_differences,
     riu_fit,
     riu_uptace_fce,
-    align_images,
-    posunuti_image,
+    align_projection,
+    apply_dt_correction,
+    DT_MAP_SIGMA,
+    region_count_rates,
+    region_label,
+    region_labels,
+    compute_uptake,
+    compute_dose,
+    preview_image,
+    planned_activities,
+    OKNA_PRO_KOREKCI,
+    MD_DATA_OPTIMA_640,
+    KAL_DATA_OPTIMA_640,
 )
+from app.batch import save_patient_inputs
+from app.frame_cache import FrameCache
+from app.uncertainty import dose_uncertainty
+from app.tasks import TaskCancelled, TaskRunner
 from datetime import datetime
 import numpy as np
-from scipy.special import lambertw
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
 import os
-from scipy.integrate import quad
 import platform
 
 
@@ -65,6 +77,26 @@ class aplikace:
 
             self.update_ram_usage(self.root, self.ram_label)
 
+            # prubeh a zruseni vypoctu bezicich na pozadi
+            self.task_label = tk.Label(
+                self.bottom_bar, text="", font=("Arial", 12), bg="gray", fg="white"
+            )
+            self.task_label.pack(side="left", padx=10, pady=5)
+
+            self.task_progress = ttk.Progressbar(
+                self.bottom_bar, length=200, maximum=1.0, mode="determinate"
+            )
+            self.task_progress.pack(side="left", padx=5, pady=5)
+
+            self.task_cancel_button = tk.Button(
+                self.bottom_bar,
+                text="Cancel",
+                font=("Arial", 12),
+                state="disabled",
+                command=lambda: self.tasks.cancel(),
+            )
+            self.task_cancel_button.pack(side="left", padx=5, pady=5)
+
             ### styl
             self.style = ttk.Style()
             self.style.theme_use("clam")
@@ -119,12 +151,15 @@ class aplikace:
             self.blank_image_tk = ImageTk.PhotoImage(self.blank_image)
 
             self.dicom_images = {}
+            # Diskova cache dekodovanych snimku (klic SOP Instance UID)
+            self.frame_cache = FrameCache()
             self.img_labels_ant = {}
             self.img_labels_pos = {}
 
             self.date_labels = {}
             self.time_labels = {}
             self.duration_labels = {}
+            self.load_buttons = {}
 
             self.img_titles1 = [
                 "Acquisition 1 h",
@@ -160,13 +195,14 @@ class aplikace:
                 self.img_labels_pos[i].image = self.blank_image_tk
 
                 # LOAD buttony
-                tk.Button(
+                self.load_buttons[i] = tk.Button(
                     self.image_frame,
                     text="Load",
                     font=("Arial", 13, "bold"),
                     **self.button_style,
                     command=lambda i=i: self.safe_call(self.load_image, i),
-                ).grid(row=3, column=i, pady=5)
+                )
+                self.load_buttons[i].grid(row=3, column=i, pady=5)
 
                 # Datumy, casy a doba akvizice
                 self.date_labels[i] = tk.Label(
@@ -184,6 +220,18 @@ class aplikace:
                 )
                 self.duration_labels[i].grid(row=6, column=i, pady=5)
 
+            # LOAD STUDY button - vsechny akvizice ze slozky najednou
+            self.load_study_button = tk.Button(
+                self.image_frame,
+                text="Load study folder",
+                font=("Arial", 13, "bold"),
+                **self.button_style,
+                command=lambda: self.safe_call(self.load_study_folder),
+            )
+            self.load_study_button.grid(
+                row=7, column=0, columnspan=len(self.img_titles1), pady=5
+            )
+
             ### buttony
             self.button_frame_1 = tk.Frame(self.tab1)
             self.button_frame_1.pack(padx=10, pady=0)
@@ -199,6 +247,15 @@ class aplikace:
             )
             self.cor_MD_button.grid(row=0, column=0, padx=10)
 
+            # volba pixelove korekce na mrtvou dobu (mapa faktoru z lokalnich cetnosti)
+            self.pixelwise_dt = tk.BooleanVar(value=False)
+            tk.Checkbutton(
+                self.button_frame_1,
+                text="Pixel-wise DT",
+                font=("Arial", 13),
+                variable=self.pixelwise_dt,
+            ).grid(row=1, column=0, padx=10)
+
             # align ANT button
             self.align_ant_button = tk.Button(
                 self.button_frame_1,
@@ -210,6 +267,15 @@ class aplikace:
             )
             self.align_ant_button.grid(row=0, column=2, padx=(80, 10))
 
+            # volba sub-pixeloveho zarovnani (fazova korelace, posun bez pretoceni pres okraj)
+            self.subpixel_alignment = tk.BooleanVar(value=False)
+            tk.Checkbutton(
+                self.button_frame_1,
+                text="Sub-pixel alignment",
+                font=("Arial", 13),
+                variable=self.subpixel_alignment,
+            ).grid(row=0, column=1, padx=(40, 0))
+
             # segment ANT button
             self.segment_ant_button = tk.Button(
                 self.button_frame_1,
@@ -243,6 +309,22 @@ class aplikace:
             )
             self.segment_pos_button.grid(row=0, column=5, padx=10)
 
+            # editor ROI vlozeny do zalozky - pri segmentaci nahradi nahledy a tlacitka
+            self.roi_editor = None
+            self.roi_editor_frame = tk.Frame(self.tab1)
+
+            self.roi_done_button = tk.Button(
+                self.roi_editor_frame,
+                text="Done",
+                font=("Arial", 13, "bold"),
+                **self.button_style,
+                command=lambda: self.safe_call(self.close_roi_editor),
+            )
+            self.roi_done_button.pack(pady=5)
+
+            self.roi_canvas_frame = tk.Frame(self.roi_editor_frame)
+            self.roi_canvas_frame.pack(fill="both", expand=True)
+
             ### ZALOZKA 2 - GRAPH CREATION
 
             self.tab2_frame = tk.Frame(self.tab2)
@@ -504,6 +586,12 @@ class aplikace:
 
             self.results_tree_dose_1.pack(fill="x", pady=10)
 
+            # interval spolehlivosti davky (Monte Carlo)
+            self.dose_ci_label = tk.Label(
+                self.results_frame_dose, text="", font=("Arial", 13)
+            )
+            self.dose_ci_label.pack(anchor="w")
+
             # druha tabulka
             self.results_columns_2 = ("Dose (Gy)", "A_[ter] (MBq)")
             self.results_tree_dose_2 = ttk.Treeview(
@@ -849,12 +937,39 @@ class aplikace:
             self.kal_parameters_value.set(1)
             self.update_table_kal_params()
 
+            # ovladani, ktere meni nebo cte data studie - vypnute, dokud bezi uloha
+            # na pozadi (snimky a zasobnik studie se v ni meni in-place)
+            self.task_controls = [
+                *self.load_buttons.values(),
+                self.load_study_button,
+                self.cor_MD_button,
+                self.align_ant_button,
+                self.segment_ant_button,
+                self.align_pos_button,
+                self.segment_pos_button,
+                self.roi_done_button,
+                self.evaluation_button,
+                self.add_spect_button,
+                self.computation_button,
+                self.protocol_button,
+                self.rb1_md,
+                self.rb2_md,
+                self.rb3_md,
+                self.rb1_kal,
+                self.rb2_kal,
+                self.rb3_kal,
+            ]
+            self.task_controls_busy = False
+
             self.provedeni_korekce_MD = False
             self.evaluace_grafu = False
 
         else:
             self.root = None
 
+        # narocne kroky bezi na pozadi, bez GUI synchronne
+        self.tasks = TaskRunner(self.root, self.show_task_progress)
+
     ### --------------------------------------------------------------
     ### podpurne FUNKCE
 
@@ -866,6 +981,44 @@ class aplikace:
             messagebox.showerror("Error", f"Error in {func.__name__}: {e}")
             return None
 
+    ## spusteni narocneho kroku na pozadi - chyba vyhodi messagebox jako safe_call
+    def run_task(self, name, work, on_done=None):
+        on_error = None
+        if self.root is not None:
+            on_error = lambda e: messagebox.showerror("Error", f"Error in {name}: {e}")
+        return self.tasks.submit(name, work, on_done, on_error)
+
+    ## prubeh ulohy na pozadi ve spodni liste (name None = zadna uloha nebezi)
+    def show_task_progress(self, name, fraction, text):
+        self.set_task_controls(name is not None)
+        if name is None:
+            self.task_label.config(text="")
+            self.task_progress.stop()
+            self.task_progress.config(mode="determinate", value=0)
+            self.task_cancel_button.config(state="disabled")
+            return
+
+        self.task_label.config(text=f"{name}: {text}" if text else f"{name}...")
+        self.task_cancel_button.config(state="normal")
+        if fraction is None:
+            if str(self.task_progress["mode"]) != "indeterminate":
+                self.task_progress.config(mode="indeterminate")
+                self.task_progress.start(20)
+        else:
+            self.task_progress.stop()
+            self.task_progress.config(mode="determinate", value=fraction)
+
+    ## vypnuti ovladani a editoru ROI, dokud bezi uloha na pozadi
+    def set_task_controls(self, busy):
+        if busy == self.task_controls_busy:
+            return
+        self.task_controls_busy = busy
+        state = "disabled" if busy else "normal"
+        for widget in self.task_controls:
+            widget.config(state=state)
+        if self.roi_editor is not None:
+            self.roi_editor.selector.set_active(not busy)
+
     ## funkce, ktera stale zobrazuje vyuziti RAM
     def update_ram_usage(self, root, ram_label):
         ram = psutil.virtual_memory()
@@ -900,50 +1053,12 @@ class aplikace:
                 )
                 os.makedirs(self.output_folder, exist_ok=True)
 
-                # Vytvori instanci tridy dicom_image a nacte DICOM soubor do slovniku s klicem 'index'
-                self.dicom_images[index] = dicom_image()
-                self.dicom_images[index].load_dicom(file_path)
-
-                # Prevede obraz 'ant_pw' na PIL obrazek pro zobrazeni
-                ant_pw_image = self.dicom_images[index].convert_to_image("ant_pw")
-                # Zmeni velikost obrazku na pozadovane rozmery
-                ant_pw_image_resized = ant_pw_image.resize(
-                    (self.image_size, self.image_size)
-                )
-                # Prevede PIL obrazek na Tkinter kompatibilni obrazek
-                ant_pw_image_tk = ImageTk.PhotoImage(ant_pw_image_resized)
-
-                # Aktualizuje label, aby zobrazil novy obrazek
-                self.img_labels_ant[index].config(image=ant_pw_image_tk)
-                # Udrzuje referenci na obrazek, aby nedoslo k jeho odstraneni
-                self.img_labels_ant[index].image = ant_pw_image_tk
-
-                # Stejne provede pro obraz 'pos_pw' (pokud je potreba zobrazit i ten)
-                pos_pw_image = self.dicom_images[index].convert_to_image("pos_pw")
-                pos_pw_image_resized = pos_pw_image.resize(
-                    (self.image_size, self.image_size)
-                )
-                pos_pw_image_tk = ImageTk.PhotoImage(pos_pw_image_resized)
-
-                self.img_labels_pos[index].config(image=pos_pw_image_tk)
-                self.img_labels_pos[index].image = pos_pw_image_tk
+                # Nacte DICOM soubor do slovniku s klicem 'index' - jiz jednou dekodovany
+                # snimek se vezme z diskove cache, nekomprimovana data se mapuji ze souboru
+                self.dicom_images[index] = self.frame_cache.load_image(file_path)
 
-                # Prevede cas akvizice z formatu "093108.00" na "09:31:08"
-                acq_time = self.dicom_images[index].acq_time
-                acq_time_formatted = f"{acq_time[:2]}:{acq_time[2:4]}:{acq_time[4:6]}"
-
-                # Prevede datum akvizice z formatu "20250212" na "12.02.2025"
-                acq_date = self.dicom_images[index].acq_date
-                acq_date_formatted = datetime.strptime(acq_date, "%Y%m%d").strftime(
-                    "%d.%m.%Y"
-                )
-
-                # Aktualizuje textove labely s datumem, casem a dobou trvani akvizice
-                self.date_labels[index].config(text=f"Date: {acq_date_formatted}")
-                self.time_labels[index].config(text=f"Time: {acq_time_formatted}")
-                self.duration_labels[index].config(
-                    text=f"Duration: {self.dicom_images[index].acq_dur:.2f} seconds"
-                )
+                # Zobrazi nahledy a metadata akvizice
+                self.show_acquisition(index)
 
             except Exception as e:
                 # Pokud nastane chyba pri nacitani, vypise ji a znovu vyhodi vyjimku
@@ -954,6 +1069,76 @@ class aplikace:
                     f"Error loading DICOM image for index {index} in by Load Button: {e}"
                 )
 
+    # funkce pro tlacitko Load study folder
+    def load_study_folder(self):
+        # Otevre dialog pro vyber slozky se vsemi akvizicemi pacienta
+        folder_path = filedialog.askdirectory()
+        if folder_path:
+            try:
+                self.folder_path = folder_path
+
+                # Vytvori vystupni slozku "dosithyroid_output", pokud jeste neexistuje
+                self.output_folder = os.path.join(
+                    self.folder_path, "dosithyroid_output"
+                )
+                os.makedirs(self.output_folder, exist_ok=True)
+
+                # Akvizice se prirazi slotum podle casu akvizice a dekoduji se paralelne
+                images = nacti_studii(
+                    self.folder_path, len(self.img_titles1), cache=self.frame_cache
+                )
+                self.dicom_images.clear()
+                self.dicom_images.update(images)
+
+                for index in self.dicom_images:
+                    self.show_acquisition(index)
+
+            except Exception as e:
+                print(f"Error loading study folder: {e}")
+                raise Exception(f"Error loading study folder: {e}")
+
+    def show_acquisition(self, index):
+        """
+        Zobrazi nahledy PW obrazu a datum, cas a dobu akvizice snimku `index`.
+        """
+        image = self.dicom_images[index]
+
+        # Nahled obrazu 'ant_pw' v pozadovane velikosti (z cache nahledu snimku)
+        ant_pw_image_resized = preview_image(
+            image, "ant_pw", (self.image_size, self.image_size)
+        )
+        # Prevede PIL obrazek na Tkinter kompatibilni obrazek
+        ant_pw_image_tk = ImageTk.PhotoImage(ant_pw_image_resized)
+
+        # Aktualizuje label, aby zobrazil novy obrazek
+        self.img_labels_ant[index].config(image=ant_pw_image_tk)
+        # Udrzuje referenci na obrazek, aby nedoslo k jeho odstraneni
+        self.img_labels_ant[index].image = ant_pw_image_tk
+
+        # Stejne provede pro obraz 'pos_pw' (pokud je potreba zobrazit i ten)
+        pos_pw_image_resized = preview_image(
+            image, "pos_pw", (self.image_size, self.image_size)
+        )
+        pos_pw_image_tk = ImageTk.PhotoImage(pos_pw_image_resized)
+
+        self.img_labels_pos[index].config(image=pos_pw_image_tk)
+        self.img_labels_pos[index].image = pos_pw_image_tk
+
+        # Prevede cas akvizice z formatu "093108.00" na "09:31:08"
+        acq_time = image.acq_time
+        acq_time_formatted = f"{acq_time[:2]}:{acq_time[2:4]}:{acq_time[4:6]}"
+
+        # Prevede datum akvizice z formatu "20250212" na "12.02.2025"
+        acq_date = image.acq_date
+        acq_date_formatted = datetime.strptime(acq_date, "%Y%m%d").strftime("%d.%m.%Y")
+
+        # Aktualizuje textove labely s datumem, casem a dobou trvani akvizice
+        self.date_labels[index].config(text=f"Date: {acq_date_formatted}")
+        self.time_labels[index].config(text=f"Time: {acq_time_formatted}")
+        self.duration_labels[index].config(
+            text=f"Duration: {image.acq_dur:.2f} seconds"
+        )
+
     def update_image_labels(
         self, index, img_labels_ant, img_labels_pos, image_size, type
     ):
@@ -962,10 +1147,11 @@ class aplikace:
         """
         try:
             if type == "ant":
-                # Aktualizuje obraz 'ant_pw'
-                ant_pw_image = self.dicom_images[index].convert_to_image("ant_pw")
-                # Zmeni velikost obrazku na pozadovanou
-                ant_pw_image_resized = ant_pw_image.resize((image_size, image_size))
+                # Aktualizuje obraz 'ant_pw' - nahled v pozadovane velikosti, po zmene
+                # dat (korekce, zarovnani) se vykresli znovu, jinak se vezme z cache
+                ant_pw_image_resized = preview_image(
+                    self.dicom_images[index], "ant_pw", (image_size, image_size)
+                )
                 # Prevede PIL obrazek na Tkinter obrazek
                 ant_pw_image_tk = ImageTk.PhotoImage(ant_pw_image_resized)
                 # Nastavi obrazek do prislusneho labelu
@@ -975,8 +1161,9 @@ class aplikace:
 
             else:
                 # Aktualizuje obraz 'pos_pw'
-                pos_pw_image = self.dicom_images[index].convert_to_image("pos_pw")
-                pos_pw_image_resized = pos_pw_image.resize((image_size, image_size))
+                pos_pw_image_resized = preview_image(
+                    self.dicom_images[index], "pos_pw", (image_size, image_size)
+                )
                 pos_pw_image_tk = ImageTk.PhotoImage(pos_pw_image_resized)
                 img_labels_pos[index].config(image=pos_pw_image_tk)
                 img_labels_pos[
@@ -990,18 +1177,38 @@ class aplikace:
 
     # funkce tlaticka DT correction
     def DT_correction(self):
+        # Zkontroluje, zda uz byla korekce provedena
+        if self.provedeni_korekce_MD:
+            print("Correction has already been applied.")
+            return  # Pokud byla korekce uz provedena, funkce se ukonci
+
+        # Volba pixelove korekce se precte z GUI, vypocet bezi na pozadi
+        sigma = self.dt_map_sigma()
+        self.run_task(
+            "DT correction",
+            lambda task: self.dt_correction_work(task, sigma),
+            lambda _: self.dt_correction_done(),
+        )
+
+    # vypocet korekce na mrtvou dobu (pracovni vlakno, bez pristupu k Tk)
+    def dt_correction_work(self, task, sigma):
         try:
-            # Zkontroluje, zda uz byla korekce provedena
+            # Korekce mohla probehnout v predchozi uloze ve fronte
             if self.provedeni_korekce_MD:
                 print("Correction has already been applied.")
-                return  # Pokud byla korekce uz provedena, funkce se ukonci
+                return
 
-            # Slovnik pro ulozeni namerenych a teoretickych cetnosti
-            merena_cetnost = {}
-            teoreticka_cetnost = {}
-            kor_faktor = {}
+            # Vypocet a aplikace korekcnich faktoru pro vsechny snimky a okna;
+            # task.progress je kontrolni bod po kazdem okne, data se zmeni az po
+            # poslednim z nich (zruseni nechava snimky beze zmeny)
+            vysledky = apply_dt_correction(
+                self.dicom_images, self.md_data, sigma, task.progress
+            )
+            # Data jsou korigovana - nastavi priznak, ze korekce byla provedena
+            self.provedeni_korekce_MD = True
+            self.dt_sigma = sigma
 
-            # Projde vsechny dicom obrazky a aplikuje korekci
+            # Projde vsechny dicom obrazky a zapise pouzitou korekci
             with open(
                 os.path.join(self.output_folder, "DT_correction_params.txt"), "w"
             ) as dt_file:
@@ -1014,166 +1221,161 @@ class aplikace:
                     "-----------------------------------------------------------------------------------------\n\n"
                 )
 
-                # Pro kazdy index v slovniku dicom obrazku
-                for index in self.dicom_images.keys():
-                    # Pro kazdy klic v md_data (typy dat, napr. ant_pw, pos_pw)
-                    for key in self.md_data.keys():
-                        try:
-                            # Vypocita namerenou cetnost jako soucet pixelu deleno dobou akvizice
-                            merena_cetnost[key] = np.sum(
-                                getattr(self.dicom_images[index], key)
-                            ) / getattr(self.dicom_images[index], "acq_dur")
-                            # Zapise namerenou cetnost do souboru
-                            dt_file.write(
-                                f"Measured rate for {key} for index {index}: {merena_cetnost[key]} cps\n"
-                            )
-
-                            # Vypocita teoretickou cetnost pomoci Lambert W funkce pro korekci mrtve
-                            teoreticka_cetnost[key] = (
-                                -np.real(
-                                    lambertw(
-                                        -merena_cetnost[key] * self.md_data[key], k=0
-                                    )
-                                )
-                                / self.md_data[key]
-                            )
-
-                            # Vypocita korekcni faktor jako pomer teoreticke a namerene cetnosti
-                            kor_faktor[key] = (
-                                teoreticka_cetnost[key] / merena_cetnost[key]
-                            )
-                            # Zapise korekcni faktor do souboru
-                            dt_file.write(
-                                f"Correction factor for {key} for index {index}: {kor_faktor[key]}\n\n"
-                            )
-
-                            # Aplikuje korekcni faktor na data v dicom obrazku
-                            setattr(
-                                self.dicom_images[index],
-                                key,
-                                getattr(self.dicom_images[index], key)
-                                * kor_faktor[key],
-                            )
-
-                            # Podle klice aktualizuje prislusny obrazkovy label (predni nebo zadni obrazek)
-                            if key == "ant_pw":
-                                self.safe_call(
-                                    self.update_image_labels,
-                                    index,
-                                    self.img_labels_ant,
-                                    self.img_labels_pos,
-                                    self.image_size,
-                                    "ant",
-                                )
-                            if key == "pos_pw":
-                                self.safe_call(
-                                    self.update_image_labels,
-                                    index,
-                                    self.img_labels_ant,
-                                    self.img_labels_pos,
-                                    self.image_size,
-                                    "pos",
-                                )
-
-                        except Exception as e:
-                            # Pokud nastane chyba u zpracovani daneho klice, vypise a znovu vyhodi vyjimku
-                            print(f"Error processing {key} for index {index}: {e}")
-                            raise Exception(
-                                f"Error processing {key} for index {index}: {e}"
-                            )
+                if sigma is not None:
+                    dt_file.write(
+                        "Pixel-wise correction: factor = 1 + (F - 1) * s / s_mean, "
+                        "F = total-rate factor of the frame, s = gaussian_filter("
+                        f"frame, sigma={sigma} px), s_mean = count-weighted mean of s\n"
+                        "----> Correction factor below = corrected / measured total rate\n\n"
+                    )
+
+                # Zapis namerenych cetnosti a korekcnich faktoru do souboru
+                for index, okna in vysledky.items():
+                    for key, (merena_cetnost, kor_faktor) in okna.items():
+                        dt_file.write(
+                            f"Measured rate for {key} for index {index}: {merena_cetnost} cps\n"
+                        )
+                        dt_file.write(
+                            f"Correction factor for {key} for index {index}: {kor_faktor}\n\n"
+                        )
                     # Oddelovac mezi zaznamy v souboru
                     dt_file.write("----\n\n")
 
-            # Po uspesnem provedeni korekce nastavi priznak, ze korekce byla provedena
-            self.provedeni_korekce_MD = True
             print("Correction applied successfully.")
 
+        except TaskCancelled:
+            raise
         except Exception as e:
             # Pokud nastane neocekavana chyba, vypise a znovu vyhodi vyjimku
             print(f"Unexpected error in korekce_MD: {e}")
             raise Exception(f"Unexpected error in korekce_MD: {e}")
 
+    # aktualizace nahledu korigovanych PW obrazku (hlavni vlakno)
+    def dt_correction_done(self):
+        for index in self.dicom_images.keys():
+            for key, typ in (("ant_pw", "ant"), ("pos_pw", "pos")):
+                if key in self.md_data:
+                    self.safe_call(
+                        self.update_image_labels,
+                        index,
+                        self.img_labels_ant,
+                        self.img_labels_pos,
+                        self.image_size,
+                        typ,
+                    )
+
+    # sigma vyhlazeni pro pixelovou korekci na mrtvou dobu, None = jeden faktor na okno
+    def dt_map_sigma(self):
+        pixelwise = getattr(self, "pixelwise_dt", None)
+        return DT_MAP_SIGMA if pixelwise is not None and pixelwise.get() else None
+
     # funkce tlacitka align ANT
     def align_ANT(self):
-        try:
-            # Nastavi referencni obrazek jako ant_pw obrazek s indexem 2
-            reference = self.dicom_images[2].ant_pw
-            # Projde vsechny klice ve slovniku dicom obrazku
-            for key in self.dicom_images.keys():
-                # Zarovna aktualni ant_pw obrazek na referencni, vrati zarovnany obrazek a posuny v x a y
-                self.dicom_images[key].ant_pw, x_shift, y_shift = align_images(
-                    reference, self.dicom_images[key].ant_pw
-                )
-                # Posune dalsi obrazky ant_usw a ant_lsw o stejny posun, aby zustaly zarovnane
-                self.dicom_images[key].ant_usw = posunuti_image(
-                    self.dicom_images[key].ant_usw, x_shift, y_shift
-                )
-                self.dicom_images[key].ant_lsw = posunuti_image(
-                    self.dicom_images[key].ant_lsw, x_shift, y_shift
-                )
+        # Metoda zarovnani se precte z GUI, zarovnani bezi na pozadi
+        method = self.alignment_method()
+        self.run_task(
+            "Align ANT",
+            lambda task: self.align_work(task, "ant", method),
+            lambda _: self.align_done("ant"),
+        )
 
-                # Aktualizuje obrazkove labely v GUI pro ant obrazky
-                self.update_image_labels(
-                    key,
-                    self.img_labels_ant,
-                    self.img_labels_pos,
-                    self.image_size,
-                    "ant",
-                )
+    # zarovnani vsech snimku projekce (pracovni vlakno, bez pristupu k Tk)
+    def align_work(self, task, projekce, method):
+        try:
+            # Zarovna vsechny snimky projekce (PW i scatter okna) na referencni 24h snimek;
+            # zruseni je mozne do posledniho kontrolniho bodu pred posunem dat
+            task.progress(0.0, "registering images")
+            align_projection(
+                self.dicom_images,
+                projekce,
+                reference_index=2,
+                method=method,
+                progress=task.progress,
+            )
+            # Zarovnane projekce a metoda pro vstupy davkoveho prepoctu
+            self.metoda_zarovnani = method
+            zarovnane = getattr(self, "zarovnane_projekce", [])
+            self.zarovnane_projekce = sorted(set(zarovnane) | {projekce})
 
+        except TaskCancelled:
+            raise
         except Exception as e:
             # Pri chybe vypise hlasku a vyhodi vyjimku
-            print(f"Error aligning anterior images: {e}")
-            raise Exception(f"Error aligning anterior images: {e}")
+            nazev = "anterior" if projekce == "ant" else "posterior"
+            print(f"Error aligning {nazev} images: {e}")
+            raise Exception(f"Error aligning {nazev} images: {e}")
+
+    # aktualizace obrazkovych labelu zarovnane projekce (hlavni vlakno)
+    def align_done(self, projekce):
+        for key in self.dicom_images.keys():
+            self.update_image_labels(
+                key,
+                self.img_labels_ant,
+                self.img_labels_pos,
+                self.image_size,
+                projekce,
+            )
+
+    # metoda zarovnani podle zaskrtavaciho policka
+    def alignment_method(self):
+        return "phase" if self.subpixel_alignment.get() else "fft"
 
     # funkce tlacitka align POS
     def align_POS(self):
-        try:
-            # Nastavi referencni obrazek jako pos_pw obrazek s indexem 2
-            reference = self.dicom_images[2].pos_pw
-            # Projde vsechny klice ve slovniku dicom obrazku
-            for key in self.dicom_images.keys():
-                # Zarovna aktualni pos_pw obrazek na referencni, vrati zarovnany obrazek a posuny v x a y
-                self.dicom_images[key].pos_pw, x_shift, y_shift = align_images(
-                    reference, self.dicom_images[key].pos_pw
-                )
-                # Posune dalsi obrazky pos_usw a pos_lsw o stejny posun, aby zustaly zarovnane
-                self.dicom_images[key].pos_usw = posunuti_image(
-                    self.dicom_images[key].pos_usw, x_shift, y_shift
-                )
-                self.dicom_images[key].pos_lsw = posunuti_image(
-                    self.dicom_images[key].pos_lsw, x_shift, y_shift
-                )
+        # Metoda zarovnani se precte z GUI, zarovnani bezi na pozadi
+        method = self.alignment_method()
+        self.run_task(
+            "Align POS",
+            lambda task: self.align_work(task, "pos", method),
+            lambda _: self.align_done("pos"),
+        )
 
-                # Aktualizuje obrazkove labely v GUI pro pos obrazky
-                self.update_image_labels(
-                    key,
-                    self.img_labels_ant,
-                    self.img_labels_pos,
-                    self.image_size,
-                    "pos",
-                )
+    # editor ROI vlozeny do zalozky 1 misto samostatneho pyplot okna
+    def open_roi_editor(self, planar_type, img_labels):
+        # Spusti manualni segmentaci na 24hodinovem obrazku a aplikuje ji na vsechny
+        # obrazky projekce; ROI se vlozi do mapy oblasti jako oblast vybrana
+        # v "type of thyroid evaluation"
+        if 2 not in self.dicom_images:
+            # Pokud obrazek s indexem 2 neni, vypise chybu a vyhodi vyjimku
+            print("Error: No DICOM image loaded for the 24h timepoint.")
+            raise Exception("No DICOM image loaded for the 24h timepoint.")
+
+        # Predchozi editor se uvolni, v pameti je vzdy nejvyse jedno platno
+        self.close_roi_editor()
+
+        mapa = getattr(self.dicom_images[2], f"{planar_type[:3]}_roi")
+        velikost = round(self.window_height * 0.7) / 100  # palce pri dpi 100
+        self.roi_editor = ROI_drawer_manual(
+            self.dicom_images,
+            planar_type,
+            img_labels,
+            self.image_size,
+            label=region_label(mapa, self.sz_selected_option.get()),
+            scheduler=self.root,
+            master=self.roi_canvas_frame,
+            figsize=(velikost, velikost),
+        )
 
-        except Exception as e:
-            # Pri chybe vypise hlasku a vyhodi vyjimku
-            print(f"Error aligning posterior images: {e}")
-            raise Exception(f"Error aligning posterior images: {e}")
+        # Editor nahradi nahledy a tlacitka zalozky az do stisku "Done"
+        self.image_container.pack_forget()
+        self.button_frame_1.pack_forget()
+        self.roi_editor_frame.pack(fill="both", expand=True)
+        self.roi_editor.show()
+
+    def close_roi_editor(self):
+        # Ukonci editor ROI (pokud bezi) a vrati nahledy a tlacitka zalozky 1
+        if self.roi_editor is None:
+            return
+        self.roi_editor.close()
+        self.roi_editor = None
+        self.roi_editor_frame.pack_forget()
+        self.image_container.pack(padx=20, pady=10)
+        self.button_frame_1.pack(padx=10, pady=0)
 
     # funkce tlacitka segment ANT
     def segment_ANT(self):
-        # Spusti manualni segmentaci na 24hodinovem anteriornim obrazku a aplikuje na vsechny anteriorni obrazky
         try:
-            # Zkontroluje, zda je nacten obrazek s indexem 2
-            if 2 in self.dicom_images:
-                # Vytvori instanci ROI_drawer_manual pro ant_pw obrazky a zobrazi ji (spusti GUI segmentaci)
-                roi_drawer = ROI_drawer_manual(
-                    self.dicom_images, "ant_pw", self.img_labels_ant, self.image_size
-                )
-                roi_drawer.show()
-            else:
-                # Pokud obrazek s indexem 2 neni, vypise chybu a vyhodi vyjimku
-                print("Error: No DICOM image loaded for the 24h timepoint.")
-                raise Exception("No DICOM image loaded for the 24h timepoint.")
+            self.open_roi_editor("ant_pw", self.img_labels_ant)
         except Exception as e:
             # Pri chybe vypise hlasku a vyhodi vyjimku
             print(f"Error starting manual segmentation for ANT: {e}")
@@ -1181,19 +1383,8 @@ class aplikace:
 
     # funkce tlacitka segment POS
     def segment_POS(self):
-        # Spusti manualni segmentaci na 24hodinovem posteriornim obrazku a aplikuje na vsechny posteriorni obrazky
         try:
-            # Zkontroluje, zda je nacten obrazek s indexem 2
-            if 2 in self.dicom_images:
-                # Vytvori instanci ROI_drawer_manual pro pos_pw obrazky a zobrazi ji (spusti GUI segmentaci)
-                roi_drawer = ROI_drawer_manual(
-                    self.dicom_images, "pos_pw", self.img_labels_pos, self.image_size
-                )
-                roi_drawer.show()
-            else:
-                # Pokud obrazek s indexem 2 neni, vypise chybu a vyhodi vyjimku
-                print("Error: No DICOM image loaded for the 24h timepoint.")
-                raise Exception("No DICOM image loaded for the 24h timepoint.")
+            self.open_roi_editor("pos_pw", self.img_labels_pos)
         except Exception as e:
             # Pri chybe vypise hlasku a vyhodi vyjimku
             print(f"Error starting manual segmentation for POS: {e}")
@@ -1305,22 +1496,8 @@ class aplikace:
 
     # funkce pro tlacitko evaluate
     def graph_evalueation(self):
-        # Vymazani predchoziho grafu, pokud existuje
-        if self.evaluace_grafu:
-            for widget in self.graph_frame.winfo_children():
-                widget.destroy()  # odstraneni predchozich widgetu grafu
-
-        self.evaluace_grafu = True
-        # Inicializace noveho grafu s nastavenymi parametry
-        self.graph = Graf_1(
-            fontsize=10,
-            title="",
-            xlabel="Čas (h)",
-            ylabel="Uptake aktivity (%)",
-            figsize=(10, 6),
-            dpi=round(self.window_height * 0.15),
-        )
-
+        # Predchozi graf zustava zobrazeny - nahradi se az po uspesnem vyhodnoceni
+        # (evaluation_done), zrusene nebo chybne vyhodnoceni ho nesmaze
         try:
             # Nacteni hodnoty podane aktivity z UI a konverze na float
             self.podana_aktivita = float(self.entry_act_computed_value.get())
@@ -1340,148 +1517,108 @@ class aplikace:
             else:
                 title = "Uptake aktivity v hyperfunkčním uzlu ŠŽ"
 
-            self.graph.fig.set_title(title)
-
         except Exception as e:
             print(f"Error setting graph title: {e}")
             raise Exception(f"Error setting graph title: {e}")
 
-        # Inicializace seznamu pro ulozeni cetnosti a hodnot
-        cetnosti_ant_pw = []
-        cetnosti_ant_usw = []
-        cetnosti_ant_lsw = []
-
-        cetnosti_pos_pw = []
-        cetnosti_pos_usw = []
-        cetnosti_pos_lsw = []
+        # Typ korekce a datum podani se prectou z GUI, vyhodnoceni bezi na pozadi
+        option_corr = self.typ_korekce.get()
+        datum_podani = self.entry_date_pacient.get()
+        self.run_task(
+            "Evaluation",
+            lambda task: self.evaluation_work(
+                task, option_corr, option_sz, datum_podani
+            ),
+            lambda vysledky: self.evaluation_done(vysledky, title),
+        )
 
-        hodnoty_ant = []
-        hodnoty_pos = []
+    # cetnosti v ROI, uptake a fit RIU (pracovni vlakno, bez pristupu k Tk)
+    def evaluation_work(self, task, option_corr, option_sz, datum_podani):
         datumy = []
         casy = []
 
+        task.progress(0.0, "count rates in ROI")
         try:
-            # Ziskani typu korekce z UI
-            option_corr = self.typ_korekce.get()
-            if option_corr == "ACSC":
-                # Prochazeni vsech DICOM snimku a vypocet korekce s ACSC
-                for index in self.dicom_images.keys():
-                    doba_akv = self.dicom_images[index].acq_dur
-                    ant_roi = self.dicom_images[index].ant_roi
-                    pos_roi = self.dicom_images[index].pos_roi
-
-                    datumy.append(self.dicom_images[index].acq_date)
-                    casy.append(self.dicom_images[index].acq_time)
-
-                    # Vypocet cetnosti s ROI a normalizace na dobu akvizice
-                    ant_pw = self.dicom_images[index].ant_pw * ant_roi
-                    cetnosti_ant_pw.append(ant_pw.sum() / doba_akv)
-                    ant_usw = self.dicom_images[index].ant_usw * ant_roi
-                    cetnosti_ant_usw.append(ant_usw.sum() / doba_akv)
-                    ant_lsw = self.dicom_images[index].ant_lsw * ant_roi
-                    cetnosti_ant_lsw.append(ant_lsw.sum() / doba_akv)
-
-                    pos_pw = self.dicom_images[index].pos_pw * pos_roi
-                    cetnosti_pos_pw.append(pos_pw.sum() / doba_akv)
-                    pos_usw = self.dicom_images[index].pos_usw * pos_roi
-                    cetnosti_pos_usw.append(pos_usw.sum() / doba_akv)
-                    pos_lsw = self.dicom_images[index].pos_lsw * pos_roi
-                    cetnosti_pos_lsw.append(pos_lsw.sum() / doba_akv)
-
-                # Aplikace tew korekce na cetnosti
-                hodnoty_ant = tew_correction(
-                    np.array(cetnosti_ant_pw),
-                    np.array(cetnosti_ant_usw),
-                    np.array(cetnosti_ant_lsw),
-                )[0]
-                hodnoty_pos = tew_correction(
-                    np.array(cetnosti_pos_pw),
-                    np.array(cetnosti_pos_usw),
-                    np.array(cetnosti_pos_lsw),
-                )[0]
-
-                # Vypocet celkove uptake hodnoty a normalizace na podanou aktivitu
-                hodnoty = (
-                    np.sqrt(np.array(hodnoty_ant) * np.array(hodnoty_pos))
-                    / self.kal_data[option_corr]
-                )
-                uptake_array = hodnoty / self.podana_aktivita
-
-            elif option_corr == "SC":
-                # Vypocet s korekci SC - pouze anteriorni snimky
-                for index in self.dicom_images.keys():
-                    doba_akv = self.dicom_images[index].acq_dur
-                    ant_roi = self.dicom_images[index].ant_roi
-
-                    datumy.append(self.dicom_images[index].acq_date)
-                    casy.append(self.dicom_images[index].acq_time)
-
-                    ant_pw = self.dicom_images[index].ant_pw * ant_roi
-                    cetnosti_ant_pw.append(ant_pw.sum() / doba_akv)
-                    ant_usw = self.dicom_images[index].ant_usw * ant_roi
-                    cetnosti_ant_usw.append(ant_usw.sum() / doba_akv)
-                    ant_lsw = self.dicom_images[index].ant_lsw * ant_roi
-                    cetnosti_ant_lsw.append(ant_lsw.sum() / doba_akv)
-
-                hodnoty_ant = tew_correction(
-                    np.array(cetnosti_ant_pw),
-                    np.array(cetnosti_ant_usw),
-                    np.array(cetnosti_ant_lsw),
-                )[0]
-                hodnoty = hodnoty_ant / self.kal_data[option_corr]
-                uptake_array = hodnoty / self.podana_aktivita
-
-            elif option_corr == "AC":
-                # Korekce AC - jen anteriorni a posteriorni pw snimky
-                for index in self.dicom_images.keys():
-                    doba_akv = self.dicom_images[index].acq_dur
-                    ant_roi = self.dicom_images[index].ant_roi
-                    pos_roi = self.dicom_images[index].pos_roi
-
-                    datumy.append(self.dicom_images[index].acq_date)
-                    casy.append(self.dicom_images[index].acq_time)
-
-                    ant_pw = self.dicom_images[index].ant_pw * ant_roi
-                    cetnosti_ant_pw.append(ant_pw.sum() / doba_akv)
-
-                    pos_pw = self.dicom_images[index].pos_pw * pos_roi
-                    cetnosti_pos_pw.append(pos_pw.sum() / doba_akv)
-
-                hodnoty = (
-                    np.sqrt(np.array(cetnosti_ant_pw) * np.array(cetnosti_pos_pw))
-                    / self.kal_data[option_corr]
-                )
-                uptake_array = hodnoty / self.podana_aktivita
-
-            else:  # Bez korekce
-                for index in self.dicom_images.keys():
-                    doba_akv = self.dicom_images[index].acq_dur
-                    ant_roi = self.dicom_images[index].ant_roi
-
-                    datumy.append(self.dicom_images[index].acq_date)
-                    casy.append(self.dicom_images[index].acq_time)
-
-                    ant_pw = self.dicom_images[index].ant_pw * ant_roi
-                    cetnosti_ant_pw.append(ant_pw.sum() / doba_akv)
+            # Okna, ktera zvolena korekce potrebuje
+            okna = OKNA_PRO_KOREKCI[option_corr]
+
+            for index in self.dicom_images.keys():
+                datumy.append(self.dicom_images[index].acq_date)
+                casy.append(self.dicom_images[index].acq_time)
+
+            # Cetnosti vsech oblasti ROI pro vsechny snimky a okna jednim pruchodem,
+            # normalizovane na dobu akvizice; secte se jen vybrana oblast
+            region_rates = region_count_rates(self.dicom_images, okna)
+            first = self.dicom_images[next(iter(self.dicom_images))]
+            labels = region_labels((first.ant_roi, first.pos_roi), option_sz)
+            cetnosti = {
+                okno: rates[:, labels].sum(axis=1)
+                for okno, rates in region_rates.items()
+            }
 
-                hodnoty = np.array(cetnosti_ant_pw) / self.kal_data[option_corr]
-                uptake_array = hodnoty / self.podana_aktivita
+            # Prepocet cetnosti na uptake podle zvolene korekce a kalibrace
+            # (sirky oken pro TEW z DICOM hlavicky)
+            uptake_array = compute_uptake(
+                cetnosti,
+                option_corr,
+                self.kal_data,
+                self.podana_aktivita,
+                first.energy_windows,
+            )
 
         except Exception as e:
             print(f"Error processing DICOM images in calculation: {e}")
             raise Exception(f"Error processing DICOM images in calculation: {e}")
 
         # Prevod uptake hodnot do slovniku podle indexu snimku
-        self.uptake = {}
-        self.time_differencies = {}
+        uptake = {}
+        time_differencies = {}
 
         for idx, index in enumerate(self.dicom_images.keys()):
-            self.uptake[index] = uptake_array[idx]
+            uptake[index] = uptake_array[idx]
             # Vypocet casovych rozdilu mezi datumem administrace aktivity pacientovi a akvizicemi
-            self.time_differencies[index] = compute_time_differences(
-                self.entry_date_pacient.get(), [datumy[idx]], [casy[idx]]
+            time_differencies[index] = compute_time_differences(
+                datum_podani, [datumy[idx]], [casy[idx]]
             )[0]
 
+        # Fit parametru pro riu funkci
+        # (kovariance parametru se uchova pro Monte Carlo nejistotu davky)
+        task.progress(0.8, "RIU fit")
+        times_for_graph = np.array(list(time_differencies.values()))
+        uptake_for_graph = np.array(list(uptake.values()))
+        riu_params, riu_params_err, riu_params_covar = riu_fit(
+            [times_for_graph, uptake_for_graph], y_err=None
+        )
+
+        return {
+            "region_rates": region_rates,
+            "uptake": uptake,
+            "time_differencies": time_differencies,
+            "times_for_graph": times_for_graph,
+            "uptake_for_graph": uptake_for_graph,
+            "riu_params": riu_params,
+            "riu_params_covar": riu_params_covar,
+            # Vstupy vyhodnoceni pro davkovy prepocet (save_inputs)
+            "vstupy": {
+                "typ_korekce": option_corr,
+                "oblast": option_sz,
+                "datum_podani": datum_podani,
+                "ant_roi": first.ant_roi,
+                "pos_roi": first.pos_roi,
+            },
+        }
+
+    # prevzeti vysledku vyhodnoceni a vykresleni grafu (hlavni vlakno)
+    def evaluation_done(self, vysledky, title=""):
+        self.region_rates = vysledky["region_rates"]
+        self.uptake = vysledky["uptake"]
+        self.time_differencies = vysledky["time_differencies"]
+        self.times_for_graph = vysledky["times_for_graph"]
+        self.uptake_for_graph = vysledky["uptake_for_graph"]
+        self.riu_params = vysledky["riu_params"]
+        self.riu_params_covar = vysledky["riu_params_covar"]
+        self.vstupy_vyhodnoceni = vysledky["vstupy"]
+
         # Vypsani dulezitych informaci
         print(
             "Time differencies:",
@@ -1489,21 +1626,25 @@ class aplikace:
         )
         print("Uptake:", self.uptake)
 
-        self.times_for_graph = np.array(list(self.time_differencies.values()))
-        self.uptake_for_graph = np.array(list(self.uptake.values()))
-        # Fit parametru pro riu funkci
-        self.riu_params, riu_params_err, riu_params_covar = riu_fit(
-            [self.times_for_graph, self.uptake_for_graph], y_err=None
-        )
-
         try:
+            # Inicializace noveho grafu s nastavenymi parametry
+            graf = Graf_1(
+                fontsize=10,
+                title="",
+                xlabel="Čas (h)",
+                ylabel="Uptake aktivity (%)",
+                figsize=(10, 6),
+                dpi=round(self.window_height * 0.15),
+            )
+            graf.fig.set_title(title)
+
             # Vytvoreni pole casu pro vykresleni fitu
             self.time_diff_linspace = np.linspace(
                 0, self.times_for_graph[-1] + 150, 100
             )
 
             # Vykresleni fitu a namerenych dat do grafu
-            self.graph.plot(
+            graf.plot(
                 self.time_diff_linspace,
                 riu_uptace_fce(self.time_diff_linspace, *self.riu_params) * 100,
                 "-",
@@ -1512,7 +1653,7 @@ class aplikace:
                 1,
                 1,
             )
-            self.graph.plot(
+            graf.plot(
                 self.times_for_graph,
                 self.uptake_for_graph * 100,
                 "o",
@@ -1522,12 +1663,19 @@ class aplikace:
                 6,
             )
             # Ulozeni grafu do souboru
-            self.graph.Figure.savefig(
+            graf.Figure.savefig(
                 os.path.join(self.output_folder, "Graph.png"), bbox_inches="tight"
             )
 
+            # Novy graf je hotovy - teprve ted se odstrani predchozi
+            if self.evaluace_grafu:
+                for widget in self.graph_frame.winfo_children():
+                    widget.destroy()  # odstraneni predchozich widgetu grafu
+            self.evaluace_grafu = True
+            self.graph = graf
+
             # Vytvoreni canvasu pro Tkinter a zobrazeni grafu v GUI
-            canvas = FigureCanvasTkAgg(self.graph.Figure, master=self.graph_frame)
+            canvas = FigureCanvasTkAgg(graf.Figure, master=self.graph_frame)
             canvas_widget = canvas.get_tk_widget()
             canvas_widget.pack(expand=True, anchor="center")
             plt.close()
@@ -1536,6 +1684,8 @@ class aplikace:
             print(f"Error displaying graph in GUI: {e}")
             raise Exception(f"Error displaying graph in GUI: {e}")
 
+        self.save_inputs()
+
     def add_spect(self):
         # Vymazani existujiciho grafu, pokud uz byl vytvoren
         if self.evaluace_grafu:
@@ -1654,39 +1804,23 @@ class aplikace:
             self.pomer = 1
 
         print(self.pomer)
-        # Vypocet integralni hodnoty uptake z fitu riu upravene pomerem, prepocteno na dny
-        self.integral_riu = round(
-            self.pomer
-            * self.riu_params[0]
-            / (self.riu_params[1] * self.riu_params[2])
-            / 24,
-            3,
-        )
-        # Integral uptake vypocitany numericky (quad) a upraveny pomerem, prepocteno na dny
-        self.integral_statik = round(
-            self.pomer
-            * quad(
-                riu_uptace_fce,
-                self.times_for_graph[0],
-                self.times_for_graph[-1],
-                args=tuple(self.riu_params),
-            )[0]
-            / 24,
-            3,
-        )
-        # Podil F vypocteny jako procento rozdilu mezi integralem statikem a integralem riu
-        self.podil_f = 100 - round(self.integral_statik / self.integral_riu * 100, 3)
-        # Efektivni polovocas v dnech vypocteny z posledniho parametru riu (vylucovaci konstanta)
-        self.eff_polocas = round(np.log(2) / self.riu_params[-1] / 24, 3)  # dny
-        # Hmotnost organu (objem * hustota)
-        self.organ_mass = float(self.volume_of_organ.get()) * 1.045
-        # Velke E (konstanta pro prepočet davky), vypocet podle dane rovnice
-        self.big_E = round((self.organ_mass**0.25 + 18) / 7.2, 3)  # (Gy*gram)/(MBq*day)
-
-        # Vypocet absorbovane davky (aktivita * velka E * integral riu / hmotnost organu)
-        self.absorbovana_davka = round(
-            self.podana_aktivita * self.big_E * self.integral_riu / self.organ_mass, 3
+        # Vypocet TIAC, podilu f, efektivniho polocasu, konstanty E a davky
+        vysledky = compute_dose(
+            self.riu_params,
+            self.times_for_graph,
+            self.pomer,
+            self.volume_of_organ.get(),
+            self.podana_aktivita,
         )
+        self.integral_riu = vysledky["integral_riu"]
+        self.integral_statik = vysledky["integral_statik"]
+        self.podil_f = vysledky["podil_f"]
+        self.eff_polocas = vysledky["eff_polocas"]
+        self.organ_mass = vysledky["organ_mass"]
+        self.big_E = vysledky["big_E"]
+        self.absorbovana_davka = vysledky["absorbovana_davka"]
+        self.save_inputs()
+
         # Vlozeni vysledku do prvni tabulky
         self.results_tree_dose_1.insert(
             "",
@@ -1700,18 +1834,69 @@ class aplikace:
             ),
         )
 
-        # Preddefinovane hodnoty pozadovanych davky
-        pozadovana_davka = [150, 200, 250, 300, 350, 400]
-
         # Pro kazdou pozadovanou davku vypocet pozadovane aktivity a vlozeni do druhe tabulky
-        for dose in pozadovana_davka:
-            pozadovana_A = round(
-                (1 / self.big_E) * (self.organ_mass * dose) / self.integral_riu, 3
-            )
+        for dose, pozadovana_A in planned_activities(
+            self.big_E, self.organ_mass, self.integral_riu
+        ):
             self.results_tree_dose_2.insert(
                 "", "end", values=(dose, pozadovana_A)
             )  # Spravne vlozeni do tabulky
 
+        # Interval spolehlivosti davky z Monte Carlo vzorku parametru fitu,
+        # kalibrace, objemu organu a pomeru SPECT (na pozadi, s prubehem po blocich)
+        vstupy = (
+            self.riu_params,
+            self.riu_params_covar,
+            self.volume_of_organ.get(),
+            self.podana_aktivita,
+            self.pomer,
+        )
+        self.dose_ci_label.config(text="Dose CI: computing...")
+        self.run_task(
+            "Dose uncertainty",
+            lambda task: dose_uncertainty(*vstupy, progress=task.progress),
+            self.dose_uncertainty_done,
+        )
+
+    # zobrazeni intervalu spolehlivosti davky (hlavni vlakno)
+    def dose_uncertainty_done(self, dose_ci):
+        self.dose_ci = dose_ci
+        self.dose_ci_label.config(
+            text=(
+                f"Dose {self.dose_ci['interval']:.0f}% CI: "
+                f"{self.dose_ci['davka_low']:.2f} - "
+                f"{self.dose_ci['davka_high']:.2f} Gy "
+                f"(median {self.dose_ci['davka_median']:.2f} Gy)"
+            )
+        )
+
+    # ulozeni vstupu vyhodnoceni do dosithyroid_output/dosithyroid.json pro davkovy
+    # prepocet (python -m app.batch) - stejne kroky jako v GUI, stejna davka
+    def save_inputs(self):
+        vstupy = dict(self.vstupy_vyhodnoceni)
+        ant_roi = vstupy.pop("ant_roi")
+        pos_roi = vstupy.pop("pos_roi")
+
+        objem = self.volume_of_organ.get()
+        # SPECT se pouzije, jen pokud uz je z nej spocitany pomer (add_spect)
+        spect = self.spect_entry_value.get()
+        if getattr(self, "pomer", 1) == 1 or not spect:
+            spect = 0
+        vstupy.update(
+            {
+                "podana_aktivita": self.podana_aktivita,
+                "objem_organu": float(objem) if objem else None,
+                "spect_uptake": float(spect),
+                "dt_korekce": self.provedeni_korekce_MD,
+                "dt_sigma": getattr(self, "dt_sigma", None),
+                "zarovnani": getattr(self, "zarovnane_projekce", []),
+                "metoda_zarovnani": getattr(self, "metoda_zarovnani", "fft"),
+                "md_data": self.md_data,
+                "kal_data": self.kal_data,
+            }
+        )
+        save_patient_inputs(self.folder_path, vstupy, ant_roi, pos_roi)
+
     def protocol_export(self):
         pass
 
@@ -1758,25 +1943,11 @@ class aplikace:
         # Nastavi dummy data podle hodnoty md_parameters_value
         if self.md_parameters_value.get() == 1:
             # Data pro pripad, kdy md_parameters_value je 1
-            self.md_data = {
-                "ant_pw": 1.2278225074520933e-05,
-                "ant_usw": 7.523878532633466e-05,
-                "ant_lsw": 7.52862007849338e-05,
-                "pos_pw": 1.2120528337418146e-05,
-                "pos_usw": 5.7212768749137515e-05,
-                "pos_lsw": 5.6539578680391605e-05,
-            }
+            self.md_data = dict(MD_DATA_OPTIMA_640)
             print(self.md_data)
         else:
             # Data pro ostatni pripady (tu je stejna jako vyse)
-            self.md_data = {
-                "ant_pw": 1.2278225074520933e-05,
-                "ant_usw": 7.523878532633466e-05,
-                "ant_lsw": 7.52862007849338e-05,
-                "pos_pw": 1.2120528337418146e-05,
-                "pos_usw": 5.7212768749137515e-05,
-                "pos_lsw": 5.6539578680391605e-05,
-            }
+            self.md_data = dict(MD_DATA_OPTIMA_640)
             print(self.md_data)
 
         # Vlozi data do tabulky, kazdy radek odpovida jednomu klici a hodnote ve slovniku
@@ -1913,11 +2084,11 @@ class aplikace:
         # Podle hodnoty kal_parameters_value nastavi dummy data do tabulky
         if self.kal_parameters_value.get() == 1:
             # Pokud je hodnota 1, priradi realne kalibracni faktory
-            self.kal_data = {"ACSC": 7.77, "SC": 13.30, "AC": 18.3, "No corr": 19.7}
+            self.kal_data = dict(KAL_DATA_OPTIMA_640)
             print(self.kal_data)
         else:
             # Jinak nastavi vsechny hodnoty na 1 (napr. testovaci nebo default hodnoty)
-            self.kal_data = {"ACSC": 7.77, "SC": 13.30, "AC": 18.3, "No corr": 19.7}
+            self.kal_data = dict(KAL_DATA_OPTIMA_640)
             print(self.kal_data)
 
         # Vlozi data do tabulky
@@ -2010,3 +2181,4 @@ class aplikace:
 if __name__ == "__main__":
     app = aplikace()
     app.root.mainloop()
+    app.tasks.shutdown()
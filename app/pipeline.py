@@ -0,0 +1,236 @@
+import numpy as np
+from datetime import datetime
+
+from app.functions import (
+    dicom_image,
+    apply_dt_correction,
+    align_study,
+    roi_count_rates,
+    compute_uptake,
+    compute_time_differences,
+    compute_dose,
+    planned_activities,
+    polygon_mask,
+    roi_indices,
+    tew_correct_study,
+    riu_fit,
+    riu_uptace_fce,
+    OKNA_PRO_KOREKCI,
+    MD_DATA_OPTIMA_640,
+    KAL_DATA_OPTIMA_640,
+)
+
+
+class DosimetryPipeline:
+    """
+    Headless (bez GUI) vypocet davky na stitnou zlazu pro jednoho pacienta.
+
+    Provede stejne kroky jako aplikace - nacteni DICOMu, korekci na mrtvou dobu,
+    zarovnani na 24h snimek, vypocet cetnosti v ROI, fit RIU a vypocet davky -
+    ale vsechny vstupy dostava jako parametry misto z Tk widgetu.
+    """
+
+    def __init__(
+        self,
+        dicom_paths,
+        ant_roi,
+        pos_roi,
+        podana_aktivita,
+        datum_podani,
+        objem_organu,
+        md_data=None,
+        kal_data=None,
+        typ_korekce="ACSC",
+        spect_uptake=0.0,
+        reference_index=2,
+        dt_korekce=True,
+        dt_sigma=None,
+        zarovnani=True,
+        metoda_zarovnani="fft",
+        oblast=None,
+    ):
+        """
+        Parametry:
+        - dicom_paths: seznam (nebo slovnik {index: cesta}) peti DICOM souboru
+          v poradi 1 h, 4-6 h, 24 h, 48 h, 144 h
+        - ant_roi, pos_roi: binarni masky ROI, mapy oblasti (celociselne, 0 = pozadi),
+          ploche indexy pixelu ROI nebo seznamy bodu polygonu [(x, y), ...]
+        - podana_aktivita: aktivita podana pacientovi v okamziku podani (MBq)
+        - datum_podani: datum a cas podani ve formatu 'dd.mm.yyyy hh:mm'
+        - objem_organu: objem zajmove oblasti (ml)
+        - md_data, kal_data: tabulky mrtvych dob a kalibracnich faktoru (vychozi Optima 640)
+        - typ_korekce: 'ACSC', 'SC', 'AC' nebo 'No corr'
+        - spect_uptake: 24h uptake ze SPECT v procentech (0 = bez korekce na SPECT)
+        - dt_sigma: sigma (pixely) pro pixelovou korekci na mrtvou dobu,
+          None = jeden korekcni faktor na okno
+        - zarovnani: True = zarovnani obou projekci, nebo seznam zarovnavanych
+          projekci (napr. ["ant"]), False / [] = bez zarovnani
+        - metoda_zarovnani: 'fft' (celociselny cyklicky posun) nebo 'phase'
+          (sub-pixelovy posun uplatneny az pri souctu v ROI)
+        - oblast: vyhodnocovana oblast mapy ROI (klic OBLASTI_ROI), None = cela ROI
+        """
+        if isinstance(dicom_paths, dict):
+            self.dicom_paths = dict(dicom_paths)
+        else:
+            self.dicom_paths = dict(enumerate(dicom_paths))
+
+        self.ant_roi = ant_roi
+        self.pos_roi = pos_roi
+        self.podana_aktivita = float(podana_aktivita)
+        if isinstance(datum_podani, datetime):
+            datum_podani = datum_podani.strftime("%d.%m.%Y %H:%M")
+        self.datum_podani = datum_podani
+        self.objem_organu = float(objem_organu)
+        self.md_data = dict(MD_DATA_OPTIMA_640 if md_data is None else md_data)
+        self.kal_data = dict(KAL_DATA_OPTIMA_640 if kal_data is None else kal_data)
+        self.typ_korekce = typ_korekce
+        self.spect_uptake = float(spect_uptake)
+        self.reference_index = reference_index
+        self.dt_korekce = dt_korekce
+        self.dt_sigma = dt_sigma
+        self.zarovnani = zarovnani
+        self.metoda_zarovnani = metoda_zarovnani
+        self.oblast = oblast
+
+        self.dicom_images = {}
+        self.results = {}
+
+    def load(self):
+        # Nacteni hlavicek vsech DICOM souboru, pixely se dekoduji az v prvnim kroku, ktery je pouzije
+        for index, path in self.dicom_paths.items():
+            self.dicom_images[index] = dicom_image()
+            self.dicom_images[index].load_dicom(path, lazy=True)
+        return self.dicom_images
+
+    def dt_correction(self):
+        # Korekce na mrtvou dobu pro vsechna okna z tabulky md_data
+        self.results["dt_correction"] = apply_dt_correction(
+            self.dicom_images, self.md_data, self.dt_sigma
+        )
+        return self.results["dt_correction"]
+
+    def align(self):
+        # Zarovnani projekci (standardne obou) na referencni (24h) snimek jednou
+        # davkovou registraci
+        projekce = ("ant", "pos") if self.zarovnani is True else tuple(self.zarovnani)
+        self.results["shifts"] = align_study(
+            self.dicom_images,
+            projekce,
+            self.reference_index,
+            method=self.metoda_zarovnani,
+        )
+        return self.results["shifts"]
+
+    def _roi_mask(self, roi):
+        # ROI muze byt zadana jako maska, ploche indexy pixelu nebo body polygonu
+        if roi is None:
+            return None
+        roi = np.asarray(roi)
+        if roi.ndim == 1:
+            return roi_indices(roi)
+        shape = self.dicom_images[self.reference_index].ant_pw.shape
+        if (
+            roi.ndim == 2
+            and roi.shape[1] == 2
+            and roi.dtype != bool
+            and roi.shape != shape
+        ):
+            return polygon_mask(shape, [tuple(p) for p in roi])
+        if np.issubdtype(roi.dtype, np.integer):
+            # Mapa oblasti (0 = pozadi, 1.. = oblasti)
+            return roi
+        return roi.astype(bool)
+
+    def count_rates(self):
+        # Prirazeni ROI vsem snimkum a vypocet cetnosti v oknech potrebnych pro korekci
+        ant_roi = self._roi_mask(self.ant_roi)
+        pos_roi = self._roi_mask(self.pos_roi)
+        okna = OKNA_PRO_KOREKCI[self.typ_korekce]
+
+        for image in self.dicom_images.values():
+            image.ant_roi = ant_roi
+            image.pos_roi = pos_roi
+
+        self.results["count_rates"] = roi_count_rates(
+            self.dicom_images, okna, oblast=self.oblast
+        )
+        return self.results["count_rates"]
+
+    def scatter_corrected(self):
+        # Pixelova TEW korekce PW oken cele studie (snimky a mapy nejistot pro export)
+        self.results["tew"] = tew_correct_study(self.dicom_images)
+        return self.results["tew"]
+
+    def evaluate(self):
+        # Uptake v jednotlivych casech a fit RIU modelu
+        uptake = compute_uptake(
+            self.results["count_rates"],
+            self.typ_korekce,
+            self.kal_data,
+            self.podana_aktivita,
+            next(iter(self.dicom_images.values())).energy_windows,
+        )
+        times = np.array(
+            compute_time_differences(
+                self.datum_podani,
+                [image.acq_date for image in self.dicom_images.values()],
+                [image.acq_time for image in self.dicom_images.values()],
+            )
+        )
+        riu_params, riu_params_err, riu_params_covar = riu_fit([times, uptake])
+
+        self.results.update(
+            {
+                "times": times,
+                "uptake": uptake,
+                "riu_params": riu_params,
+                "riu_params_err": riu_params_err,
+                "riu_params_covar": riu_params_covar,
+            }
+        )
+        return self.results
+
+    def dose(self):
+        # Pomer SPECT / planar ve 24h bode (1 = bez korekce na SPECT)
+        if self.spect_uptake:
+            reference_time = self.results["times"][
+                list(self.dicom_images).index(self.reference_index)
+            ]
+            pomer = (0.01 * self.spect_uptake) / riu_uptace_fce(
+                reference_time, *self.results["riu_params"]
+            )
+        else:
+            pomer = 1
+
+        vysledky = compute_dose(
+            self.results["riu_params"],
+            self.results["times"],
+            pomer,
+            self.objem_organu,
+            self.podana_aktivita,
+        )
+        vysledky["pomer"] = pomer
+        vysledky["planned_activities"] = planned_activities(
+            vysledky["big_E"], vysledky["organ_mass"], vysledky["integral_riu"]
+        )
+        self.results.update(vysledky)
+        return vysledky
+
+    def run(self):
+        """
+        Provede cely vypocet a vrati slovnik se vsemi mezivysledky a vysledky.
+        """
+        try:
+            self.load()
+            if self.dt_korekce:
+                self.dt_correction()
+            if self.zarovnani:
+                self.align()
+            self.count_rates()
+            self.evaluate()
+            self.dose()
+            return self.results
+
+        except Exception as e:
+            print(f"Error in dosimetry pipeline: {e}")
+            raise Exception(f"Error in dosimetry pipeline: {e}")
@@ -0,0 +1,177 @@
+"""
+Spousteni narocnych kroku aplikace na pozadi.
+
+Tk neni vlaknove bezpecny, proto se s widgety smi pracovat jen v hlavnim vlakne.
+TaskRunner proto kazdou ulohu rozdeli na dve casti:
+- `work(task, ...)` - vypocet (numpy, soubory) ve vlakne pracovniho poolu,
+  bez jakehokoli pristupu k Tk; prubeh hlasi pres task.progress(),
+- `on_done(vysledek)` / `on_error(vyjimka)` - zobrazeni vysledku v hlavnim vlakne.
+
+Zpravy z pracovniho vlakna (prubeh, vysledek, chyba) jdou pres frontu, kterou hlavni
+vlakno vybira pres root.after(), takze hlavni smycka (a s ni napr. casovac RAM)
+bezi dal. Ulohy se provadeji postupne v poradi zadani - jednotlive kroky
+(korekce, zarovnani, vyhodnoceni) na sobe zavisi. Zruseni je kooperativni:
+task.progress() v pracovnim vlakne vyhodi TaskCancelled, takze uloha skonci
+v nejblizsim kontrolnim bode (pred zmenou dat), a cekajici ulohy se nespusti.
+
+Bez `root` (aplikace bez GUI, testy) se ulohy provadeji synchronne v miste volani.
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Interval vybirani fronty zprav v hlavnim vlakne (ms)
+POLL_MS = 50
+
+
+class TaskCancelled(Exception):
+    """Uloha byla zrusena uzivatelem."""
+
+
+class Task:
+    def __init__(self, name, zpravy=None):
+        self.name = name
+        self._zrusit = threading.Event()
+        self._zpravy = zpravy
+
+    @property
+    def cancelled(self):
+        return self._zrusit.is_set()
+
+    def cancel(self):
+        self._zrusit.set()
+
+    def progress(self, fraction=None, text=None):
+        """
+        Nahlasi prubeh (0-1, None = neurcity) a volitelny popis aktualniho kroku.
+        Zaroven je to kontrolni bod zruseni - pri zrusene uloze vyhodi TaskCancelled.
+        """
+        if self.cancelled:
+            raise TaskCancelled(f"{self.name} cancelled")
+        if self._zpravy is not None:
+            self._zpravy.put(("progress", self, (fraction, text)))
+
+
+class TaskRunner:
+    def __init__(self, root=None, on_progress=None, poll_ms=POLL_MS, max_workers=1):
+        """
+        - root: Tk okno, pres jehoz after() se vybiraji zpravy; None = synchronni beh
+        - on_progress(nazev, podil, text): volano v hlavnim vlakne pri kazde zmene
+          prubehu; po dokonceni vsech uloh s nazvem None
+        - max_workers: pocet pracovnich vlaken (1 = ulohy postupne v poradi zadani)
+        """
+        self.root = root
+        self.on_progress = on_progress
+        self.poll_ms = poll_ms
+        self._zpravy = queue.Queue()
+        self._ulohy = []
+        self._polling = False
+        self._executor = (
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+            if root is not None
+            else None
+        )
+
+    @property
+    def busy(self):
+        # Bezi nebo ceka na spusteni nejaka uloha
+        return bool(self._ulohy)
+
+    def submit(self, name, work, on_done=None, on_error=None):
+        """
+        Spusti work(task) na pozadi. Po dokonceni se v hlavnim vlakne zavola
+        on_done(vysledek), pri chybe on_error(vyjimka); uloha prerusena zrusenim
+        nevola ani jedno. Bez `root` probehne vse hned a chyba bez on_error se vyhodi.
+        Vraci objekt Task (lze ho zrusit pres task.cancel()).
+        """
+        if self._executor is None:
+            task = Task(name)
+            try:
+                vysledek = work(task)
+            except TaskCancelled:
+                return task
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+                return task
+            if on_done is not None:
+                on_done(vysledek)
+            return task
+
+        task = Task(name, self._zpravy)
+        self._ulohy.append(task)
+        self._executor.submit(self._run, task, work, on_done, on_error)
+        self._notify(task.name, None, "Waiting..." if len(self._ulohy) > 1 else "")
+        self._start_polling()
+        return task
+
+    def cancel(self):
+        # Zrusi bezici ulohu (v nejblizsim kontrolnim bode) i vsechny cekajici
+        for task in self._ulohy:
+            task.cancel()
+
+    def shutdown(self):
+        # Zrusi ulohy a ukonci pracovni vlakna (pri zavirani okna)
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task, work, on_done, on_error):
+        # Pracovni vlakno - jen vypocet, vysledek se preda hlavnimu vlaknu frontou
+        try:
+            task.progress(0.0, "")
+            zprava = ("done", task, work(task))
+        except TaskCancelled:
+            zprava = ("cancelled", task, None)
+        except Exception as e:
+            zprava = ("error", task, e)
+        self._zpravy.put(zprava + (on_done, on_error))
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        # Hlavni vlakno - zpracovani vsech zprav z fronty
+        while True:
+            try:
+                zprava = self._zpravy.get_nowait()
+            except queue.Empty:
+                break
+
+            if zprava[0] == "progress":
+                _, task, (fraction, text) = zprava
+                if not task.cancelled:
+                    self._notify(task.name, fraction, text)
+                continue
+
+            druh, task, data, on_done, on_error = zprava
+            self._ulohy.remove(task)
+            if druh == "cancelled":
+                # Dokoncena uloha se zobrazi i pri pozdnim zruseni - data uz se zmenila
+                print(f"{task.name} cancelled.")
+                continue
+            try:
+                if druh == "error":
+                    raise data
+                if on_done is not None:
+                    on_done(data)
+            except Exception as e:
+                # Chyba vypoctu i zobrazeni vysledku se hlasi stejne
+                if on_error is None:
+                    print(f"Error in {task.name}: {e}")
+                else:
+                    on_error(e)
+
+        if self._ulohy:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+            self._notify(None, None, "")
+
+    def _notify(self, name, fraction, text):
+        if self.on_progress is not None:
+            self.on_progress(name, fraction, text)
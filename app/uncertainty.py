@@ -0,0 +1,175 @@
+"""
+Monte Carlo odhad nejistoty absorbovane davky.
+
+Z fitu RIU se vezmou parametry (k_t, k_B, k_T) a jejich kovariancni matice, k nim
+relativni nejistoty kalibracniho faktoru, objemu organu a pomeru SPECT / planar
+(pri korekci SPECT se nejistota kalibrace nepocita, pomer ji uz obsahuje).
+Vzorky vsech vstupu se vygeneruji najednou a vektorizovane se proziji stejnymi
+vzorci jako compute_dose (TIAC v uzavrenem tvaru z app.tiac, konstanta E, davka).
+Vzorky se pocitaji po blocich; kazdy blok ma vlastni potomek SeedSequence, takze
+vysledek pri danem `seed` nezavisi na poctu procesu. Bezne pocty (10^6, ~0.2 s)
+se pocitaji primo v procesu aplikace, az velmi velke pocty se rozdeli mezi procesy
+ProcessPoolExecutoru. Procesy se startuji metodou spawn - fork z pracovniho vlakna
+Tk aplikace s dalsimi bezicimi vlakny neni bezpecny.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.tasks import TaskCancelled
+from app.tiac import riu_integral
+
+# Vychozi relativni nejistoty (1 sigma) vstupu, ktere fit RIU nezahrnuje
+REL_NEJISTOTA_KALIBRACE = 0.05
+REL_NEJISTOTA_OBJEMU = 0.10
+REL_NEJISTOTA_POMERU = 0.05
+
+# Vychozi pocet vzorku a velikost bloku pro jeden proces
+DEFAULT_SAMPLES = 1_000_000
+CHUNK_SAMPLES = 250_000
+
+# Od tohoto poctu vzorku se pocita ve vice procesech - pod nim je start procesu
+# (spawn, import numpy/scipy) drazsi nez cely vypocet
+PARALLEL_MIN_SAMPLES = 10_000_000
+
+
+def sample_doses(
+    rng,
+    n,
+    riu_params,
+    riu_covar,
+    objem_organu,
+    podana_aktivita,
+    pomer=1.0,
+    rel_kalibrace=REL_NEJISTOTA_KALIBRACE,
+    rel_objem=REL_NEJISTOTA_OBJEMU,
+    rel_pomer=REL_NEJISTOTA_POMERU,
+):
+    """
+    Vygeneruje `n` vzorku vstupu a vrati (TIAC ve dnech, davka v Gy) pro platne vzorky.
+    Parametry RIU jsou korelovane (vicerozmerne normalni rozdeleni s kovarianci fitu),
+    kalibracni faktor, objem a pomer SPECT nezavisle normalni. Uptake, a tedy k_t,
+    je neprimo umerny kalibracnimu faktoru. Pri korekci SPECT (pomer != 1) uz pomer
+    spect / fit(24h) kalibraci planarnich snimku obsahuje, nejistota kalibrace se
+    proto nezapocita podruhe. Nefyzikalni vzorky (zaporne konstanty, k_B <= k_T,
+    nekladny objem) se zahodi.
+    """
+    if float(pomer) != 1.0:
+        # Kalibrace se v pomeru SPECT / planar vykrati
+        rel_kalibrace = 0.0
+    covar = np.nan_to_num(np.asarray(riu_covar, dtype=np.float64))
+    k_t, k_B, k_T = rng.multivariate_normal(
+        np.asarray(riu_params, dtype=np.float64), covar, size=n, method="eigh"
+    ).T
+    kalibrace = rng.normal(1.0, rel_kalibrace, n)
+    objem = float(objem_organu) * rng.normal(1.0, rel_objem, n)
+    pomer = float(pomer) * rng.normal(1.0, rel_pomer, n)
+
+    valid = (k_t > 0) & (k_T > 0) & (k_B > k_T) & (kalibrace > 0) & (objem > 0)
+    valid &= pomer > 0
+    k_t, k_B, k_T = k_t[valid] / kalibrace[valid], k_B[valid], k_T[valid]
+
+    # Stejne vzorce jako compute_dose (bez zaokrouhleni)
+    integral_riu = pomer[valid] * riu_integral(k_t, k_B, k_T) / 24
+    organ_mass = objem[valid] * 1.045
+    big_E = (organ_mass**0.25 + 18) / 7.2
+    davka = podana_aktivita * big_E * integral_riu / organ_mass
+    return integral_riu, davka
+
+
+def _sample_chunk(args):
+    # Jeden blok vzorku v procesu - vlastni generator ze zadane SeedSequence
+    seed, n, kwargs = args
+    return sample_doses(np.random.default_rng(seed), n, **kwargs)
+
+
+def dose_uncertainty(
+    riu_params,
+    riu_covar,
+    objem_organu,
+    podana_aktivita,
+    pomer=1.0,
+    n_samples=DEFAULT_SAMPLES,
+    workers=None,
+    seed=None,
+    interval=95.0,
+    progress=None,
+    **rel_nejistoty,
+):
+    """
+    Monte Carlo interval spolehlivosti absorbovane davky a TIAC.
+    Vzorky se pocitaji po blocich CHUNK_SAMPLES; od PARALLEL_MIN_SAMPLES vzorku
+    se bloky rozdeli mezi `workers` procesu (standardne pocet jader), mensi
+    pocty se spocitaji primo.
+    `rel_nejistoty` jsou volitelne rel_kalibrace, rel_objem a rel_pomer
+    (viz sample_doses). `progress(podil)` se vola po kazdem bloku (napr.
+    Task.progress, ktery vypocet pri zruseni prerusi).
+    Vraci slovnik s medianem, prumerem, smerodatnou odchylkou a mezemi intervalu
+    (`interval` v procentech) davky (Gy) a TIAC (dny) a poctem platnych vzorku.
+    """
+    try:
+        kwargs = dict(
+            riu_params=tuple(float(p) for p in riu_params),
+            riu_covar=np.asarray(riu_covar, dtype=np.float64),
+            objem_organu=float(objem_organu),
+            podana_aktivita=float(podana_aktivita),
+            pomer=float(pomer),
+            **rel_nejistoty,
+        )
+        sizes = [CHUNK_SAMPLES] * (n_samples // CHUNK_SAMPLES)
+        if n_samples % CHUNK_SAMPLES:
+            sizes.append(n_samples % CHUNK_SAMPLES)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        chunks = [(s, n, kwargs) for s, n in zip(seeds, sizes)]
+
+        workers = workers or os.cpu_count() or 1
+        vysledky = []
+        if n_samples >= PARALLEL_MIN_SAMPLES and len(chunks) > 1 and workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            try:
+                for vysledek in executor.map(_sample_chunk, chunks):
+                    vysledky.append(vysledek)
+                    if progress is not None:
+                        progress(len(vysledky) / len(chunks))
+            finally:
+                # Pri zruseni (TaskCancelled z progress) se cekajici bloky zahodi
+                # a na bezici se neceka
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for chunk in chunks:
+                vysledky.append(_sample_chunk(chunk))
+                if progress is not None:
+                    progress(len(vysledky) / len(chunks))
+
+        integral_riu = np.concatenate([v[0] for v in vysledky])
+        davka = np.concatenate([v[1] for v in vysledky])
+        if not davka.size:
+            raise ValueError("no valid Monte Carlo samples")
+
+        meze = (50 - interval / 2, 50, 50 + interval / 2)
+        davka_low, davka_median, davka_high = np.percentile(davka, meze)
+        tiac_low, tiac_median, tiac_high = np.percentile(integral_riu, meze)
+        return {
+            "interval": interval,
+            "n_valid": int(davka.size),
+            "davka_median": davka_median,
+            "davka_mean": float(np.mean(davka)),
+            "davka_std": float(np.std(davka)),
+            "davka_low": davka_low,
+            "davka_high": davka_high,
+            "tiac_median": tiac_median,
+            "tiac_low": tiac_low,
+            "tiac_high": tiac_high,
+        }
+
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        print(f"Error in Monte Carlo dose uncertainty: {e}")
+        raise Exception(f"Error in Monte Carlo dose uncertainty: {e}")
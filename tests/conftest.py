@@ -0,0 +1,95 @@
+import sys
+import os
+import pytest
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+# Přidáme do sys.path nadřazený adresář aktuálního souboru, aby Python našel modul 'app'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def write_planar_dicom(
+    path, frames, acq_date, acq_time, acq_dur_ms=300000, energy_windows=None
+):
+    """
+    Zapise jednoduchy multi-frame DICOM (NM) se zadanymi snimky (pole N x H x W, uint16)
+    a metadaty akvizice. Slouzi jako testovaci data misto realnych studii.
+    `energy_windows` je volitelny seznam mezi oken [(dolni, horni) keV, ...]
+    zapsany do Energy Window Information Sequence; roviny patri oknum po dvou.
+    """
+    frames = np.asarray(frames, dtype=np.uint16)
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.20"
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = "NM"
+    ds.AcquisitionDate = acq_date
+    ds.AcquisitionTime = acq_time
+    ds.ActualFrameDuration = acq_dur_ms
+    ds.NumberOfFrames = frames.shape[0]
+    ds.Rows, ds.Columns = frames.shape[1:]
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = frames.tobytes()
+
+    if energy_windows is not None:
+        items = []
+        for lower, upper in energy_windows:
+            window_range = Dataset()
+            window_range.EnergyWindowLowerLimit = lower
+            window_range.EnergyWindowUpperLimit = upper
+            item = Dataset()
+            item.EnergyWindowRangeSequence = [window_range]
+            items.append(item)
+        ds.EnergyWindowInformationSequence = items
+        ds.EnergyWindowVector = [1 + i // 2 for i in range(frames.shape[0])]
+
+    pydicom.dcmwrite(path, ds, enforce_file_format=True)
+    return path
+
+
+def synthetic_study(folder, shape=(32, 32), times_h=(1, 5, 24, 48, 144)):
+    """
+    Vytvori ve slozce `folder` pet DICOM souboru se stitnou zlazou (ctverec uprostred),
+    jejiz aktivita sleduje RIU krivku. Podani je 01.06.2025 08:00.
+    Vraci seznam cest serazeny podle casu akvizice.
+    """
+    k_t, k_B, k_T = 0.05, 0.1, 0.005
+    paths = []
+    for i, t in enumerate(times_h):
+        uptake = (k_t / (k_B - k_T)) * (np.exp(-k_T * t) - np.exp(-k_B * t))
+        pw = np.full(shape, 2.0)
+        pw[12:20, 12:20] += 4000.0 * uptake
+        scatter = np.full(shape, 1.0)
+        scatter[12:20, 12:20] += 20.0 * uptake
+        frames = np.stack([pw, pw * 0.9, scatter, scatter, scatter, scatter])
+
+        day = 1 + (8 + t) // 24
+        hour = (8 + t) % 24
+        paths.append(
+            write_planar_dicom(
+                os.path.join(folder, f"acq_{i}.dcm"),
+                np.round(frames),
+                f"202506{day:02d}",
+                f"{hour:02d}0000",
+            )
+        )
+    return paths
+
+
+@pytest.fixture
+def study_paths(tmp_path):
+    # Fixture s peti syntetickymi akvizicemi jednoho pacienta
+    return synthetic_study(str(tmp_path))
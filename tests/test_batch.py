@@ -0,0 +1,220 @@
+import csv
+import json
+import os
+import shutil
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from app.batch import find_patient_folders, process_patient, run_batch, main
+from app.functions import najdi_akvizice, nacti_studii, polygon_mask, set_roi_region
+from app.functions import MD_DATA_OPTIMA_640, KAL_DATA_OPTIMA_640
+from conftest import synthetic_study
+
+ROI = [[10.5, 10.5], [20.5, 10.5], [20.5, 20.5], [10.5, 20.5]]
+
+
+def make_patient(folder, **overrides):
+    # Vytvori slozku pacienta s peti akvizicemi a vstupnim souborem
+    os.makedirs(folder, exist_ok=True)
+    synthetic_study(folder)
+    vstupy = {
+        "podana_aktivita": 100.0,
+        "datum_podani": "01.06.2025 08:00",
+        "objem_organu": 20.0,
+        "ant_roi": ROI,
+        "pos_roi": ROI,
+    }
+    vstupy.update(overrides)
+    with open(os.path.join(folder, "dosithyroid.json"), "w") as f:
+        json.dump(vstupy, f)
+    return folder
+
+
+def test_najdi_akvizice_sorts_by_acquisition_time(tmp_path):
+    # Soubory jsou serazeny podle casu akvizice, ne podle nazvu
+    paths = synthetic_study(str(tmp_path))
+    renamed = []
+    for i, path in enumerate(paths):
+        new = os.path.join(str(tmp_path), f"{9 - i}.dcm")
+        os.rename(path, new)
+        renamed.append(new)
+    assert najdi_akvizice(str(tmp_path)) == renamed
+
+
+def test_nacti_studii_fills_slots_by_acquisition_time(tmp_path):
+    # Cela slozka se nacte najednou, sloty odpovidaji poradi akvizic v case
+    paths = synthetic_study(str(tmp_path))
+    for i, path in enumerate(paths):
+        os.rename(path, os.path.join(str(tmp_path), f"{9 - i}.dcm"))
+
+    images = nacti_studii(str(tmp_path), workers=3)
+    assert list(images) == [0, 1, 2, 3, 4]
+    assert [images[i].acq_time for i in images] == [
+        "090000",
+        "130000",
+        "080000",
+        "080000",
+        "080000",
+    ]
+    dates = [images[i].acq_date for i in images]
+    assert dates[2:] == ["20250602", "20250603", "20250607"]
+    assert images[2].ant_pw[15, 15] > images[0].ant_pw[15, 15]
+
+    with pytest.raises(Exception) as excinfo:
+        nacti_studii(str(tmp_path), pocet_akvizic=4)
+    assert "expected 4 DICOM acquisitions" in str(excinfo.value)
+
+
+def test_find_patient_folders(tmp_path):
+    # Pacienti se hledaji rekurzivne, vystupni slozka GUI neni samostatny pacient
+    make_patient(str(tmp_path / "a"))
+    make_patient(str(tmp_path / "group" / "b"))
+    os.makedirs(tmp_path / "a" / "dosithyroid_output")
+    assert find_patient_folders(str(tmp_path)) == [
+        str(tmp_path / "a"),
+        str(tmp_path / "group" / "b"),
+    ]
+
+
+def test_process_patient_decay_corrects_activity(tmp_path):
+    # Bez podane aktivity se aktivita prepocita premenovym zakonem
+    folder = make_patient(
+        str(tmp_path / "p"), aktivita=200.0, datum_aktivity="24.05.2025 08:00"
+    )
+    with open(os.path.join(folder, "dosithyroid.json")) as f:
+        vstupy = json.load(f)
+    del vstupy["podana_aktivita"]
+    with open(os.path.join(folder, "dosithyroid.json"), "w") as f:
+        json.dump(vstupy, f)
+
+    row = process_patient(folder)
+    assert row["status"] == "ok"
+    # Mezi kalibraci a podanim uplynulo 8 dni, tedy temer jeden polocas I-131
+    assert row["podana_aktivita"] == pytest.approx(200.0 / 2, rel=1e-2)
+
+
+def test_process_patient_rejects_wrong_number_of_acquisitions(tmp_path):
+    # Chybejici nebo navic akvizice se hlasi jako chyba, ne jako spatna davka
+    folder = make_patient(str(tmp_path / "p"))
+    os.remove(os.path.join(folder, "acq_4.dcm"))
+    row = process_patient(folder)
+    assert row["status"] == "error"
+    assert "expected 5 DICOM acquisitions, found 4" in row["error"]
+
+    shutil.copy(os.path.join(folder, "acq_0.dcm"), os.path.join(folder, "a.dcm"))
+    shutil.copy(os.path.join(folder, "acq_1.dcm"), os.path.join(folder, "b.dcm"))
+    row = process_patient(folder)
+    assert "found 6" in row["error"]
+
+
+def test_run_batch_writes_one_row_per_patient(tmp_path):
+    # Kazdy pacient ma jeden radek, chybny pacient nezastavi ostatni
+    archive = tmp_path / "archive"
+    make_patient(str(archive / "p1"))
+    make_patient(str(archive / "p2"), objem_organu=40.0)
+    broken = make_patient(str(archive / "p3"))
+    os.remove(os.path.join(broken, "acq_0.dcm"))
+    with open(os.path.join(broken, "acq_1.dcm"), "wb") as f:
+        f.write(b"not a dicom")
+
+    output = tmp_path / "out.csv"
+    rows = run_batch(str(archive), str(output), workers=2)
+
+    with open(output, newline="") as f:
+        written = list(csv.DictReader(f))
+    assert len(written) == 3
+    assert [r["status"] for r in written] == ["ok", "ok", "error"]
+    assert written[2]["error"]
+    # Vetsi objem organu pri stejne kinetice znamena mensi davku
+    assert float(rows[1]["absorbovana_davka"]) < float(rows[0]["absorbovana_davka"])
+
+
+def test_main_with_calibration_override(tmp_path):
+    # Zmena kalibracniho faktoru se promitne do prepoctene davky
+    archive = tmp_path / "archive"
+    make_patient(str(archive / "p1"))
+    kal = tmp_path / "kal.json"
+    kal.write_text(json.dumps({"ACSC": 7.77 * 2, "SC": 1, "AC": 1, "No corr": 1}))
+
+    assert main([str(archive), "-o", str(tmp_path / "a.csv"), "-j", "1"]) == 0
+    assert (
+        main([str(archive), "-o", str(tmp_path / "b.csv"), "--kal-data", str(kal)])
+        == 0
+    )
+
+    with open(tmp_path / "a.csv", newline="") as f:
+        uptake_a = np.array(next(csv.DictReader(f))["uptake"].split(), dtype=float)
+    with open(tmp_path / "b.csv", newline="") as f:
+        uptake_b = np.array(next(csv.DictReader(f))["uptake"].split(), dtype=float)
+    np.testing.assert_allclose(uptake_b, uptake_a / 2, rtol=1e-4)
+
+
+def test_gui_saved_inputs_reproduce_dose(tmp_path, monkeypatch):
+    # Vstupy ulozene z GUI pri vyhodnoceni a vypoctu davky davkovy prepocet
+    # precte a spocita stejnou davku
+    import app.main
+    from app.main import aplikace
+
+    folder = str(tmp_path / "p")
+    os.makedirs(folder)
+    synthetic_study(folder)
+
+    gui = aplikace(init_gui=False)
+    gui.folder_path = folder
+    gui.output_folder = os.path.join(folder, "dosithyroid_output")
+    os.makedirs(gui.output_folder)
+    gui.dicom_images = nacti_studii(folder)
+    gui.md_data = dict(MD_DATA_OPTIMA_640)
+    gui.kal_data = dict(KAL_DATA_OPTIMA_640)
+    gui.provedeni_korekce_MD = False
+    gui.evaluace_grafu = False
+    gui.window_height = 500
+    for widget in (
+        "update_image_labels",
+        "img_labels_ant",
+        "img_labels_pos",
+        "image_size",
+        "graph_frame",
+        "results_tree_dose_1",
+        "results_tree_dose_2",
+        "dose_ci_label",
+    ):
+        setattr(gui, widget, MagicMock())
+    for widget, value in {
+        "subpixel_alignment": True,
+        "entry_act_computed_value": "100.00",
+        "entry_date_pacient": "01.06.2025 08:00",
+        "typ_korekce": "ACSC",
+        "sz_selected_option": "Right lobe",
+        "volume_of_organ": "20",
+        "spect_entry_value": "0",
+    }.items():
+        setattr(gui, widget, MagicMock(**{"get.return_value": value}))
+    # Vykresleni grafu se netestuje
+    monkeypatch.setattr(app.main, "Graf_1", MagicMock())
+    monkeypatch.setattr(app.main, "FigureCanvasTkAgg", MagicMock())
+
+    gui.DT_correction()
+    gui.align_ANT()
+    gui.align_POS()
+    shape = gui.dicom_images[2].ant_pw.shape
+    labels = set_roi_region(None, polygon_mask(shape, [tuple(p) for p in ROI]), 2)
+    labels = set_roi_region(
+        labels, polygon_mask(shape, [(13.5, 13.5), (16.5, 13.5), (16.5, 16.5)]), 4
+    )
+    for image in gui.dicom_images.values():
+        image.ant_roi = labels
+        image.pos_roi = labels
+    gui.graph_evalueation()
+    gui.compute_activity_and_dose()
+
+    assert find_patient_folders(str(tmp_path)) == [folder]
+    row = process_patient(folder)
+    assert row["status"] == "ok", row.get("error")
+    assert row["absorbovana_davka"] == pytest.approx(gui.absorbovana_davka)
+    np.testing.assert_allclose(
+        [float(u) for u in row["uptake"].split()], gui.uptake_for_graph, rtol=1e-5
+    )
@@ -0,0 +1,97 @@
+import csv
+
+import numpy as np
+import pytest
+
+from app.cohort_fit import fit_riu_cohort, main
+from app.functions import riu_fit, riu_initial_params, riu_uptace_fce
+from app.functions import RIU_PARAMS_DEFAULT
+
+TIMES = np.array([1.0, 5.0, 24.0, 48.0, 144.0])
+
+
+def make_cohort(n, noise=0.03, seed=0):
+    # Nahodna kohorta RIU krivek s relativnim sumem
+    rng = np.random.default_rng(seed)
+    params = np.column_stack(
+        (
+            0.05 * rng.uniform(0.5, 2, n),
+            0.1 * rng.uniform(0.5, 2, n),
+            0.005 * rng.uniform(0.5, 2, n),
+        )
+    )
+    uptake = riu_uptace_fce(TIMES, *(params[:, i, None] for i in range(3)))
+    return uptake * (1 + rng.normal(0, noise, uptake.shape))
+
+
+@pytest.mark.parametrize("relative_error", [None, 0.05])
+def test_cohort_fit_matches_riu_fit(relative_error):
+    # Hromadny fit dava pro kazdeho pacienta stejne vysledky jako riu_fit
+    uptake = make_cohort(40)
+    y_err = None if relative_error is None else relative_error * uptake
+
+    params, errors, covar, converged = fit_riu_cohort(TIMES, uptake, y_err)
+
+    assert converged.all()
+    assert covar.shape == (40, 3, 3)
+    for i in range(40):
+        expected = riu_fit((TIMES, uptake[i]), None if y_err is None else y_err[i])
+        np.testing.assert_allclose(params[i], expected[0], rtol=1e-5)
+        np.testing.assert_allclose(errors[i], expected[1], rtol=1e-4)
+        np.testing.assert_allclose(covar[i], expected[2], rtol=1e-4, atol=1e-15)
+
+
+def test_cohort_initial_params_match_single_patient():
+    # Vektorizovane pocatecni odhady odpovidaji riu_initial_params
+    uptake = make_cohort(200, noise=0.1, seed=1)
+    cohort = riu_initial_params(np.broadcast_to(TIMES, uptake.shape), uptake)
+    assert cohort.shape == (200, 3)
+    for i in range(200):
+        single = riu_initial_params(TIMES, uptake[i])
+        np.testing.assert_allclose(cohort[i], single)
+        # Stejny vysledek jako fit logaritmu pozdnich bodu pres np.polyfit
+        late = np.arange(len(TIMES)) >= np.argmax(uptake[i])
+        if single != RIU_PARAMS_DEFAULT:
+            slope, _ = np.polyfit(TIMES[late], np.log(uptake[i][late]), 1)
+            assert single[2] == pytest.approx(-slope)
+
+
+def test_cohort_fit_flags_invalid_rows():
+    # Radky s NaN nebo nulovymi nejistotami se nefituji a jsou oznaceny
+    uptake = make_cohort(4)
+    uptake[1, 2] = np.nan
+    y_err = 0.05 * np.abs(np.nan_to_num(uptake))
+    y_err[3] = 0
+
+    params, errors, _, converged = fit_riu_cohort(TIMES, uptake, y_err)
+
+    assert converged.tolist() == [True, False, True, False]
+    assert np.isnan(params[[1, 3]]).all() and np.isfinite(params[[0, 2]]).all()
+
+    with pytest.raises(Exception):
+        fit_riu_cohort(TIMES, uptake[0])
+
+
+def test_main_writes_one_row_per_patient(tmp_path):
+    # CLI cte vystup davkoveho prepoctu a preskoci pacienty bez dat
+    uptake = make_cohort(3)
+    source = tmp_path / "batch.csv"
+    with open(source, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["patient", "times_h", "uptake"])
+        writer.writeheader()
+        for i, row in enumerate(uptake):
+            writer.writerow(
+                {
+                    "patient": f"p{i}",
+                    "times_h": " ".join(f"{t:.3f}" for t in TIMES),
+                    "uptake": " ".join(f"{u:.6f}" for u in row),
+                }
+            )
+        writer.writerow({"patient": "broken", "times_h": "", "uptake": ""})
+
+    output = tmp_path / "fit.csv"
+    assert main([str(source), "-o", str(output)]) == 0
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["patient"] for row in rows] == ["p0", "p1", "p2"]
+    assert all(row["converged"] == "True" for row in rows)
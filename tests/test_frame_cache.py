@@ -0,0 +1,120 @@
+import os
+from unittest.mock import patch
+
+import numpy as np
+
+from app.frame_cache import FrameCache
+from app.functions import nacti_studii, WORK_DTYPE
+from conftest import synthetic_study, write_planar_dicom
+
+
+def write_frames(path, value):
+    # DICOM se sesti okny plnymi hodnoty `value`
+    frames = np.full((6, 8, 8), value)
+    return write_planar_dicom(str(path), frames, "20250101", "101010", 1500)
+
+
+def test_cache_miss_then_hit_skips_decoding(tmp_path):
+    # Druhe nacteni stejneho snimku jde z cache (memmap) bez dekoderu
+    path = write_frames(tmp_path / "a.dcm", 7)
+    cache = FrameCache(str(tmp_path / "cache"))
+
+    with patch("app.functions.map_pixel_data", return_value=None):
+        first = cache.load_image(path)
+    np.testing.assert_array_equal(first.frames, 7)
+    assert cache.size() > 0
+
+    with patch("pydicom.pixels.pixel_array") as decoder:
+        second = cache.load_image(path)
+        decoder.assert_not_called()
+    assert isinstance(second.frames, np.memmap)
+    np.testing.assert_array_equal(second.frames, first.frames)
+    assert (second.acq_date, second.acq_time, second.acq_dur) == (
+        "20250101",
+        "101010",
+        1.5,
+    )
+
+    # Zapis do okna nacteneho z cache vytvori kopii, zaznam v cache zustane beze zmeny
+    second.ant_pw = np.zeros((8, 8))
+    np.testing.assert_array_equal(second.ant_pw, 0)
+    frames, _ = cache.get(cache._entries()[0][2])
+    np.testing.assert_array_equal(frames, 7)
+
+
+def test_cache_skips_memory_mapped_files(tmp_path):
+    # Nekomprimovana data se mapuji primo ze souboru, do cache se neukladaji
+    path = write_frames(tmp_path / "a.dcm", 3)
+    cache = FrameCache(str(tmp_path / "cache"))
+    image = cache.load_image(path)
+    assert image.is_memory_mapped
+    assert cache.size() == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    # Pri prekroceni velikosti se smaze nejdele nepouzity zaznam
+    cache = FrameCache(str(tmp_path / "cache"))
+    entry = 6 * 8 * 8 * np.dtype(WORK_DTYPE).itemsize + 128
+    cache.max_bytes = 3 * entry + 100
+
+    for uid, t in (("a", 100), ("b", 200), ("c", 300)):
+        cache.put(uid, np.zeros((6, 8, 8)), {"acq_dur": 1.0})
+        os.utime(cache._paths(uid)[0], (t, t))
+
+    # Pouziti zaznamu 'a' ho posune na konec fronty
+    assert cache.get("a") is not None
+    cache.put("d", np.zeros((6, 8, 8)), {"acq_dur": 1.0})
+
+    assert cache.get("b") is None
+    assert all(cache.get(uid) is not None for uid in ("a", "c", "d"))
+
+
+def test_cache_eviction_tolerates_races_and_locked_files(tmp_path):
+    # Zaznam smazany jinym vlaknem ani namapovany soubor (Windows) uklid nezastavi
+    cache = FrameCache(str(tmp_path / "cache"))
+    for uid, t in (("a", 100), ("b", 200), ("c", 300)):
+        cache.put(uid, np.zeros((6, 8, 8)), {"acq_dur": 1.0})
+        os.utime(cache._paths(uid)[0], (t, t))
+    for path in cache._paths("b"):
+        os.remove(path)  # soubezny uklid uz 'b' smazal
+    cache.max_bytes = 0
+
+    remove = os.remove
+
+    def locked_remove(path):
+        if path == cache._paths("a")[0]:
+            raise PermissionError("file is memory-mapped")
+        remove(path)
+
+    with patch("app.frame_cache.os.remove", side_effect=locked_remove):
+        cache.evict()
+
+    # Soubor zmizely mezi vypisem adresare a os.stat se preskoci
+    listdir = os.listdir
+    with patch(
+        "app.frame_cache.os.listdir", side_effect=lambda d: listdir(d) + ["x.npy"]
+    ):
+        assert [uid for _, _, uid in cache._entries()] == ["a"]
+
+    # 'a' zustal cely, ostatni zaznamy jsou pryc
+    assert cache.get("a") is not None
+    assert cache.get("c") is None
+    assert sorted(os.listdir(cache.directory)) == ["a.json", "a.npy"]
+
+
+def test_nacti_studii_through_cache(tmp_path):
+    # Nacteni studie pres cache dava stejna data jako primo ze souboru
+    folder = tmp_path / "study"
+    os.makedirs(folder)
+    synthetic_study(str(folder))
+    cache = FrameCache(str(tmp_path / "cache"))
+
+    with patch("app.functions.map_pixel_data", return_value=None):
+        direct = nacti_studii(str(folder))
+        nacti_studii(str(folder), cache=cache)
+    cached = nacti_studii(str(folder), cache=cache)
+
+    for index in direct:
+        assert isinstance(cached[index].frames, np.memmap)
+        np.testing.assert_array_equal(cached[index].frames, direct[index].frames)
+        assert cached[index].acq_time == direct[index].acq_time
@@ -1,5 +1,6 @@
 import sys
 import os
+import time
 import pytest
 import numpy as np
 from PIL import Image
@@ -11,6 +12,7 @@ import matplotlib
 
 matplotlib.use("Agg")
 import locale
+from scipy.ndimage import gaussian_filter
 
 # Přidáme do sys.path nadřazený adresář aktuálního souboru, aby Python našel modul 'app'
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -22,7 +24,20 @@ from app.functions import premenovy_zakon
 from app.functions import tew_correction
 from app.functions import compute_time_differences
 from app.functions import Graf_1
-from app.functions import riu_uptace_fce, riu_fit
+from app.functions import riu_uptace_fce, riu_fit, riu_jacobian
+from app.functions import study_stack, WINDOWS, align_projection, roi_count_rates
+from app.functions import WORK_DTYPE, tew_correct_study, tew_widths
+from app.functions import registration_shifts, align_study
+from app.functions import phase_correlation_shifts, shift_image
+from app.functions import polygon_mask, roi_indices
+from app.functions import nested_nodes, region_label, region_labels, set_roi_region
+from app.functions import apply_dt_correction, dt_correction_factor
+from app.functions import dt_correction_factor_table, dt_correction_map
+from app.functions import preview_lut, preview_image, ROI_overlay_renderer
+from app.tasks import TaskCancelled
+from scipy.special import lambertw
+from matplotlib.path import Path
+from conftest import write_planar_dicom
 
 
 # Fixture: zakladni mockovany DICOM objekt
@@ -120,6 +135,492 @@ def test_convert_to_image_invalid_type(dicom_mock):
         assert "Invalid planar type" in str(excinfo.value)
 
 
+def write_six_windows(path, n_frames=6):
+    # Realny DICOM soubor, kde kazda rovina je plna hodnoty (index roviny + 1) * 10
+    frames = np.stack([np.full((4, 4), (i + 1) * 10) for i in range(n_frames)])
+    return write_planar_dicom(str(path), frames, "20250101", "101010", 1500)
+
+
+def test_load_header_defers_pixel_decoding(tmp_path):
+    # Hlavicka se nacte bez pixelu, kazde okno se dekoduje az pri prvnim pristupu a jen jednou
+    path = write_six_windows(tmp_path / "six.dcm")
+    import pydicom.pixels
+
+    calls = []
+    original = pydicom.pixels.pixel_array
+    original_iter = pydicom.pixels.iter_pixels
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs.get("index"))
+        return original(*args, **kwargs)
+
+    def counting_iter(*args, **kwargs):
+        for index, frame in zip(kwargs["indices"], original_iter(*args, **kwargs)):
+            calls.append(index)
+            yield frame
+
+    # Bez namapovani souboru (jako u komprimovanych dat) se okna dekoduji
+    with patch("pydicom.pixels.pixel_array", side_effect=counting), patch(
+        "pydicom.pixels.iter_pixels", side_effect=counting_iter
+    ), patch("app.functions.map_pixel_data", return_value=None):
+        dcm = dicom_image()
+        dcm.load_dicom(path, lazy=True)
+        assert (dcm.acq_date, dcm.acq_time, dcm.acq_dur) == ("20250101", "101010", 1.5)
+        assert calls == [] and not dcm.is_loaded
+
+        np.testing.assert_array_equal(dcm.pos_pw, 20)
+        np.testing.assert_array_equal(dcm.pos_pw, 20)
+        assert dcm.pos_max == 20
+        assert calls == [1]
+
+        # Zbyvajici okna se dekoduji najednou, uz dekodovane okno se necte znovu
+        np.testing.assert_array_equal(dcm.frames[:, 0, 0], [10, 20, 30, 40, 50, 60])
+        assert calls == [1, 0, 2, 3, 4, 5] and dcm.is_loaded
+        dcm.ant_usw
+        assert len(calls) == 6
+
+
+def test_load_header_two_windows_and_overwrite(tmp_path):
+    # U souboru jen s PW okny jsou scatter okna jednicky; zapsane okno se ze souboru necte
+    path = write_six_windows(tmp_path / "two.dcm", n_frames=2)
+    dcm = dicom_image()
+    dcm.load_header(path)
+
+    dcm.ant_pw = np.full((4, 4), 5.0)
+    np.testing.assert_array_equal(dcm.ant_pw, 5.0)
+    np.testing.assert_array_equal(dcm.pos_lsw, 1.0)
+    np.testing.assert_array_equal(dcm.frames[:, 0, 0], [5, 20, 1, 1, 1, 1])
+
+    # Eager nacteni dava stejna data
+    eager = dicom_image()
+    eager.load_dicom(path)
+    np.testing.assert_array_equal(eager.frames[1:], dcm.frames[1:])
+
+
+def test_load_header_memory_maps_uncompressed_pixels(tmp_path):
+    # Nekomprimovana data se nedekoduji - okna jsou pohledy jen pro cteni do souboru
+    path = write_six_windows(tmp_path / "six.dcm")
+    with patch("pydicom.pixels.pixel_array") as decoder:
+        dcm = dicom_image()
+        dcm.load_header(path)
+
+        assert isinstance(dcm.ant_lsw, np.memmap)
+        assert not dcm.ant_lsw.flags.writeable
+        np.testing.assert_array_equal(dcm.ant_lsw, 30)
+        assert dcm.ant_max == 10
+
+        # Zapis okna vytvori float kopii jen tohoto okna, ostatni zustavaji namapovana
+        dcm.ant_pw = dcm.ant_pw * 2.0
+        np.testing.assert_array_equal(dcm.ant_pw, 20.0)
+        assert isinstance(dcm.pos_pw, np.memmap)
+
+        # Zasobnik studie kopiruje primo ze souboru
+        study = study_stack.from_images({0: dcm})
+        np.testing.assert_array_equal(study.data[0, :, 0, 0], [20, 20, 30, 40, 50, 60])
+        assert dcm.is_loaded and np.shares_memory(dcm.ant_pw, study.data)
+        decoder.assert_not_called()
+
+
+#### STUDY STACK ----------------------------
+
+
+def make_study_images(n=3, shape=(8, 8)):
+    # Pripravi slovnik dicom_image s nahodnymi snimky ve vsech 6 oknech
+    rng = np.random.default_rng(0)
+    images = {}
+    for key in range(n):
+        img = dicom_image()
+        img.frames = rng.integers(0, 100, size=(6,) + shape).astype(float)
+        img.acq_dur = 10.0 * (key + 1)
+        images[key] = img
+    return images
+
+
+def test_dicom_image_windows_are_views_of_frames():
+    # Okna dicom_image jsou pohledy do spolecneho pole frames, zapis jde in-place
+    img = make_study_images(1)[0]
+    for i, name in enumerate(WINDOWS):
+        assert np.shares_memory(getattr(img, name), img.frames)
+        np.testing.assert_array_equal(getattr(img, name), img.frames[i])
+
+    img.pos_lsw = np.full((8, 8), 7.0)
+    np.testing.assert_array_equal(img.frames[3], 7.0)
+
+    with pytest.raises(ValueError):
+        img.ant_pw = np.zeros((4, 4))
+
+
+def test_study_stack_from_images_shares_memory():
+    # Po vytvoreni zasobniku ukazuji snimky do nej a zmena zasobniku je v nich videt
+    images = make_study_images()
+    original = {k: img.frames.copy() for k, img in images.items()}
+    study = study_stack.from_images(images)
+
+    assert study.data.shape == (3, 6, 8, 8)
+    for t, key in enumerate(study.keys):
+        np.testing.assert_array_equal(study.data[t], original[key])
+        assert np.shares_memory(images[key].ant_pw, study.data)
+
+    study.data[1, 0] = -1
+    np.testing.assert_array_equal(images[1].ant_pw, -1)
+
+    # Opakovane volani vrati stejny zasobnik, dokud se snimky nezmeni
+    assert study_stack.of(images) is study
+    images[2] = make_study_images(3)[2]
+    assert study_stack.of(images) is not study
+
+
+def test_preview_lut_matches_direct_scaling():
+    # Vychozi LUT dava stejny 8-bitovy obraz jako skalovani na 0-255 a oriznuti
+    img = make_study_images(1)[0]
+    img.ant_max = 60  # hodnoty nad maximem se saturuji
+    expected = np.clip(img.ant_pw * 255.0 / 60, 0, 255).astype(np.uint8)
+    np.testing.assert_array_equal(np.asarray(img.convert_to_image("ant_pw")), expected)
+
+    # Uzsi okno (zlomky maxima) roztahne kontrast
+    lut = preview_lut(0.25, 0.5)
+    assert lut[0] == 0 and lut[-1] == 255
+    assert lut[len(lut) // 4] == 0 and lut[len(lut) // 2] == 255
+
+
+def test_preview_cache_invalidated_by_data_changes():
+    images = make_study_images()
+    img = images[1]
+    first = preview_image(img, "ant_pw", (16, 16))
+    # Beze zmeny dat se nahled jen vezme z cache
+    assert preview_image(img, "ant_pw", (16, 16)) is first
+
+    # Korekce nad zasobnikem studie, zarovnani i primy zapis nahled zneplatni
+    apply_dt_correction(images, {"ant_pw": 1e-3})
+    second = preview_image(img, "ant_pw", (16, 16))
+    assert second is not first
+
+    align_projection(images, "ant", reference_index=2)
+    third = preview_image(img, "ant_pw", (16, 16))
+    assert third is not second
+
+    img.ant_pw = np.zeros((8, 8))
+    assert np.asarray(preview_image(img, "ant_pw", (16, 16))).max() == 0
+
+
+def test_study_stack_rates_and_scale():
+    # Celkove cetnosti a cetnosti v ROI odpovidaji vypoctu po jednotlivych snimcich
+    images = make_study_images()
+    roi = np.zeros((8, 8), dtype=bool)
+    roi[2:5, 3:7] = True
+    study = study_stack.from_images(images)
+
+    for t, key in enumerate(study.keys):
+        for w, name in enumerate(WINDOWS):
+            frame = getattr(images[key], name)
+            assert study.total_rates()[t, w] == pytest.approx(
+                frame.sum() / images[key].acq_dur
+            )
+            assert study.roi_rates(roi, roi)[t, w] == pytest.approx(
+                (frame * roi).sum() / images[key].acq_dur
+            )
+
+    # Chybejici ROI projekce vraci NaN
+    assert np.isnan(study.roi_rates(roi, None)[:, 1::2]).all()
+
+    factors = np.arange(18, dtype=float).reshape(3, 6)
+    expected = study.data * factors[:, :, None, None]
+    study.scale(factors)
+    np.testing.assert_allclose(study.data, expected)
+
+
+def test_apply_dt_correction_matches_per_window_formula():
+    # Davkova korekce dava stejne faktory a data jako korekce okna po okne
+    images = make_study_images()
+    before = {key: img.frames.copy() for key, img in images.items()}
+    md_data = {"ant_pw": 2e-4, "pos_pw": 1e-4, "ant_usw": 5e-4}
+
+    vysledky = apply_dt_correction(images, md_data)
+
+    for key, img in images.items():
+        for w, name in enumerate(WINDOWS):
+            if name not in md_data:
+                np.testing.assert_array_equal(img.frames[w], before[key][w])
+                continue
+            rate = before[key][w].sum() / img.acq_dur
+            factor = -np.real(lambertw(-rate * md_data[name])) / md_data[name] / rate
+            assert vysledky[key][name][0] == pytest.approx(rate)
+            assert vysledky[key][name][1] == pytest.approx(factor)
+            np.testing.assert_allclose(
+                img.frames[w], before[key][w] * factor, rtol=1e-6
+            )
+
+
+def test_dt_correction_factor_table_matches_lambertw():
+    # Tabulka W funkce odpovida lambertw v celem fyzikalnim rozsahu R_m * tau
+    rates = np.linspace(1e-6, 0.999 / np.e, 2000) / 1e-5
+    np.testing.assert_allclose(
+        dt_correction_factor_table(rates, 1e-5),
+        dt_correction_factor(rates, 1e-5),
+        rtol=1e-6,
+    )
+    assert dt_correction_factor_table(0.0, 1e-5) == 1.0
+    assert dt_correction_factor_table(1 / np.e, 1.0) == pytest.approx(np.e)
+
+
+def test_dt_correction_factor_zero_rate_and_out_of_range():
+    # Nulova cetnost ma faktor 1, nad maximem modelu (x > 1/e) obe cesty vyhodi chybu
+    assert dt_correction_factor(0.0, 1e-5) == 1.0
+    np.testing.assert_array_equal(dt_correction_factor(np.zeros(3), 1e-5), 1.0)
+    for funkce in (dt_correction_factor, dt_correction_factor_table):
+        with pytest.raises(Exception, match="1/e"):
+            funkce(np.array([1e3, 5e4]), 1.2e-5)
+
+    # Pixelova korekce: mapa ve WORK_DTYPE, celkova cetnost nad maximem je chyba
+    frame = np.full((16, 16), 10.0, dtype=WORK_DTYPE)
+    assert dt_correction_map(frame, 10.0, 1e-4, sigma=1.0).dtype == WORK_DTYPE
+    frame[6:10, 6:10] = 1e5
+    with pytest.raises(Exception, match="1/e"):
+        dt_correction_map(frame, 10.0, 1e-4, sigma=1.0)
+
+
+def test_pixelwise_dt_correction_map():
+    # Rovnomerny snimek ma stejnou korekci jako globalni, horke misto vetsi faktor
+    uniform = make_study_images()
+    for img in uniform.values():
+        img.frames = np.full((6, 8, 8), 500.0)
+    pixelwise = make_study_images()
+    for img in pixelwise.values():
+        img.frames = np.full((6, 8, 8), 500.0)
+    md_data = {"ant_pw": 1e-4}
+
+    globalni = apply_dt_correction(uniform, md_data)
+    mapa = apply_dt_correction(pixelwise, md_data, sigma=1.0)
+    for key in uniform:
+        np.testing.assert_allclose(pixelwise[key].ant_pw, uniform[key].ant_pw)
+        assert mapa[key]["ant_pw"][1] == pytest.approx(globalni[key]["ant_pw"][1])
+
+    # Realna studie: 128 x 128, stitna zlaza 20 x 20 px na studenem pozadi, ~5 kcps;
+    # lokalni hustota v uzlu je ~40x prumer, faktor ale zustava blizko globalniho
+    rng = np.random.default_rng(0)
+    frame = rng.poisson(0.5, (128, 128)).astype(WORK_DTYPE)
+    frame[54:74, 54:74] += rng.poisson(3700.0, (20, 20))
+    acq_dur, tau = 300.0, 1.2e-5
+    globalni = dt_correction_factor(frame.sum(dtype=np.float64) / acq_dur, tau)
+    assert 1.05 < globalni < 1.1
+
+    factors = dt_correction_map(frame, acq_dur, tau)
+    assert np.all(np.isfinite(factors))
+    assert factors[64, 64] == pytest.approx(globalni, rel=5e-2)
+    assert factors[64, 64] > factors[0, 0] >= 1.0
+    # Impulzy vazeny prumer faktoru je globalni faktor - celkova korekce se nemeni
+    assert np.sum(frame * factors, dtype=np.float64) / frame.sum(
+        dtype=np.float64
+    ) == pytest.approx(globalni, rel=1e-5)
+
+
+@pytest.mark.parametrize("sigma", [None, 1.0])
+def test_dt_correction_and_alignment_cancel_before_changing_data(sigma):
+    # Zruseni v kteremkoli kontrolnim bode nechava snimky beze zmeny
+    for krok in (
+        lambda images, progress: apply_dt_correction(
+            images, {"ant_pw": 1e-4, "pos_pw": 1e-4}, sigma, progress
+        ),
+        lambda images, progress: align_projection(images, "ant", progress=progress),
+    ):
+        prubeh = []
+        krok(make_study_images(), lambda *a: prubeh.append(a))
+        assert prubeh
+        assert [p for p, _ in prubeh] == sorted(p for p, _ in prubeh)
+
+        for zastavit in range(len(prubeh)):
+            images = make_study_images()
+            before = {key: img.frames.copy() for key, img in images.items()}
+            volani = []
+
+            def progress(fraction, text):
+                volani.append(text)
+                if len(volani) > zastavit:
+                    raise TaskCancelled("cancelled")
+
+            with pytest.raises(TaskCancelled):
+                krok(images, progress)
+            for key, img in images.items():
+                np.testing.assert_array_equal(img.frames, before[key])
+
+
+def test_study_stack_roll_projection_matches_np_roll():
+    # Vektorizovany posun projekce odpovida np.roll pro kazdy casovy bod zvlast
+    images = make_study_images()
+    study = study_stack.from_images(images)
+    before = study.data.copy()
+    shift_x, shift_y = [1, -2, 0], [3, 0, -1]
+
+    study.roll_projection("pos", shift_x, shift_y)
+
+    for t in range(3):
+        for w in range(6):
+            if w % 2 == 1:
+                expected = np.roll(before[t, w], (shift_y[t], shift_x[t]), axis=(0, 1))
+            else:
+                expected = before[t, w]
+            np.testing.assert_array_equal(study.data[t, w], expected)
+
+
+def test_align_projection_and_roi_count_rates():
+    # Zarovnani cele studie vrati posuny k referenci a posune i scatter okna
+    images = {}
+    base = np.zeros((20, 20))
+    base[8:12, 8:12] = 10
+    for key, shift in enumerate([(2, -1), (0, 0), (0, 0)]):
+        img = dicom_image()
+        img.frames = np.stack([np.roll(base, shift, axis=(0, 1))] * 6)
+        img.acq_dur = 1.0
+        images[key] = img
+
+    shifts = align_projection(images, "ant", reference_index=2)
+    assert shifts[0] == (1, -2)
+    for name in ("ant_pw", "ant_lsw", "ant_usw"):
+        np.testing.assert_array_equal(getattr(images[0], name), base)
+
+    roi = base > 0
+    for img in images.values():
+        img.ant_roi = roi
+        img.pos_roi = roi
+    rates = roi_count_rates(images, ("ant_pw", "pos_pw"))
+    np.testing.assert_allclose(rates["ant_pw"], [160, 160, 160])
+    # Posteriorni projekce nebyla zarovnana, prvni snimek je mimo ROI jen castecne
+    assert rates["pos_pw"][0] < 160
+
+
+def test_study_stack_roi_counts_sparse_engine():
+    # Soucty pres ploche indexy ROI odpovidaji souctu masek pres cele snimky
+    images = make_study_images(3, shape=(8, 8))
+    study = study_stack.from_images(images)
+    ant = np.zeros((8, 8), dtype=bool)
+    ant[2:5, 3:7] = True
+    pos = np.zeros((8, 8), dtype=bool)
+    pos[0, :] = True
+
+    counts = study.roi_counts(ant, roi_indices(pos))
+    for t in range(3):
+        for k in range(6):
+            mask = ant if k % 2 == 0 else pos
+            assert counts[t, k] == pytest.approx((study.data[t, k] * mask).sum())
+
+    # Projekce bez ROI je NaN, prazdna ROI dava nulu
+    counts = study.roi_counts(np.zeros((8, 8), dtype=bool), None)
+    np.testing.assert_array_equal(counts[:, 0::2], 0)
+    assert np.isnan(counts[:, 1::2]).all()
+    np.testing.assert_array_equal(roi_indices(ant), np.flatnonzero(ant))
+
+
+def test_study_stack_region_counts_match_masks():
+    # Soucty vsech oblasti mapy ROI jednim pruchodem odpovidaji souctum pres masky
+    images = make_study_images(3, shape=(8, 8))
+    study = study_stack.from_images(images)
+    labels = np.zeros((8, 8), dtype=np.int16)
+    labels[1:4, 1:4] = 2
+    labels[1:4, 5:8] = 3
+    labels[6, 6] = 5
+    pos = np.zeros((8, 8), dtype=bool)
+    pos[0, :] = True
+
+    counts = study.region_counts(labels, pos)
+    assert counts.shape == (3, 6, 6)
+    for t in range(3):
+        for k in range(0, 6, 2):
+            for label in range(1, 6):
+                expected = study.data[t, k][labels == label].sum()
+                assert counts[t, k, label] == pytest.approx(expected)
+        # Binarni maska je oblast 1
+        for k in range(1, 6, 2):
+            assert counts[t, k, 1] == pytest.approx(study.data[t, k][pos].sum())
+
+
+def test_set_roi_region_and_region_labels():
+    # Nove nakreslena oblast prepise starou oblast se stejnym cislem i prekryv
+    right = np.zeros((6, 6), dtype=bool)
+    right[:, :3] = True
+    left = np.zeros((6, 6), dtype=bool)
+    left[:, 2:] = True
+
+    labels = set_roi_region(None, right, region_label(None, "Right lobe"))
+    labels = set_roi_region(labels, left, region_label(labels, "Left lobe"))
+    assert (labels[:, 2:] == 3).all() and (labels[:, :2] == 2).all()
+
+    node = np.zeros((6, 6), dtype=bool)
+    node[0, 0] = True
+    labels = set_roi_region(labels, node, region_label(labels, "Node"))
+    assert region_label(labels, "Node") == 5
+    assert labels[0, 0] == 4
+
+    assert region_labels((labels, None), "Whole thyroid gland") == [2, 3, 4]
+    # Uzel v rohu praveho laloku k nemu patri
+    assert region_labels((labels, None), "Right lobe") == [2, 4]
+    assert region_labels((labels, None), "Left lobe") == [3]
+    assert region_labels((labels, None), "Node") == [4]
+    # Jedina binarni ROI (bez oblasti) se vyhodnocuje cela
+    assert region_labels((right, right), "Left lobe") == [1]
+
+
+def test_roi_count_rates_for_region():
+    # Cetnosti vybrane oblasti = cetnosti v jeji binarni masce
+    images = make_study_images(3, shape=(8, 8))
+    labels = np.zeros((8, 8), dtype=np.int16)
+    labels[1:4, 1:4] = 2
+    labels[1:4, 5:8] = 3
+    for image in images.values():
+        image.ant_roi = labels
+        image.pos_roi = labels
+
+    whole = roi_count_rates(images, ("ant_pw", "pos_pw"), oblast="Whole thyroid gland")
+    lobe = roi_count_rates(images, ("ant_pw", "pos_pw"), oblast="Left lobe")
+    for image in images.values():
+        image.ant_roi = labels == 3
+        image.pos_roi = labels == 3
+    expected = roi_count_rates(images, ("ant_pw", "pos_pw"))
+    for window in ("ant_pw", "pos_pw"):
+        np.testing.assert_allclose(lobe[window], expected[window])
+        assert (whole[window] > lobe[window]).all()
+
+
+
+def test_nested_node_counts_in_its_lobe():
+    # Uzel uvnitr laloku prepise pixely laloku v mape, lalok ho ale dal obsahuje
+    images = make_study_images(3, shape=(12, 12))
+    right = np.zeros((12, 12), dtype=bool)
+    right[2:10, 1:6] = True
+    left = np.zeros((12, 12), dtype=bool)
+    left[2:10, 7:11] = True
+    node = np.zeros((12, 12), dtype=bool)
+    node[4:7, 2:5] = True
+
+    labels = set_roi_region(None, right, region_label(None, "Right lobe"))
+    labels = set_roi_region(labels, left, region_label(labels, "Left lobe"))
+    labels = set_roi_region(labels, node, region_label(labels, "Node"))
+    assert nested_nodes(labels, 2) == [4] and nested_nodes(labels, 3) == []
+    assert region_labels((labels, labels), "Right lobe") == [2, 4]
+    assert region_labels((labels, labels), "Left lobe") == [3]
+
+    # Prekresleni laloku uzel uvnitr nesmaze
+    redrawn = set_roi_region(labels, right, region_label(labels, "Right lobe"))
+    np.testing.assert_array_equal(redrawn, labels)
+
+    for image in images.values():
+        image.ant_roi = labels
+        image.pos_roi = labels
+    windows = ("ant_pw", "pos_pw")
+    lobe = roi_count_rates(images, windows, oblast="Right lobe")
+    uzel = roi_count_rates(images, windows, oblast="Node")
+    for image in images.values():
+        image.ant_roi = right
+        image.pos_roi = right
+    expected = roi_count_rates(images, windows)
+    for image in images.values():
+        image.ant_roi = node
+        image.pos_roi = node
+    expected_uzel = roi_count_rates(images, windows)
+    for window in windows:
+        np.testing.assert_allclose(lobe[window], expected[window])
+        np.testing.assert_allclose(uzel[window], expected_uzel[window])
+
+
 ##### ALIGN A POSUNUTI ----------------------------
 
 
@@ -204,6 +705,116 @@ def test_align_images_invalid_input():
     assert "same shape for alignment" in str(excinfo.value)
 
 
+def gaussian_blob(shape, rng):
+    # Hladky nahodny obraz s jednoznacnym maximem korelace
+    return gaussian_filter(rng.random(shape), 2) * 100
+
+
+@pytest.mark.parametrize("shape", [(16, 16), (15, 21)])
+def test_registration_shifts_matches_align_images(shape):
+    # Davkova registrace dava stejne posuny jako align_images pro kazdy par zvlast
+    rng = np.random.default_rng(1)
+    reference = gaussian_blob(shape, rng)
+    moving = np.stack(
+        [
+            np.roll(reference, (dy, dx), axis=(0, 1)) + rng.normal(0, 0.05, shape)
+            for dy, dx in [(0, 0), (3, -2), (-4, 5), (1, 1)]
+        ]
+    )
+
+    shift_x, shift_y = registration_shifts(reference[None], moving)
+    for t in range(len(moving)):
+        _, sx, sy = align_images(reference, moving[t])
+        assert (shift_x[t], shift_y[t]) == (sx, sy)
+
+
+def test_align_study_both_projections_at_once():
+    # Zarovnani obou projekci jednou registraci odpovida zarovnani po projekcich
+    images = make_study_images(4, shape=(16, 16))
+    copies = make_study_images(4, shape=(16, 16))
+
+    shifts = align_study(images, ("ant", "pos"), reference_index=2)
+    assert shifts["ant"] == align_projection(copies, "ant", reference_index=2)
+    assert shifts["pos"] == align_projection(copies, "pos", reference_index=2)
+    for key in images:
+        np.testing.assert_array_equal(images[key].frames, copies[key].frames)
+
+
+def test_phase_correlation_subpixel_accuracy():
+    # Fazova korelace najde i necelociselne posuny (chyba pod 0.1 px)
+    yy, xx = np.mgrid[:48, :48]
+    reference = 100 * np.exp(-((yy - 22) ** 2 + (xx - 25) ** 2) / (2 * 3.0**2))
+    true = [(0.0, 0.0), (1.3, -2.6), (-3.45, 0.8)]
+    moving = np.stack(
+        [
+            shift_image(reference, -sx, -sy, order=3) if (sx or sy) else reference
+            for sx, sy in true
+        ]
+    )
+
+    shift_x, shift_y = phase_correlation_shifts(reference, moving)
+    np.testing.assert_allclose(shift_x, [sx for sx, _ in true], atol=0.1)
+    np.testing.assert_allclose(shift_y, [sy for _, sy in true], atol=0.1)
+
+
+def test_phase_correlation_refinement_is_fast_for_clinical_matrix():
+    # Zpresneni maticovou DFT nesmi byt radove pomalejsi nez celociselna FFT cesta
+    rng = np.random.default_rng(0)
+    reference = rng.poisson(20, (256, 256)).astype(float)
+    moving = np.stack([np.roll(reference, (k, -k), axis=(0, 1)) for k in range(10)])
+
+    start = time.perf_counter()
+    shift_x, shift_y = phase_correlation_shifts(reference, moving)
+    assert time.perf_counter() - start < 2.0
+    np.testing.assert_allclose(shift_x, np.arange(10), atol=0.1)
+    np.testing.assert_allclose(shift_y, -np.arange(10), atol=0.1)
+
+
+def test_shift_image_zero_fills_instead_of_wrapping():
+    # Posun nepretaci hodnoty pres okraj, uvolnene pixely jsou nulove
+    img = np.arange(16, dtype=float).reshape(4, 4)
+    shifted = shift_image(img, 1, -2)
+    expected = np.zeros((4, 4))
+    expected[:2, 1:] = img[2:, :3]
+    np.testing.assert_array_equal(shifted, expected)
+    np.testing.assert_array_equal(shift_image(img, 5, 0), 0)
+    half = shift_image(img, 0.5, 0)
+    np.testing.assert_allclose(half[:, 1:], (img[:, 1:] + img[:, :-1]) / 2)
+
+
+def test_phase_alignment_offsets_resolved_in_roi_sums():
+    # Sub-pixelovy posun se jen ulozi a uplatni se az pri souctu v ROI;
+    # horky pixel na okraji se pri posunu nepretoci do ROI
+    base = np.zeros((20, 20))
+    base[8:12, 8:12] = 10
+    images = {}
+    for key, (dx, dy) in enumerate([(2, -1), (0, 0), (0, 0)]):
+        frame = shift_image(base, dx, dy)
+        if key == 0:
+            frame[0, 0] = 50.0  # horky pixel na okraji
+        img = dicom_image()
+        img.frames = np.stack([frame] * 6)
+        img.acq_dur = 1.0
+        images[key] = img
+    raw = images[0].frames.copy()
+
+    shifts = align_study(images, ("ant",), reference_index=2, method="phase")
+    np.testing.assert_allclose(shifts["ant"][0], (-2, 1), atol=0.05)
+    # Okna se neposunula, posun je ulozen na snimku
+    np.testing.assert_array_equal(images[0].frames, raw)
+    assert images[0].offsets["ant"] == shifts["ant"][0]
+    aligned = images[0].aligned_window("ant_pw")
+    np.testing.assert_allclose(aligned[8:12, 8:12], 10, atol=0.5)
+
+    roi = np.zeros((20, 20), dtype=bool)
+    roi[8:12, 8:12] = True
+    roi[1, 18] = True  # sem by np.roll pretocil horky pixel
+    for img in images.values():
+        img.ant_roi = roi
+    rates = roi_count_rates(images, ("ant_pw",))["ant_pw"]
+    np.testing.assert_allclose(rates, 160, rtol=0.05)
+
+
 def test_posunuti_image_basic_shift():
     """
     Testujeme jednoduche posunuti obrazku pomoci funkce posunuti_image.
@@ -318,36 +929,33 @@ def test_create_mask_empty_and_valid_polygon(setup_roi_drawer):
     assert roi.mask.sum() > 0
 
 
-def test_remove_old_artists(setup_roi_drawer):
-    # Test metody remove_old_artists, ktera odstranuje graficke objekty (artists)
-    roi = setup_roi_drawer
-
-    # Definice dummy tridy DummyArtist s metodou remove, ktera nastavi flag removed na True
-    class DummyArtist:
-        def remove(self):
-            self.removed = True
-
-    # Dummy trida DummyContour, ktera obsahuje seznam collections s DummyArtist objekty
-    class DummyContour:
-        def __init__(self):
-            self.collections = [DummyArtist(), DummyArtist()]
-
-    # Nastavi do ROI atribut contour na instanci DummyContour
-    roi.contour = DummyContour()
-    # Nastavi polygon_patch na DummyArtist instanci
-    roi.polygon_patch = DummyArtist()
-    # Nastavi point_patches na seznam dvou DummyArtist instanci
-    roi.point_patches = [DummyArtist(), DummyArtist()]
-
-    # Zavola testovanou metodu, ktera by mela odstranit vsechny tyto artists
-    roi.remove_old_artists()
-
-    # Ocekavame, ze po odstraneni bude atribut contour None
-    assert roi.contour is None
-    # Ocekavame, ze polygon_patch bude None
-    assert roi.polygon_patch is None
-    # Ocekavame, ze seznam point_patches bude prazdny
-    assert roi.point_patches == []
+def test_polygon_mask_matches_contains_points():
+    # Scanline rasterizace dava stejne pixely jako Path.contains_points
+    # (i pro konkavni polygony a polygony presahujici okraj obrazu)
+    rng = np.random.default_rng(2)
+    y, x = np.mgrid[:40, :50]
+    centres = np.vstack((x.ravel(), y.ravel())).T
+    for shift_x in (0.0, -20.0, 25.0):
+        for _ in range(20):
+            n = rng.integers(3, 10)
+            angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+            radii = rng.uniform(3, 18, n)
+            points = [
+                (25 + shift_x + r * np.cos(a), 20 + r * np.sin(a))
+                for r, a in zip(radii, angles)
+            ]
+            expected = Path(points).contains_points(centres).reshape(40, 50)
+            np.testing.assert_array_equal(polygon_mask((40, 50), points), expected)
+
+
+def test_polygon_mask_is_cached_per_vertices():
+    # Stejne vrcholy vrati stejnou (jen pro cteni) masku bez noveho vypoctu
+    points = [(2.5, 2.5), (7.5, 2.5), (4.5, 7.5)]
+    first = polygon_mask((10, 10), points)
+    assert polygon_mask((10, 10), list(points)) is first
+    assert not first.flags.writeable
+    assert polygon_mask((10, 10), points[:2]).sum() == 0
+    assert polygon_mask((10, 10), [(20, 20), (30, 20), (25, 30)]).sum() == 0
 
 
 def test_on_select_calls_mask_and_display(setup_roi_drawer, monkeypatch):
@@ -405,6 +1013,84 @@ def test_apply_roi_to_all_images_basic(monkeypatch):
     root.destroy()
 
 
+class FakeScheduler:
+    # Nahrada Tk after/after_cancel - naplanovane callbacky spousti test
+    def __init__(self):
+        self.pending = {}
+        self.counter = 0
+
+    def after(self, ms, func):
+        self.counter += 1
+        self.pending[self.counter] = func
+        return self.counter
+
+    def after_cancel(self, timer_id):
+        del self.pending[timer_id]
+
+    def run(self):
+        for timer_id in list(self.pending):
+            self.pending.pop(timer_id)()
+
+
+def test_roi_overlay_debounces_and_reuses_previews(monkeypatch):
+    photos = []
+
+    def fake_photo(image):
+        photo = MagicMock()
+        photo.width.return_value, photo.height.return_value = image.size
+        photos.append(photo)
+        return photo
+
+    monkeypatch.setattr("app.functions.ImageTk.PhotoImage", fake_photo)
+    images = make_study_images()
+    labels = {key: MagicMock() for key in images}
+    scheduler = FakeScheduler()
+    overlay = ROI_overlay_renderer(
+        images, "ant_pw", labels, (16, 16), (8, 8), scheduler
+    )
+
+    # Rychle upravy vrcholu se slouci do jednoho prekresleni
+    for dx in range(5):
+        overlay.request([(1 + dx, 1), (6, 1), (3, 6)])
+    assert len(scheduler.pending) == 1
+    scheduler.run()
+    assert len(photos) == len(images)
+    assert all(label.config.call_count == 1 for label in labels.values())
+    bases = {key: overlay.base(key) for key in images}
+
+    # Dalsi uprava: podklady z cache, PhotoImage se jen prepise
+    overlay.request([(2, 2), (6, 2), (3, 6)])
+    scheduler.run()
+    assert len(photos) == len(images)
+    assert all(photo.paste.call_count == 1 for photo in photos)
+    assert all(overlay.base(key) is bases[key] for key in images)
+
+    # Cervena cara v rozliseni nahledu (souradnice x2)
+    layer = np.asarray(overlay.layer([(2, 2), (6, 2), (3, 6)]))
+    assert tuple(layer[4, 8]) == (255, 0, 0, 255)
+
+
+def test_roi_drawer_shares_preview_and_close_releases_figure(monkeypatch):
+    monkeypatch.setattr("app.functions.ImageTk.PhotoImage", MagicMock())
+    images = make_study_images()
+    labels = {key: MagicMock() for key in images}
+    scheduler = FakeScheduler()
+    roi = ROI_drawer_manual(images, "ant_pw", labels, (16, 16), scheduler=scheduler)
+
+    # Podklad editoru je 8-bitovy nahled z cache snimku
+    np.testing.assert_array_equal(
+        roi.ax.images[0].get_array(), np.asarray(images[2].preview("ant_pw"))
+    )
+
+    # Zavreni dokresli nevyrizene nahledy a uvolni figure
+    roi.roi_points = [(1, 1), (6, 1), (3, 6)]
+    roi.apply_roi_to_all_images("ant_pw")
+    assert scheduler.pending
+    roi.close()
+    assert all(label.config.call_count == 1 for label in labels.values())
+    assert roi.fig.number not in plt.get_fignums()
+
+
 def test_show_pixel_value_inside_and_outside(setup_roi_drawer):
     # Test metody show_pixel_value, ktera zobrazuje hodnotu pixelu pod kurzorem
     roi = setup_roi_drawer
@@ -445,6 +1131,25 @@ def test_show_pixel_value_inside_and_outside(setup_roi_drawer):
     assert roi.text.get_text() == ""
 
 
+def test_display_results_reuses_artists_over_static_image(setup_roi_drawer):
+    # Obrazek se vykresli jednou, pri upravach ROI se jen meni data tychz artistu
+    roi = setup_roi_drawer
+    roi.roi_points = [(1, 1), (1, 6), (6, 6)]
+    roi.display_results()
+    contour, patch, body = roi.contour, roi.polygon_patch, roi.point_patches[0]
+
+    roi.roi_points = [(1, 1), (1, 6), (6, 6), (6, 1)]
+    roi.display_results()
+    assert roi.contour is contour and roi.polygon_patch is patch
+    assert roi.point_patches == [body]
+    assert len(roi.ax.images) == 1 and len(roi.ax.patches) == 1
+    # Hranice ROI je uzavreny polygon, ne contour masky
+    np.testing.assert_array_equal(
+        np.column_stack(contour.get_data()), roi.roi_points + roi.roi_points[:1]
+    )
+    assert all(a.get_animated() for a in (contour, patch, body, roi.text))
+
+
 #### PREMENOVY ZAKON --------------------------
 
 
@@ -544,6 +1249,77 @@ def test_tew_correction_output_types_and_shapes():
     assert corrected_uncertainty.shape == (3, 3)
 
 
+def test_tew_correction_keeps_work_dtype():
+    # Snimky v pracovnim typu zustanou ve float32, vysledek odpovida puvodnimu vzorci
+    rng = np.random.default_rng(1)
+    em, sc1, sc2 = rng.integers(0, 200, size=(3, 16, 16)).astype(WORK_DTYPE)
+
+    corrected_img, corrected_uncertainty = tew_correction(em, sc1, sc2)
+
+    assert corrected_img.dtype == corrected_uncertainty.dtype == WORK_DTYPE
+    scatter = (sc1 / 0.06 + sc2 / 0.06) * (0.2 / 2)
+    np.testing.assert_allclose(corrected_img, np.clip(em - scatter, 0, None), atol=1e-3)
+    np.testing.assert_allclose(
+        corrected_uncertainty,
+        np.sqrt(em + (0.2 / (2 * 0.06)) ** 2 * (sc1 + sc2)),
+        rtol=1e-6,
+    )
+
+
+def test_energy_window_widths_from_dicom(tmp_path):
+    # Sirky oken se ctou z Energy Window Information Sequence podle Energy Window Vector
+    frames = np.ones((6, 4, 4))
+    path = write_planar_dicom(
+        str(tmp_path / "a.dcm"),
+        frames,
+        "20250101",
+        "101010",
+        energy_windows=[(327.6, 400.4), (301.0, 323.0), (405.0, 427.0)],
+    )
+    img = dicom_image()
+    img.load_dicom(path, lazy=True)
+    assert img.energy_windows["ant_pw"] == pytest.approx(72.8)
+    assert img.energy_windows["pos_lsw"] == pytest.approx(22.0)
+    assert tew_widths(img.energy_windows, "pos") == pytest.approx((72.8, 22.0, 22.0))
+
+    # Bez sekvence se pouziji vychozi sirky
+    img.load_dicom(
+        write_planar_dicom(str(tmp_path / "b.dcm"), frames, "20250101", "101010")
+    )
+    assert img.energy_windows is None
+    assert tew_widths(img.energy_windows) == (0.2, 0.06, 0.06)
+
+
+def test_tew_correct_study_chunked_matches_full_frames():
+    # Blokove zpracovani po radcich dava stejny vysledek jako TEW celych snimku
+    images = make_study_images(3, shape=(10, 7))
+    sirky = {"pw": 70.0, "usw": 20.0, "lsw": 25.0}
+    for img in images.values():
+        img.energy_windows = {
+            f"{p}_{o}": w for p in ("ant", "pos") for o, w in sirky.items()
+        }
+
+    vysledky = tew_correct_study(images, chunk_rows=3)
+
+    for t, img in enumerate(images.values()):
+        for projection in ("ant", "pos"):
+            pw, usw, lsw = (
+                getattr(img, f"{projection}_{o}").astype(np.float64)
+                for o in ("pw", "usw", "lsw")
+            )
+            scatter = (usw / 20.0 + lsw / 25.0) * 70.0 / 2
+            corrected, uncertainty = vysledky[projection]
+            assert corrected.dtype == WORK_DTYPE
+            np.testing.assert_allclose(
+                corrected[t], np.clip(pw - scatter, 0, None), atol=1e-3
+            )
+            np.testing.assert_allclose(
+                uncertainty[t],
+                np.sqrt(pw + (35.0 / 20.0) ** 2 * usw + (35.0 / 25.0) ** 2 * lsw),
+                rtol=1e-5,
+            )
+
+
 def test_tew_correction_raises_exception_on_invalid_input():
     # Test, ze funkce vyhodi vyjimku pokud jsou vstupy nevalidni (napr. retezce misto poli)
     with pytest.raises(Exception):
@@ -958,3 +1734,46 @@ def test_covar_shape():
     y = (0.05 / (0.1 - 0.005)) * (np.exp(-0.005 * x) - np.exp(-0.1 * x))
     _, _, covar = riu_fit((x, y))
     assert covar.shape == (3, 3)
+
+
+def test_riu_jacobian_matches_finite_differences():
+    # Analyticka Jacobiho matice odpovida centralnim diferencim
+    x = np.array([1.0, 5.0, 24.0, 48.0, 144.0])
+    p = np.array([0.05, 0.1, 0.005])
+    numeric = np.empty((5, 3))
+    for i in range(3):
+        h = np.zeros(3)
+        h[i] = 1e-7 * p[i]
+        numeric[:, i] = (riu_uptace_fce(x, *(p + h)) - riu_uptace_fce(x, *(p - h))) / (
+            2 * h[i]
+        )
+    np.testing.assert_allclose(riu_jacobian(x, *p), numeric, rtol=1e-5, atol=1e-12)
+
+
+@pytest.mark.parametrize("relative_error", [None, 0.02])
+def test_riu_fit_matches_lmfit(relative_error):
+    # Jeden fit s analytickou Jacobiho matici dava stejne vysledky jako lmfit
+    from lmfit import Model
+
+    rng = np.random.default_rng(3)
+    x = np.array([1.0, 5.0, 24.0, 48.0, 144.0])
+    y = riu_uptace_fce(x, 0.04, 0.15, 0.007) * (1 + rng.normal(0, 0.03, 5))
+    y_err = None if relative_error is None else relative_error * y
+    weights = None if y_err is None else (1 / y_err) ** 2
+
+    model = Model(riu_uptace_fce)
+    params = model.make_params(k_t=0.05, k_B=0.1, k_T=0.005)
+    for _ in range(5):
+        params = model.fit(y, params, x=x, weights=weights).params
+    result = model.fit(y, params, x=x, weights=weights)
+
+    fitted, errors, covar = riu_fit((x, y), y_err=y_err)
+    names = ("k_t", "k_B", "k_T")
+    np.testing.assert_allclose(
+        fitted, [result.params[n].value for n in names], rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        errors, [result.params[n].stderr for n in names], rtol=1e-3
+    )
+    np.testing.assert_allclose(covar, result.covar, rtol=1e-3, atol=1e-15)
+
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from app.pipeline import DosimetryPipeline
+from app.functions import compute_uptake, riu_uptace_fce
+
+
+def thyroid_mask(shape=(32, 32)):
+    # Binarni maska ROI pokryvajici syntetickou stitnou zlazu
+    mask = np.zeros(shape, dtype=bool)
+    mask[11:21, 11:21] = True
+    return mask
+
+
+def make_pipeline(paths, **kwargs):
+    params = dict(
+        dicom_paths=paths,
+        ant_roi=thyroid_mask(),
+        pos_roi=thyroid_mask(),
+        podana_aktivita=100.0,
+        datum_podani="01.06.2025 08:00",
+        objem_organu=20.0,
+    )
+    params.update(kwargs)
+    return DosimetryPipeline(**params)
+
+
+def test_pipeline_run_returns_all_results(study_paths):
+    # Cely vypocet bez GUI vrati casy, uptake, parametry fitu i davku
+    results = make_pipeline(study_paths).run()
+
+    np.testing.assert_allclose(results["times"], [1, 5, 24, 48, 144])
+    assert results["uptake"].shape == (5,)
+    assert results["riu_params"].shape == (3,)
+    assert results["riu_params_covar"].shape == (3, 3)
+    assert results["absorbovana_davka"] > 0
+    assert len(results["planned_activities"]) == 6
+    # Efektivni polocas odpovida vylucovaci konstante synteticke krivky (0.005 1/h)
+    assert results["eff_polocas"] == pytest.approx(np.log(2) / 0.005 / 24, rel=0.05)
+
+
+def test_pipeline_uptake_matches_manual_computation(study_paths):
+    # Uptake z pipeline je shodny s rucnim vypoctem ze stejnych cetnosti
+    pipeline = make_pipeline(study_paths, typ_korekce="AC", dt_korekce=False)
+    results = pipeline.run()
+
+    expected = compute_uptake(
+        results["count_rates"], "AC", pipeline.kal_data, pipeline.podana_aktivita
+    )
+    np.testing.assert_allclose(results["uptake"], expected)
+    assert set(results["count_rates"]) == {"ant_pw", "pos_pw"}
+
+
+def test_pipeline_polygon_roi_equals_mask(study_paths):
+    # ROI zadana body polygonu dava stejny vysledek jako ekvivalentni maska
+    polygon = [(10.5, 10.5), (20.5, 10.5), (20.5, 20.5), (10.5, 20.5)]
+    by_mask = make_pipeline(study_paths).run()
+    by_polygon = make_pipeline(study_paths, ant_roi=polygon, pos_roi=polygon).run()
+
+    np.testing.assert_allclose(by_polygon["uptake"], by_mask["uptake"])
+
+
+def test_pipeline_spect_ratio(study_paths):
+    # Pri zadanem SPECT uptake se fit preskaluje tak, aby ve 24 h odpovidal SPECT hodnote
+    results = make_pipeline(study_paths, spect_uptake=30.0).run()
+    fitted_24h = riu_uptace_fce(results["times"][2], *results["riu_params"])
+    assert results["pomer"] * fitted_24h == pytest.approx(0.30)
+
+
+def test_pipeline_missing_file_raises(tmp_path):
+    # Chybejici soubor vede na vyjimku s informaci o pipeline
+    pipeline = make_pipeline([str(tmp_path / "missing.dcm")])
+    with pytest.raises(Exception) as excinfo:
+        pipeline.run()
+    assert "Error in dosimetry pipeline" in str(excinfo.value)
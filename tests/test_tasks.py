@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from app.tasks import TaskCancelled, TaskRunner
+
+
+class FakeRoot:
+    # Nahrada Tk okna - after() si callbacky jen uklada, test je spousti rucne
+    def __init__(self):
+        self.callbacks = []
+        self.thread = threading.current_thread()
+
+    def after(self, ms, func, *args):
+        self.callbacks.append((func, args))
+
+    def pump(self, runner, timeout=5.0):
+        # Spousti naplanovane callbacky, dokud nejsou vsechny ulohy hotove
+        konec = time.monotonic() + timeout
+        while self.callbacks and time.monotonic() < konec:
+            func, args = self.callbacks.pop(0)
+            func(*args)
+            time.sleep(0.001)
+        assert not runner.busy
+
+
+def test_task_runs_in_worker_and_reports_in_main_thread():
+    root = FakeRoot()
+    prubeh, vysledky = [], []
+    runner = TaskRunner(
+        root, on_progress=lambda *a: prubeh.append((threading.current_thread(), a))
+    )
+
+    def work(task):
+        task.progress(0.5, "half")
+        return threading.current_thread()
+
+    def on_done(vlakno):
+        vysledky.append((vlakno, threading.current_thread()))
+
+    runner.submit("Test", work, on_done)
+    root.pump(runner)
+
+    (vlakno, hlavni), = vysledky
+    assert vlakno is not root.thread
+    assert hlavni is root.thread
+    assert all(t is root.thread for t, _ in prubeh)
+    assert ("Test", 0.5, "half") in [a for _, a in prubeh]
+    # Po dokonceni vsech uloh se prubeh vynuluje
+    assert prubeh[-1][1] == (None, None, "")
+    runner.shutdown()
+
+
+def test_cancel_stops_running_and_pending_tasks():
+    root = FakeRoot()
+    runner = TaskRunner(root)
+    spusteno = threading.Event()
+    hotovo = []
+
+    def long_work(task):
+        spusteno.set()
+        while True:
+            task.progress(None, "waiting")
+            time.sleep(0.001)
+
+    runner.submit("Long", long_work, hotovo.append)
+    runner.submit("Pending", lambda task: "pending", hotovo.append)
+    assert spusteno.wait(5)
+    runner.cancel()
+    root.pump(runner)
+
+    assert hotovo == []
+    runner.shutdown()
+
+
+def test_error_is_passed_to_on_error():
+    root = FakeRoot()
+    runner = TaskRunner(root)
+    chyby = []
+
+    def work(task):
+        raise ValueError("bad data")
+
+    runner.submit("Broken", work, on_error=chyby.append)
+    root.pump(runner)
+    assert [str(e) for e in chyby] == ["bad data"]
+    runner.shutdown()
+
+
+def test_without_root_tasks_run_synchronously():
+    runner = TaskRunner()
+    vysledky = []
+    runner.submit("Sync", lambda task: 42, vysledky.append)
+    assert vysledky == [42]
+
+    with pytest.raises(ValueError):
+        runner.submit("Sync", lambda task: int("x"))
+
+    # Zrusena uloha nevola on_done a nevyhodi vyjimku
+    def cancelled(task):
+        raise TaskCancelled("cancelled")
+
+    runner.submit("Sync", cancelled, vysledky.append)
+    assert vysledky == [42]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.integrate import quad
+
+from app.functions import compute_dose, riu_uptace_fce
+from app.tiac import (
+    LAMBDA_I131,
+    hybrid_integral,
+    riu_integral,
+    tail_rate,
+    trapezoid_integral,
+)
+
+PARAMS = (0.05, 0.3, 0.01)
+TIMES = np.array([1.0, 5.0, 24.0, 48.0, 144.0])
+
+
+def test_riu_integral_matches_quadrature():
+    # Uzavreny tvar se shoduje s numerickou kvadraturou na intervalu i v ocasu
+    for t0, t1 in ((1, 144), (0, 24), (144, np.inf)):
+        expected = quad(riu_uptace_fce, t0, t1, args=PARAMS)[0]
+        assert riu_integral(*PARAMS, t0, t1) == pytest.approx(expected, rel=1e-10)
+    assert riu_integral(*PARAMS) == pytest.approx(0.05 / (0.3 * 0.01), rel=1e-12)
+
+
+def test_riu_integral_is_vectorised_over_parameters():
+    # Pole parametru (vzorek,) dava stejne vysledky jako vypocet po jednom
+    rng = np.random.default_rng(0)
+    k_t = rng.uniform(0.01, 0.1, 50)
+    k_B = rng.uniform(0.1, 1.0, 50)
+    k_T = rng.uniform(0.002, 0.05, 50)
+    batch = riu_integral(k_t, k_B, k_T, 1.0, 144.0)
+    single = [riu_integral(*p, 1.0, 144.0) for p in zip(k_t, k_B, k_T)]
+    np.testing.assert_allclose(batch, single, rtol=1e-12)
+
+
+def test_compute_dose_statik_uses_closed_form():
+    davka = compute_dose(PARAMS, TIMES, 1, 20.0, 550.0)
+    expected = quad(riu_uptace_fce, 1, 144, args=PARAMS)[0] / 24
+    assert davka["integral_statik"] == round(expected, 3)
+
+
+def test_hybrid_integral_of_mono_exponential_is_close_to_exact():
+    # Cista monoexponenciala od prvniho mereni: ocas z poslednich dvou bodu je
+    # presny, lichobezniky nadhodnocuji jen malo pri hustem vzorkovani
+    times = np.linspace(1, 144, 200)
+    values = 0.4 * np.exp(-0.01 * times)
+    assert tail_rate(times, values) == pytest.approx(0.01)
+    exact = 0.4 * np.exp(-0.01) / 0.01
+    hybrid = hybrid_integral(times, values, od_nuly=False)
+    assert hybrid == pytest.approx(exact, rel=1e-3)
+
+
+def test_hybrid_schemes_broadcast_over_patients():
+    # Hodnoty (pacient x casovy bod) se spolecnymi casy
+    uptake = riu_uptace_fce(TIMES, *PARAMS)
+    values = np.stack([uptake, 2 * uptake])
+    trapezoid = trapezoid_integral(TIMES, values)
+    np.testing.assert_allclose(trapezoid[1], 2 * trapezoid[0])
+    # Trojuhelnik od nuly + lichobezniky mezi merenimi
+    t, y = np.r_[0, TIMES], np.r_[0, uptake]
+    expected = sum((t[i + 1] - t[i]) * (y[i + 1] + y[i]) / 2 for i in range(5))
+    assert trapezoid[0] == pytest.approx(expected)
+
+    hybrid = hybrid_integral(TIMES, values, rate=PARAMS[2])
+    np.testing.assert_allclose(hybrid, trapezoid + values[:, -1] / PARAMS[2])
+
+
+def test_tail_rate_never_slower_than_physical_decay():
+    # Rostouci nebo nekladne posledni body -> fyzikalni premena I-131
+    assert tail_rate([24, 48], [0.1, 0.2]) == pytest.approx(LAMBDA_I131)
+    assert tail_rate([24, 48], [0.1, 0.0]) == pytest.approx(LAMBDA_I131)
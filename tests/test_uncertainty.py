@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import app.uncertainty as uncertainty
+from app.functions import compute_dose
+from app.tasks import TaskCancelled
+from app.uncertainty import dose_uncertainty
+
+PARAMS = (0.05, 0.1, 0.005)
+COVAR = np.diag([0.002, 0.01, 0.0002]) ** 2
+
+
+def test_no_uncertainty_reproduces_compute_dose():
+    # Bez nejistot vstupu je interval jediny bod - davka z compute_dose
+    # (compute_dose zaokrouhluje mezivysledky, proto relativni tolerance)
+    vysledek = dose_uncertainty(
+        PARAMS,
+        np.zeros((3, 3)),
+        20.0,
+        550.0,
+        n_samples=1000,
+        rel_kalibrace=0,
+        rel_objem=0,
+        rel_pomer=0,
+    )
+    davka = compute_dose(PARAMS, [1, 144], 1, 20.0, 550.0)
+    assert vysledek["n_valid"] == 1000
+    assert vysledek["davka_low"] == pytest.approx(davka["absorbovana_davka"], rel=1e-3)
+    assert vysledek["davka_high"] == pytest.approx(vysledek["davka_low"])
+    assert vysledek["tiac_median"] == pytest.approx(davka["integral_riu"], rel=1e-3)
+
+
+def test_result_does_not_depend_on_number_of_processes(monkeypatch):
+    # Bloky maji vlastni SeedSequence - stejny seed, stejny vysledek v 1 i 2 procesech
+    monkeypatch.setattr(uncertainty, "CHUNK_SAMPLES", 5000)
+    monkeypatch.setattr(uncertainty, "PARALLEL_MIN_SAMPLES", 10000)
+    kwargs = dict(n_samples=12000, seed=7)
+    serial = dose_uncertainty(PARAMS, COVAR, 20.0, 550.0, workers=1, **kwargs)
+    parallel = dose_uncertainty(PARAMS, COVAR, 20.0, 550.0, workers=2, **kwargs)
+    assert serial == parallel
+    assert serial["davka_low"] < serial["davka_median"] < serial["davka_high"]
+
+
+def test_spect_ratio_absorbs_calibration_uncertainty():
+    # Pomer SPECT / planar uz kalibraci obsahuje - jeji nejistota se nepocita podruhe
+    kwargs = dict(pomer=1.3, n_samples=20000, seed=3, rel_objem=0.1, rel_pomer=0.05)
+    s_kalibraci = dose_uncertainty(
+        PARAMS, COVAR, 20.0, 550.0, rel_kalibrace=0.2, **kwargs
+    )
+    bez_kalibrace = dose_uncertainty(
+        PARAMS, COVAR, 20.0, 550.0, rel_kalibrace=0, **kwargs
+    )
+    assert s_kalibraci == bez_kalibrace
+
+    # Bez korekce SPECT (pomer 1) se nejistota kalibrace do intervalu promitne
+    kwargs["pomer"] = 1.0
+    planar = dose_uncertainty(PARAMS, COVAR, 20.0, 550.0, rel_kalibrace=0.2, **kwargs)
+    planar_0 = dose_uncertainty(PARAMS, COVAR, 20.0, 550.0, rel_kalibrace=0, **kwargs)
+    assert planar["davka_std"] > planar_0["davka_std"]
+
+
+def test_unphysical_samples_are_dropped():
+    # Vzorky se zapornou vylucovaci konstantou se do intervalu nezapocitaji
+    covar = np.diag([0.0, 0.0, 0.005]) ** 2
+    vysledek = dose_uncertainty(PARAMS, covar, 20.0, 550.0, n_samples=20000, seed=1)
+    assert 0 < vysledek["n_valid"] < 20000
+    assert vysledek["davka_low"] > 0
+
+
+def test_cancel_stops_parallel_sampling(monkeypatch):
+    # Zruseni po prvnim bloku vrati rizeni hned, zbyvajici bloky se nepocitaji
+    monkeypatch.setattr(uncertainty, "CHUNK_SAMPLES", 5000)
+    monkeypatch.setattr(uncertainty, "PARALLEL_MIN_SAMPLES", 10000)
+    volani = []
+
+    def progress(fraction):
+        volani.append(fraction)
+        raise TaskCancelled("cancelled")
+
+    with pytest.raises(TaskCancelled):
+        dose_uncertainty(
+            PARAMS, COVAR, 20.0, 550.0, n_samples=200000, workers=2, progress=progress
+        )
+    assert volani == [5000 / 200000]
+
+
+def test_default_sample_count_runs_in_process(monkeypatch):
+    # Bezny pocet vzorku se pocita bez startu procesu
+    def no_pool(*args, **kwargs):
+        raise AssertionError("process pool started")
+
+    monkeypatch.setattr(uncertainty, "ProcessPoolExecutor", no_pool)
+    vysledek = dose_uncertainty(PARAMS, COVAR, 20.0, 550.0, seed=3)
+    assert vysledek["n_valid"] > 0.9 * uncertainty.DEFAULT_SAMPLES